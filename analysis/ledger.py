@@ -0,0 +1,193 @@
+"""
+Library for remembering the returns already computed for each Reddit
+submission, so that re-running the comparison only has to compute returns
+for new submissions or ones whose price data has changed. The averages over
+every submission are kept as running sums that are adjusted as rows are
+added, replaced, or removed.
+"""
+import hashlib
+import json
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from analysis.risk import RISK_COLUMNS
+
+LEDGER_PATH = "analysis/results_ledger.csv"
+KEY = ["submission", "ticker", "period"]
+RESULT_COLUMNS = ["entry_date", "exit_date", "stock_roi", "spy_roi",
+                  "excess_return"]
+
+
+def submission_id(title, time):
+    """
+    Makes a short ID for a Reddit submission from when it was posted and its
+    title, since the filtered submissions CSV has no ID column.
+
+    Args:
+        title: A string of the title of the submission.
+        time: A string of when the submission was posted.
+
+    Returns:
+        A string of 16 hexadecimal characters.
+    """
+    return hashlib.sha1(f"{time}|{title}".encode()).hexdigest()[:16]
+
+
+class ResultsLedger:
+    """
+    A persistent table of returns keyed by (submission, ticker, period).
+
+    Attributes:
+        path: A string of the path of the ledger CSV file. The running sums
+        are saved next to it with a .json extension.
+        rows: A dataframe indexed by KEY with the columns date, the
+        RESULT_COLUMNS, the RISK_COLUMNS, fingerprint (of the ticker's and
+        the benchmark's prices inside the holding period when the row was
+        computed) and final
+        (True once the holding period had ended).
+        sums: A dictionary of the running count and sum of stock_roi and
+        spy_roi over the rows that have them.
+    """
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self.rows = pd.DataFrame(
+            columns=KEY + ["date"] + RESULT_COLUMNS + RISK_COLUMNS +
+            ["fingerprint", "final"]).set_index(KEY)
+        self.sums = {"stock_count": 0, "stock_sum": 0.0,
+                     "spy_count": 0, "spy_sum": 0.0}
+        if os.path.exists(path):
+            self.rows = pd.read_csv(path, dtype={"fingerprint": str},
+                                    keep_default_na=False,
+                                    na_values={column: [""] for column in
+                                               RESULT_COLUMNS + RISK_COLUMNS}
+                                    ).set_index(KEY)
+            # Ledgers saved before risk metrics were added don't have them
+            self.rows = self.rows.reindex(columns=self.rows.columns.union(
+                RISK_COLUMNS, sort=False))
+            if os.path.exists(self.sums_path):
+                with open(self.sums_path, "r") as file:
+                    self.sums = json.load(file)
+            else:
+                # The sums can always be rebuilt from the rows themselves
+                self._add_to_sums(self.rows, 1)
+
+    @property
+    def sums_path(self):
+        """
+        The path of the JSON file the running sums are saved in.
+        """
+        return os.path.splitext(self.path)[0] + ".json"
+
+    def _add_to_sums(self, rows, sign):
+        for column, prefix in [("stock_roi", "stock"), ("spy_roi", "spy")]:
+            values = pd.to_numeric(rows[column]).dropna()
+            self.sums[f"{prefix}_count"] += sign * int(len(values))
+            self.sums[f"{prefix}_sum"] += sign * float(values.sum())
+
+    def needs_update(self, jobs, fingerprints):
+        """
+        Finds the jobs whose returns have to be computed: ones missing from
+        the ledger, ones whose holding period had not ended when they were
+        computed, and ones whose ticker's or the benchmark's prices inside
+        the holding period have changed since.
+
+        Args:
+            jobs: A dataframe with the KEY columns and a date column.
+            fingerprints: A list of the current fingerprint of each job's
+            prices, in the same order, as given by window_fingerprints.
+
+        Returns:
+            A boolean NumPy array, True for each job that needs computing.
+        """
+        keys = pd.MultiIndex.from_frame(jobs[KEY])
+        known = keys.isin(self.rows.index)
+        needs_update = ~known
+        if known.any():
+            old = self.rows.loc[keys[known]]
+            changed = old["fingerprint"].to_numpy() != \
+                np.asarray(fingerprints, dtype=object)[known]
+            unfinished = ~old["final"].astype(bool).to_numpy()
+            needs_update[known] = changed | unfinished
+        return needs_update
+
+    def update(self, jobs, results, fingerprints, today=None):
+        """
+        Adds or replaces the rows for computed jobs and adjusts the running
+        sums to match.
+
+        Args:
+            jobs: A dataframe with the KEY columns and a date column.
+            results: The dataframe returned by compute_returns for the jobs,
+            in the same order, optionally with the RISK_COLUMNS of
+            compute_risk_metrics added. Missing risk metrics are left NaN.
+            fingerprints: A list of the fingerprint of the prices each job's
+            results were computed from, in the same order, as given by
+            window_fingerprints.
+            today: The datetime.date of the run. Defaults to today.
+        """
+        today = today or date.today()
+        new_rows = jobs[KEY + ["date"]].reset_index(drop=True)
+        results = results.reindex(columns=RESULT_COLUMNS + RISK_COLUMNS)
+        for column in RESULT_COLUMNS + RISK_COLUMNS:
+            new_rows[column] = results[column].to_numpy()
+        new_rows["fingerprint"] = list(fingerprints)
+        # Bars for a day can still change until the day after it
+        end_days = pd.to_datetime(new_rows["date"]) + \
+            pd.to_timedelta(new_rows["period"], unit="D")
+        new_rows["final"] = end_days.dt.date < today - timedelta(days=1)
+        new_rows = new_rows.set_index(KEY)
+
+        replaced = new_rows.index.intersection(self.rows.index)
+        self._add_to_sums(self.rows.loc[replaced], -1)
+        self._add_to_sums(new_rows, 1)
+        self.rows = pd.concat([self.rows.drop(replaced), new_rows])
+
+    def keep_only(self, jobs):
+        """
+        Removes the rows of submissions that are no longer in the jobs, for
+        example because the submissions CSV was regenerated.
+
+        Args:
+            jobs: A dataframe with the KEY columns of every current job.
+        """
+        removed = self.rows.index.difference(
+            pd.MultiIndex.from_frame(jobs[KEY]))
+        self._add_to_sums(self.rows.loc[removed], -1)
+        self.rows = self.rows.drop(removed)
+
+    def averages(self):
+        """
+        Gets the average stock and SPY return over every row in the ledger.
+
+        Returns:
+            A tuple of the average stock_roi and spy_roi, which are NaN if
+            there are no rows with returns.
+        """
+        averages = []
+        for prefix in ["stock", "spy"]:
+            count = self.sums[f"{prefix}_count"]
+            averages.append(self.sums[f"{prefix}_sum"] / count if count
+                            else np.nan)
+        return tuple(averages)
+
+    def risk_averages(self):
+        """
+        Gets the average of each risk metric over the rows that have it.
+
+        Returns:
+            A dictionary mapping each name in RISK_COLUMNS to its average,
+            which is NaN if no row has that metric.
+        """
+        return {column: float(pd.to_numeric(self.rows[column]).mean())
+                for column in RISK_COLUMNS}
+
+    def save(self):
+        """
+        Writes the ledger and its running sums to disk.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.rows.sort_index().to_csv(self.path)
+        with open(self.sums_path, "w") as file:
+            json.dump(self.sums, file)
@@ -0,0 +1,186 @@
+"""
+Library for computing the return of many (ticker, start date, holding period)
+investments at once. Each price series is loaded a single time and every
+entry and exit bar is found with a binary search, so the returns of all
+Reddit submissions and of SPY over the same periods come out of one pass
+over NumPy arrays.
+"""
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from stock_info.bar_cache import BarCache
+from stock_info.price_panel import read_bars
+
+# Our S&P 500 ETF and baseline
+BENCHMARK = "SPY"
+
+
+def load_close_series(ticker, cache=None, panel=None,
+                      data_dir="stock_info/data"):
+    """
+    Loads the daily closing prices of a stock as NumPy arrays. Bars are read
+    from the bar cache, falling back to the price panel or the CSV written by
+    get_stock_info.
+
+    Args:
+        ticker: A string of the ticker symbol.
+        cache: The BarCache to read from. Defaults to the standard cache
+        folder.
+        panel: The PricePanel to read from. Defaults to the panel in the
+        standard panel folder, if one has been built.
+        data_dir: A string of the folder holding {ticker}data.csv files.
+
+    Returns:
+        A tuple (days, closes) where days is a sorted int64 array of the
+        number of days since January 1, 1970 of each bar and closes is a
+        float64 array of the matching closing prices. Both are empty if no
+        data is stored for the ticker.
+    """
+    bars = (cache or BarCache()).read(ticker)
+    path = os.path.join(data_dir, f"{ticker}data.csv")
+    if bars is None and (os.path.exists(path) or
+                         (panel is not None and ticker in panel)):
+        bars = read_bars(ticker, panel, data_dir)
+    if bars is None or bars.empty:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+    bars = bars.sort_index()
+    days = bars.index.values.astype("datetime64[D]").astype(np.int64)
+    return days, bars["close"].to_numpy(dtype=np.float64)
+
+
+def window_fingerprints(jobs, load_series=load_close_series,
+                        benchmark=BENCHMARK):
+    """
+    Gets a fingerprint of the prices each job's results are computed from:
+    the ticker's and the benchmark's bars from the last one before the
+    window, whose close is carried into it, to the last one inside it. Bars
+    outside the window, like ones added by a later download, leave it
+    unchanged.
+
+    Args:
+        jobs: A list of (ticker, start_date, time_period) tuples, as passed
+        to compute_returns.
+        load_series: A function that takes a ticker symbol and returns the
+        (days, closes) arrays of load_close_series.
+        benchmark: A string of the ticker every job is compared against.
+
+    Returns:
+        A list of a string of 16 hexadecimal characters for each job.
+    """
+    series = {benchmark: load_series(benchmark)}
+    fingerprints = []
+    for ticker, start_date, time_period in jobs:
+        if ticker not in series:
+            series[ticker] = load_series(ticker)
+        start_day = np.datetime64(start_date[:10], "D").astype(np.int64)
+        digest = hashlib.sha1()
+        for days, closes in [series[ticker], series[benchmark]]:
+            first = max(np.searchsorted(days, start_day, side="left") - 1, 0)
+            last = np.searchsorted(days, start_day + time_period,
+                                   side="right")
+            digest.update(days[first:last].tobytes())
+            digest.update(closes[first:last].tobytes())
+            digest.update(b"|")
+        fingerprints.append(digest.hexdigest()[:16])
+    return fingerprints
+
+
+def series_returns(days, closes, start_days, end_days):
+    """
+    Finds the percent return of one price series over many date windows.
+    The entry price is the close of the first bar on or after the start day
+    and the exit price is the close of the last bar on or before the end day.
+
+    Args:
+        days: A sorted int64 array of the epoch day of each bar.
+        closes: A float64 array of the close of each bar.
+        start_days: An int64 array of the epoch day each window starts on.
+        end_days: An int64 array of the epoch day each window ends on.
+
+    Returns:
+        A tuple (roi, entry_days, exit_days) of arrays the same length as
+        start_days. Windows without any bars have a roi of NaN and entry and
+        exit days of -1.
+    """
+    entry = np.searchsorted(days, start_days, side="left")
+    exit_ = np.searchsorted(days, end_days, side="right") - 1
+    has_data = (entry <= exit_) & (entry < len(days))
+
+    roi = np.full(len(start_days), np.nan)
+    entry_days = np.full(len(start_days), -1, dtype=np.int64)
+    exit_days = np.full(len(start_days), -1, dtype=np.int64)
+    entry, exit_ = entry[has_data], exit_[has_data]
+    roi[has_data] = (closes[exit_] - closes[entry]) / closes[entry] * 100
+    entry_days[has_data] = days[entry]
+    exit_days[has_data] = days[exit_]
+    return roi, entry_days, exit_days
+
+
+def epoch_days_to_dates(epoch_days):
+    """
+    Converts epoch days to dates, leaving missing days (-1) empty.
+
+    Args:
+        epoch_days: An int64 array of the number of days since January 1,
+        1970, where -1 marks a missing day.
+
+    Returns:
+        A pandas series of datetime64 values with NaT for missing days.
+    """
+    dates = pd.Series(epoch_days.astype("datetime64[D]"))
+    return dates.where(epoch_days >= 0)
+
+
+def compute_returns(jobs, load_series=load_close_series,
+                    benchmark=BENCHMARK):
+    """
+    Computes the return of every job and of the benchmark over the same
+    window, plus how much the job beat the benchmark by.
+
+    Args:
+        jobs: A list of (ticker, start_date, time_period) tuples, where
+        start_date is a string in the format YYYY-MM-DD and time_period is an
+        integer number of days, as passed to get_stock_info.
+        load_series: A function that takes a ticker symbol and returns the
+        (days, closes) arrays of load_close_series.
+        benchmark: A string of the ticker to compare every job against.
+
+    Returns:
+        A dataframe with one row per job and the columns ticker, date,
+        period, entry_date, exit_date, stock_roi, spy_roi and excess_return.
+        Returns are percentages and are NaN where there was no price data.
+    """
+    tickers = np.array([job[0] for job in jobs], dtype=object)
+    start_days = np.array([job[1][:10] for job in jobs],
+                          dtype="datetime64[D]").astype(np.int64)
+    periods = np.array([job[2] for job in jobs], dtype=np.int64)
+    end_days = start_days + periods
+
+    stock_roi = np.full(len(jobs), np.nan)
+    entry_days = np.full(len(jobs), -1, dtype=np.int64)
+    exit_days = np.full(len(jobs), -1, dtype=np.int64)
+    # Group the rows by ticker so each series is only loaded once
+    codes, unique_tickers = pd.factorize(tickers)
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+    for rows in groups:
+        if not len(rows):
+            continue
+        days, closes = load_series(unique_tickers[codes[rows[0]]])
+        stock_roi[rows], entry_days[rows], exit_days[rows] = series_returns(
+            days, closes, start_days[rows], end_days[rows])
+
+    spy_days, spy_closes = load_series(benchmark)
+    spy_roi = series_returns(spy_days, spy_closes, start_days, end_days)[0]
+
+    return pd.DataFrame({
+        "ticker": tickers,
+        "date": start_days.astype("datetime64[D]"),
+        "period": periods,
+        "entry_date": epoch_days_to_dates(entry_days),
+        "exit_date": epoch_days_to_dates(exit_days),
+        "stock_roi": stock_roi,
+        "spy_roi": spy_roi,
+        "excess_return": stock_roi - spy_roi,
+    })
@@ -0,0 +1,243 @@
+"""
+Library for measuring the risk of many (ticker, start date, holding period)
+investments at once. Each price series is turned into running sums of its
+daily returns once, so the volatility, Sharpe and Sortino ratios, and beta
+and correlation to SPY of any window come from a few subtractions. Maximum
+drawdowns come from a segment tree over the prices that answers every
+window's query together, level by level, instead of scanning each window.
+"""
+import numpy as np
+import pandas as pd
+from analysis.returns import BENCHMARK, load_close_series
+
+TRADING_DAYS = 252
+RISK_COLUMNS = ["volatility", "sharpe", "sortino", "max_drawdown", "beta",
+                "correlation"]
+
+
+def _prefix_sums(values):
+    # A leading zero makes the sum over [a, b) equal sums[b] - sums[a]
+    return np.concatenate([[0.0], np.cumsum(values)])
+
+
+def _combine(left, right):
+    # Each node holds the highest and lowest log price in its range and the
+    # largest fall from a high to a later low
+    left_max, left_min, left_drop = left
+    right_max, right_min, right_drop = right
+    return (np.maximum(left_max, right_max), np.minimum(left_min, right_min),
+            np.maximum(np.maximum(left_drop, right_drop),
+                       left_max - right_min))
+
+
+def range_max_drawdowns(closes, first, last):
+    """
+    Finds the largest peak to trough fall of a price series within many
+    ranges of bars at once.
+
+    Args:
+        closes: A float64 array of positive prices.
+        first: An int64 array of the index of the first bar of each range.
+        last: An int64 array of the index of the last bar of each range.
+
+    Returns:
+        A float64 array of the maximum drawdown of each range as a positive
+        percentage, which is 0 for ranges that never fall.
+    """
+    size = 1
+    while size < len(closes):
+        size *= 2
+    log_closes = np.log(closes)
+    # One empty node past the end, since a range ending on the last bar of a
+    # full tree starts its walk at index 2 * size
+    highs = np.full(2 * size + 1, -np.inf)
+    lows = np.full(2 * size + 1, np.inf)
+    drops = np.zeros(2 * size + 1)
+    highs[size:size + len(closes)] = log_closes
+    lows[size:size + len(closes)] = log_closes
+    level = size // 2
+    while level >= 1:
+        nodes = np.arange(level, 2 * level)
+        highs[nodes], lows[nodes], drops[nodes] = _combine(
+            (highs[2 * nodes], lows[2 * nodes], drops[2 * nodes]),
+            (highs[2 * nodes + 1], lows[2 * nodes + 1],
+             drops[2 * nodes + 1]))
+        level //= 2
+
+    # Walk every query up the tree together, folding in the nodes at its
+    # left and right edges in order
+    count = len(first)
+    left = (np.full(count, -np.inf), np.full(count, np.inf), np.zeros(count))
+    right = (np.full(count, -np.inf), np.full(count, np.inf),
+             np.zeros(count))
+    low_index = np.asarray(first, dtype=np.int64) + size
+    high_index = np.asarray(last, dtype=np.int64) + 1 + size
+    while np.any(low_index < high_index):
+        active = low_index < high_index
+        take_left = active & (low_index % 2 == 1)
+        node = (highs[low_index], lows[low_index], drops[low_index])
+        combined = _combine(left, node)
+        left = tuple(np.where(take_left, new, old)
+                     for new, old in zip(combined, left))
+        low_index = low_index + take_left
+
+        take_right = active & (high_index % 2 == 1)
+        high_index = high_index - take_right
+        node = (highs[high_index], lows[high_index], drops[high_index])
+        combined = _combine(node, right)
+        right = tuple(np.where(take_right, new, old)
+                      for new, old in zip(combined, right))
+
+        low_index = np.where(active, low_index // 2, low_index)
+        high_index = np.where(active, high_index // 2, high_index)
+    drop = _combine(left, right)[2]
+    return (1 - np.exp(-drop)) * 100
+
+
+def series_risk(days, closes, bench_days, bench_closes, start_days, end_days,
+                risk_free_rate=0.0):
+    """
+    Measures the risk of one price series over many date windows. The window
+    runs from the first bar on or after the start day to the last bar on or
+    before the end day, like series_returns.
+
+    Args:
+        days: A sorted int64 array of the epoch day of each bar.
+        closes: A float64 array of the close of each bar.
+        bench_days: A sorted int64 array of the epoch day of each benchmark
+        bar.
+        bench_closes: A float64 array of the close of each benchmark bar.
+        start_days: An int64 array of the epoch day each window starts on.
+        end_days: An int64 array of the epoch day each window ends on.
+        risk_free_rate: A float of the yearly risk free rate, such as 0.02.
+
+    Returns:
+        A dictionary mapping each name in RISK_COLUMNS, plus trading_days, to
+        an array with a value per window. Volatility is the yearly standard
+        deviation of daily returns and max_drawdown the largest fall, both as
+        percentages. Values are NaN where a window has too few bars.
+    """
+    count = len(start_days)
+    metrics = {name: np.full(count, np.nan) for name in RISK_COLUMNS}
+    metrics["trading_days"] = np.zeros(count, dtype=np.int64)
+    if len(days) < 2:
+        return metrics
+
+    # Daily return i is from bar i - 1 to bar i, so a window of bars
+    # [first, last] holds returns first + 1 through last
+    daily = np.diff(closes) / closes[:-1]
+    excess = daily - risk_free_rate / TRADING_DAYS
+    first = np.searchsorted(days, start_days, side="left")
+    last = np.searchsorted(days, end_days, side="right") - 1
+    ok = (last - first >= 2) & (first < len(days))
+    first, last = first[ok], last[ok]
+    samples = (last - first).astype(np.float64)
+
+    sums = _prefix_sums(daily)
+    squares = _prefix_sums(daily ** 2)
+    excess_sums = _prefix_sums(excess)
+    downside = _prefix_sums(np.minimum(excess, 0) ** 2)
+    mean = (sums[last] - sums[first]) / samples
+    variance = np.maximum(
+        (squares[last] - squares[first] - samples * mean ** 2) /
+        (samples - 1), 0)
+    deviation = np.sqrt(variance)
+    mean_excess = (excess_sums[last] - excess_sums[first]) / samples
+    downside_deviation = np.sqrt((downside[last] - downside[first]) /
+                                 samples)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics["volatility"][ok] = deviation * np.sqrt(TRADING_DAYS) * 100
+        metrics["sharpe"][ok] = np.where(
+            deviation > 0, mean_excess / deviation, np.nan) * \
+            np.sqrt(TRADING_DAYS)
+        metrics["sortino"][ok] = np.where(
+            downside_deviation > 0, mean_excess / downside_deviation,
+            np.nan) * np.sqrt(TRADING_DAYS)
+        metrics["max_drawdown"][ok] = range_max_drawdowns(closes, first,
+                                                          last)
+        metrics["trading_days"][ok] = last - first + 1
+
+        # The benchmark's return over the same pairs of days, using its last
+        # close on or before each day
+        bench_index = np.searchsorted(bench_days, days, side="right") - 1
+        has_bench = bench_index >= 0
+        bench_at = np.where(has_bench,
+                            bench_closes[np.maximum(bench_index, 0)]
+                            if len(bench_closes) else np.nan, np.nan)
+        bench_daily = np.diff(bench_at) / bench_at[:-1]
+        paired = ~np.isnan(bench_daily)
+        stock = np.where(paired, daily, 0)
+        bench = np.where(paired, bench_daily, 0)
+        pairs = _prefix_sums(paired)
+        pair_count = pairs[last] - pairs[first]
+        stock_sum = _prefix_sums(stock)
+        bench_sum = _prefix_sums(bench)
+        cross = _prefix_sums(stock * bench)
+        bench_squares = _prefix_sums(bench ** 2)
+        stock_squares = _prefix_sums(stock ** 2)
+        window_stock = stock_sum[last] - stock_sum[first]
+        window_bench = bench_sum[last] - bench_sum[first]
+        covariance = (cross[last] - cross[first] -
+                      window_stock * window_bench / pair_count)
+        bench_variance = (bench_squares[last] - bench_squares[first] -
+                          window_bench ** 2 / pair_count)
+        stock_variance = (stock_squares[last] - stock_squares[first] -
+                          window_stock ** 2 / pair_count)
+        enough = (pair_count >= 2) & (bench_variance > 0)
+        metrics["beta"][ok] = np.where(enough, covariance / bench_variance,
+                                       np.nan)
+        metrics["correlation"][ok] = np.where(
+            enough & (stock_variance > 0),
+            covariance / np.sqrt(bench_variance * stock_variance), np.nan)
+    return metrics
+
+
+def compute_risk_metrics(jobs, load_series=load_close_series,
+                         benchmark=BENCHMARK, risk_free_rate=0.0):
+    """
+    Measures the risk of every job over its window, and how closely it moved
+    with the benchmark.
+
+    Args:
+        jobs: A list of (ticker, start_date, time_period) tuples, in the same
+        format as for compute_returns.
+        load_series: A function that takes a ticker symbol and returns the
+        (days, closes) arrays of load_close_series.
+        benchmark: A string of the ticker to find beta and correlation to.
+        risk_free_rate: A float of the yearly risk free rate, such as 0.02.
+
+    Returns:
+        A dataframe with one row per job and the columns ticker, date,
+        period, trading_days, and RISK_COLUMNS.
+    """
+    tickers = np.array([job[0] for job in jobs], dtype=object)
+    start_days = np.array([job[1][:10] for job in jobs],
+                          dtype="datetime64[D]").astype(np.int64)
+    periods = np.array([job[2] for job in jobs], dtype=np.int64)
+    end_days = start_days + periods
+
+    bench_days, bench_closes = load_series(benchmark)
+    metrics = {name: np.full(len(jobs), np.nan) for name in RISK_COLUMNS}
+    metrics["trading_days"] = np.zeros(len(jobs), dtype=np.int64)
+    # Group the rows by ticker so each series is only loaded once
+    codes, unique_tickers = pd.factorize(tickers)
+    order = np.argsort(codes, kind="stable")
+    groups = np.split(order, np.flatnonzero(np.diff(codes[order])) + 1)
+    for rows in groups:
+        if not len(rows):
+            continue
+        days, closes = load_series(unique_tickers[codes[rows[0]]])
+        window_metrics = series_risk(days, closes, bench_days, bench_closes,
+                                     start_days[rows], end_days[rows],
+                                     risk_free_rate)
+        for name, values in window_metrics.items():
+            metrics[name][rows] = values
+
+    return pd.DataFrame({
+        "ticker": tickers,
+        "date": start_days.astype("datetime64[D]"),
+        "period": periods,
+        "trading_days": metrics["trading_days"],
+        **{name: metrics[name] for name in RISK_COLUMNS},
+    })
@@ -0,0 +1,268 @@
+"""
+Library for backtesting the Reddit recommendations over a grid of holding
+periods, entry delays, and submission filters at once. Tickers are split
+into shards that a pool of worker processes works through, each reading
+prices from the same memory-mapped price panel, and every worker only sends
+back running sums per grid cell, so the results for tens of thousands of
+cells come back as one small table. Prices come from the bar cache, which
+keeps every range ever downloaded, and the longest window in the grid is
+downloaded before the sweep starts.
+
+Run from the top of the repository to sweep every holding period up to two
+years:
+    python -m analysis.sweep
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from analysis.returns import BENCHMARK, series_returns
+from reddit.pmaw_api import remove_dupes
+from reddit.submission_store import build_store
+from stock_info.price_panel import build_panel, load_panel
+from stock_info.pull_stock_info import get_bar_cache, get_stock_info_batch
+from symbol_registry import load_snp500
+
+
+def _mentioned_in_title(rows):
+    return np.array([f"${ticker}" in title for ticker, title in
+                     zip(rows["ticker"], rows["title"])], dtype=bool)
+
+
+def _in_snp500(rows):
+    snp_tickers = load_snp500()
+    return np.array([ticker in snp_tickers for ticker in rows["ticker"]],
+                    dtype=bool)
+
+
+# Ways of choosing which recommendations to invest in. Each takes the
+# dataframe made by recommendation_rows and returns a boolean array that is
+# True for the rows to keep.
+FILTERS = {
+    "all": lambda rows: np.ones(len(rows), dtype=bool),
+    "title": _mentioned_in_title,
+    "single_ticker": lambda rows: rows["post_tickers"].to_numpy() == 1,
+    "snp500": _in_snp500,
+    "not_snp500": lambda rows: ~_in_snp500(rows),
+}
+
+# The sums kept for each grid cell, in the order workers return them
+SUMS = ["count", "stock_sum", "spy_sum", "excess_sum", "excess_squares",
+        "wins", "dropped"]
+
+# Each worker process keeps the panel and grid between shards
+_PANEL = None
+_GRID = None
+
+
+def recommendation_rows(submissions):
+    """
+    Splits Reddit submissions into one row per recommended ticker.
+
+    Args:
+        submissions: A dataframe of submissions with title, time, and
+        tickers columns, as loaded by SubmissionStore.frame.
+
+    Returns:
+        A dataframe with the columns title, ticker, post_day (the epoch day
+        the submission was posted), and post_tickers (how many tickers the
+        submission recommended).
+    """
+    rows = []
+    for submission in submissions.itertuples():
+        tickers = remove_dupes(submission.tickers)
+        post_day = np.datetime64(submission.time, "D").astype(np.int64)
+        for ticker in tickers:
+            rows.append((str(submission.title), ticker, post_day,
+                         len(tickers)))
+    return pd.DataFrame(rows, columns=["title", "ticker", "post_day",
+                                       "post_tickers"])
+
+
+def _init_worker(panel_dir, hold_days, entry_delays, max_exit_gap):
+    global _PANEL, _GRID
+    _PANEL = load_panel(panel_dir)
+    _GRID = (hold_days, entry_delays, max_exit_gap)
+
+
+def _window_returns(ticker, start_days, end_days, max_exit_gap):
+    # Returns are NaN where the ticker has no bars in the window, or its bars
+    # stop more than max_exit_gap days before the window ends
+    if _PANEL is None or ticker not in _PANEL:
+        return np.full(start_days.shape, np.nan)
+    days, closes = _PANEL.series(ticker)
+    roi, _, exit_days = series_returns(days, closes, start_days.ravel(),
+                                       end_days.ravel())
+    if max_exit_gap is not None:
+        roi[end_days.ravel() - exit_days > max_exit_gap] = np.nan
+    return roi.reshape(start_days.shape)
+
+
+def sweep_shard(shard):
+    """
+    Adds up the returns of one shard of tickers over every grid cell. Must
+    run in a process set up by _init_worker.
+
+    Args:
+        shard: A list of (ticker, post_days, masks) tuples, where post_days
+        is an int64 array of the days the ticker was recommended and masks is
+        a boolean array with a row per recommendation and a column per
+        filter.
+
+    Returns:
+        A float64 array with a row per name in SUMS, then a row per filter
+        and a column per (holding period, entry delay) pair.
+    """
+    hold_days, entry_delays, max_exit_gap = _GRID
+    totals = None
+    for ticker, post_days, masks in shard:
+        start_days = post_days[:, None] + entry_delays[None, :]
+        end_days = start_days + hold_days[None, :]
+        stock_roi = _window_returns(ticker, start_days, end_days,
+                                    max_exit_gap)
+        spy_roi = _window_returns(BENCHMARK, start_days, end_days,
+                                  max_exit_gap)
+        excess = stock_roi - spy_roi
+        valid = ~np.isnan(excess)
+
+        # One matrix product per sum adds up the rows each filter keeps
+        weights = masks.T.astype(np.float64)
+        sums = np.stack([
+            weights @ valid,
+            weights @ np.where(valid, stock_roi, 0),
+            weights @ np.where(valid, spy_roi, 0),
+            weights @ np.where(valid, excess, 0),
+            weights @ np.where(valid, excess ** 2, 0),
+            weights @ (valid & (excess > 0)),
+            weights @ ~valid,
+        ])
+        totals = sums if totals is None else totals + sums
+    return totals
+
+
+def download_windows(rows, hold_days, entry_delays, cache=None, api=None):
+    """
+    Downloads the bars of every recommended ticker, and of SPY, from its
+    post to the end of its longest window in the grid.
+
+    Args:
+        rows: The dataframe made by recommendation_rows.
+        hold_days: A list of the integer numbers of days to hold each stock.
+        entry_delays: A list of the integer numbers of days after the post to
+        buy each stock.
+        cache: The BarCache to add to. Defaults to the global bar cache.
+        api: The Alpaca REST client to download with. Defaults to the shared
+        Alpaca client.
+    """
+    if not len(rows):
+        return
+    period = int(max(hold_days)) + max(0, int(max(entry_delays)))
+    post_days = rows["post_day"].to_numpy().astype("datetime64[D]")
+    jobs = [(ticker, str(day), period) for ticker, day in
+            zip(rows["ticker"], post_days)]
+    jobs += [(BENCHMARK, str(day), period) for day in np.unique(post_days)]
+    get_stock_info_batch(jobs, api, cache)
+
+
+def run_sweep(submissions, hold_days, entry_delays=(0,), filters=("all",),
+              max_exit_gap=7, cache=None, panel_dir=None, workers=None,
+              api=None, download=True):
+    """
+    Backtests investing in every recommended stock over a grid of holding
+    periods, entry delays, and submission filters, comparing each investment
+    to holding SPY over the same window.
+
+    Args:
+        submissions: A dataframe of submissions with title, time, and
+        tickers columns, as loaded by SubmissionStore.frame.
+        hold_days: A list of the integer numbers of days to hold each stock.
+        entry_delays: A list of the integer numbers of days after the post to
+        buy each stock.
+        filters: A list of names of FILTERS choosing which recommendations
+        to invest in.
+        max_exit_gap: The integer number of days a price series may end
+        before the end of a window for the window to still count, so windows
+        beyond the stored data are dropped. None counts every window.
+        cache: The BarCache to read prices from and download into. Defaults
+        to the global bar cache.
+        panel_dir: A string of the folder of the price panel, which is
+        brought up to date with the cache before the sweep starts. Defaults
+        to a panel folder inside the cache folder.
+        workers: An integer of the number of worker processes. Defaults to
+        the number of CPUs.
+        api: The Alpaca REST client to download missing bars with. Defaults
+        to the shared Alpaca client.
+        download: If False, only sweep the bars already in the cache.
+
+    Returns:
+        A dataframe with one row per grid cell and the columns filter,
+        hold_days, entry_delay, count (of recommendations with returns),
+        dropped (the recommendations left out for lack of prices),
+        mean_stock_roi, mean_spy_roi, mean_excess_return, std_excess_return,
+        and hit_rate (the fraction that beat SPY). Means are NaN for cells
+        without any returns.
+    """
+    cache = cache or get_bar_cache()
+    panel_dir = panel_dir or os.path.join(cache.cache_dir, "panel")
+    rows = recommendation_rows(submissions)
+    if download:
+        download_windows(rows, hold_days, entry_delays, cache, api)
+    build_panel(panel_dir=panel_dir, paths={
+        ticker: cache.bars_path(ticker) for ticker in cache.ranges
+        if os.path.exists(cache.bars_path(ticker))})
+    masks = np.column_stack([FILTERS[name](rows) for name in filters]) \
+        if len(rows) else np.zeros((0, len(filters)), dtype=bool)
+
+    # Every (holding period, entry delay) pair, flattened into columns
+    cell_holds, cell_delays = (grid.ravel() for grid in np.meshgrid(
+        np.asarray(hold_days, dtype=np.int64),
+        np.asarray(entry_delays, dtype=np.int64), indexing="ij"))
+
+    recommendations = [
+        (ticker, rows["post_day"].to_numpy()[group],
+         masks[group]) for ticker, group in
+        rows.groupby("ticker", sort=True).indices.items()]
+    workers = workers or os.cpu_count() or 1
+    # A few shards per worker balances the load without much overhead
+    num_shards = max(1, min(len(recommendations), 4 * workers))
+    shards = [recommendations[start::num_shards]
+              for start in range(num_shards)]
+
+    totals = np.zeros((len(SUMS), len(filters), len(cell_holds)))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(panel_dir, cell_holds, cell_delays,
+                                       max_exit_gap)) as executor:
+        for sums in executor.map(sweep_shard, shards):
+            if sums is not None:
+                totals += sums
+
+    sums = dict(zip(SUMS, (total.ravel() for total in totals)))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_excess = sums["excess_sum"] / sums["count"]
+        results = pd.DataFrame({
+            "filter": np.repeat(list(filters), len(cell_holds)),
+            "hold_days": np.tile(cell_holds, len(filters)),
+            "entry_delay": np.tile(cell_delays, len(filters)),
+            "count": sums["count"].astype(np.int64),
+            "dropped": sums["dropped"].astype(np.int64),
+            "mean_stock_roi": sums["stock_sum"] / sums["count"],
+            "mean_spy_roi": sums["spy_sum"] / sums["count"],
+            "mean_excess_return": mean_excess,
+            "std_excess_return": np.sqrt(np.maximum(
+                sums["excess_squares"] / sums["count"] - mean_excess ** 2,
+                0)),
+            "hit_rate": sums["wins"] / sums["count"],
+        })
+    return results
+
+
+if __name__ == "__main__":
+    results = run_sweep(build_store().frame(["title", "time", "tickers"]),
+                        hold_days=range(1, 731), entry_delays=[0, 1, 5, 20],
+                        filters=list(FILTERS))
+    print(results.sort_values("mean_excess_return", ascending=False)
+          .head(20).to_string(index=False))
+    everything = results[results["filter"] == "all"]
+    print(f"Dropped {everything['dropped'].sum()} of "
+          f"{(everything['count'] + everything['dropped']).sum()} windows "
+          f"without enough prices")
@@ -0,0 +1,309 @@
+"""
+Library for creating the Alpaca and Pushshift clients the first time they
+are needed instead of when a module is imported, so that offline analysis
+and tests never read credentials or open connections. Each client is made
+once and shared, and the Alpaca client keeps a pool of open connections.
+
+The backend that makes the clients is chosen with set_backend or the
+API_BACKEND environment variable:
+    real: the real Alpaca and Pushshift clients (the default).
+    offline: clients that raise OfflineError on any request, so only data
+    that is already cached can be used.
+    fake: clients serving made-up data, for trying the pipeline without
+    credentials.
+    record: the real clients, saving every response to REPLAY_DIR.
+    replay: clients answering from the responses saved by record, raising
+    OfflineError for requests that were never recorded.
+"""
+import collections.abc
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from instrumentation import count, span
+from rate_limiter import backoff_delay, get_limiter
+
+CREDENTIALS_PATH = "stock_info/alpaca_credentials.json"
+ALPACA_BASE_URL = "https://paper-API.alpaca.markets"
+REPLAY_DIR = "api_replay"
+
+# The most connections kept open to the Alpaca API at once
+POOL_SIZE = 10
+
+
+class OfflineError(RuntimeError):
+    """
+    Raised when a request would have to go over the network but the backend
+    does not allow it.
+    """
+
+
+def make_alpaca_client():
+    """
+    Loads the Alpaca credentials and creates the Alpaca client used to make
+    the API requests. Will error if the user does not have Alpaca credentials.
+
+    Returns:
+        An alpaca_trade_api REST client whose connections are pooled.
+    """
+    import alpaca_trade_api as tradeapi
+    import requests.adapters
+    with open(CREDENTIALS_PATH, "r") as file:
+        creds = json.load(file)
+
+    api = tradeapi.REST(creds['CLIENT_ID'], creds['CLIENT_SECRET'],
+                        ALPACA_BASE_URL, api_version='v2')
+    # Retries are left to call_with_backoff, which knows the rate limits
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                            pool_maxsize=POOL_SIZE)
+    api._session.mount("https://", adapter)
+    return api
+
+
+def make_pushshift_client():
+    """
+    Creates the PMAW Pushshift client. pmaw splits every search into many
+    HTTP requests made from several threads, so each of those requests waits
+    for the shared Pushshift rate limiter in place of pmaw's own. pmaw still
+    retries failed requests itself, waiting longer after each failed batch.
+
+    Returns:
+        A pmaw PushshiftAPI client.
+    """
+    from pmaw import PushshiftAPI
+
+    class LimitedPushshiftAPI(PushshiftAPI):
+        def _impose_rate_limit(self):
+            # Called by pmaw before every HTTP request it makes
+            attempts = self._rate_limit.attempts
+            if attempts:
+                time.sleep(backoff_delay(attempts - 1))
+            with span("pushshift.wait"):
+                get_limiter("pushshift").acquire()
+            count("api_calls.pushshift")
+
+    return LimitedPushshiftAPI()
+
+
+class OfflineClient:
+    """
+    A client that raises OfflineError whenever it is used to make a request.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, method):
+        def request(*args, **kwargs):
+            raise OfflineError(f"{self.name}.{method} needs the network, "
+                               f"but the API backend is offline")
+        return request
+
+
+# The seconds between bars of each size FakeAlpaca can serve during the
+# day, which runs from 14:30 to 21:00 UTC
+FAKE_BAR_SECONDS = {"1Min": 60, "5Min": 5 * 60, "15Min": 15 * 60,
+                    "1Hour": 60 * 60}
+
+
+class FakeAlpaca:
+    """
+    A stand-in for the Alpaca REST client that serves made-up bars for every
+    symbol on every weekday from the multi-symbol bars endpoint: one bar a
+    day for the 1Day timeframe, or bars through the trading day for the
+    sizes in FAKE_BAR_SECONDS. Symbols in invalid never have any bars.
+    """
+
+    def __init__(self, seed=0, invalid=()):
+        self.seed = seed
+        self.invalid = set(invalid)
+        self.requests = 0
+
+    def data_get(self, path, data=None, api_version="v1"):
+        """
+        Returns one page of fake bars in the format of the Alpaca API.
+        """
+        self.requests += 1
+        start = datetime.date.fromisoformat(data["start"][:10])
+        end = datetime.date.fromisoformat(data["end"][:10])
+        days = [start + datetime.timedelta(days=offset)
+                for offset in range((end - start).days + 1)]
+        step = FAKE_BAR_SECONDS.get(data.get("timeframe"))
+        times = ["05:00:00"] if step is None else [
+            f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:00"
+            for seconds in range(14 * 3600 + 1800, 21 * 3600, step)]
+        rows = [(symbol, f"{day.isoformat()}T{time}") for symbol in
+                data["symbols"].split(",") if symbol not in self.invalid
+                for day in days if day.weekday() < 5 for time in times]
+        first = int(data.get("page_token") or 0)
+        limit = int(data.get("limit") or 10000)
+        page = rows[first:first + limit]
+
+        bars = {}
+        for symbol, moment in page:
+            seed = f"{self.seed}{symbol}{moment}" if step else \
+                f"{self.seed}{symbol}{moment[:10]}"
+            rng = random.Random(seed)
+            close = 100 + rng.uniform(-50, 50)
+            bars.setdefault(symbol, []).append(
+                {"t": f"{moment}Z", "o": close, "h": close + 1,
+                 "l": close - 1, "c": close, "v": 1000, "n": 10,
+                 "vw": close})
+        next_token = None
+        if first + limit < len(rows):
+            next_token = str(first + limit)
+        return {"bars": bars, "next_page_token": next_token}
+
+
+class FakePushshift:
+    """
+    A stand-in for the PMAW Pushshift client that serves a list of posts.
+    """
+
+    def __init__(self, posts=()):
+        self.posts = list(posts)
+
+    def search_submissions(self, subreddit=None, limit=None, before=None,
+                           after=None, **kwargs):
+        """
+        Returns the posts made strictly between after and before, at most
+        limit of them.
+        """
+        posts = [post for post in self.posts
+                 if (after is None or post["created_utc"] > after) and
+                 (before is None or post["created_utc"] < before)]
+        return posts[:limit]
+
+
+class ReplayClient:
+    """
+    A client that saves the response to every request it forwards to a real
+    client, or answers from saved responses without a real client.
+
+    Attributes:
+        name: A string naming the API, such as "alpaca".
+        client: The client to forward requests to and record, or None to
+        only replay.
+        replay_dir: A string of the folder the responses are saved in.
+    """
+
+    def __init__(self, name, client=None, replay_dir=REPLAY_DIR):
+        self.name = name
+        self.client = client
+        self.replay_dir = replay_dir
+
+    def response_path(self, method, args, kwargs):
+        """
+        Gets the file a request's response is saved in, named after a hash of
+        the request.
+        """
+        request = json.dumps([method, args, kwargs], sort_keys=True,
+                             default=str)
+        key = hashlib.sha1(request.encode()).hexdigest()
+        return os.path.join(self.replay_dir, self.name, f"{key}.pickle")
+
+    def __getattr__(self, method):
+        def request(*args, **kwargs):
+            path = self.response_path(method, args, kwargs)
+            if self.client is None:
+                if not os.path.exists(path):
+                    raise OfflineError(f"no recorded response for "
+                                       f"{self.name}.{method}")
+                with open(path, "rb") as file:
+                    return pickle.load(file)
+
+            response = getattr(self.client, method)(*args, **kwargs)
+            if isinstance(response, collections.abc.Iterator):
+                # PMAW responses are generators that can only be read once
+                response = list(response)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                pickle.dump(response, file)
+            return response
+        return request
+
+
+def _record(name, make_client):
+    return lambda: ReplayClient(name, make_client())
+
+
+# The function that makes each API's client, for each backend
+BACKENDS = {
+    "real": {"alpaca": make_alpaca_client,
+             "pushshift": make_pushshift_client},
+    "offline": {"alpaca": lambda: OfflineClient("alpaca"),
+                "pushshift": lambda: OfflineClient("pushshift")},
+    "fake": {"alpaca": FakeAlpaca, "pushshift": FakePushshift},
+    "record": {"alpaca": _record("alpaca", make_alpaca_client),
+               "pushshift": _record("pushshift", make_pushshift_client)},
+    "replay": {"alpaca": lambda: ReplayClient("alpaca"),
+               "pushshift": lambda: ReplayClient("pushshift")},
+}
+
+_BACKEND = os.environ.get("API_BACKEND", "real")
+_CLIENTS = {}
+_LOCK = threading.Lock()
+
+
+def set_backend(backend):
+    """
+    Changes the backend that clients are made by, throwing away the clients
+    made so far.
+
+    Args:
+        backend: A string key of BACKENDS, such as "offline".
+    """
+    global _BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown API backend {backend!r}")
+    with _LOCK:
+        _BACKEND = backend
+        _CLIENTS.clear()
+
+
+def get_backend():
+    """
+    Gets the name of the backend clients are made by.
+    """
+    return _BACKEND
+
+
+def set_client(name, client):
+    """
+    Makes every later request to an API use a given client, such as a fake.
+
+    Args:
+        name: A string naming the API, such as "alpaca".
+        client: The client to use, or None to go back to making one with the
+        current backend.
+    """
+    with _LOCK:
+        if client is None:
+            _CLIENTS.pop(name, None)
+        else:
+            _CLIENTS[name] = client
+
+
+def get_client(name):
+    """
+    Gets the shared client for an API, making it with the current backend
+    the first time it is asked for.
+
+    Args:
+        name: A string naming the API, either "alpaca" or "pushshift".
+
+    Returns:
+        The client object.
+    """
+    client = _CLIENTS.get(name)
+    if client is None:
+        with _LOCK:
+            client = _CLIENTS.get(name)
+            if client is None:
+                client = BACKENDS[_BACKEND][name]()
+                _CLIENTS[name] = client
+    return client
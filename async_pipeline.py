@@ -0,0 +1,394 @@
+"""
+Streams Reddit submissions through to their returns with asyncio instead of
+running each step over every submission in turn. Pulling and filtering
+posts, checking that tickers are valid, downloading bars, and computing
+returns are separate stages joined by bounded queues, and each stage runs as
+many workers as it is given. A stage whose queue is full makes the stage
+before it wait, so a slow download never lets posts pile up in memory, and
+while one ticker waits on the network the others are being checked or
+computed, so a run takes about as long as its slowest stage rather than the
+sum of them all.
+
+Only network requests run in threads. Everything that reads or writes the
+ticker index and bar cache runs on the event loop, so the stages never need
+more than an asyncio lock per ticker to share them.
+
+Run from the top of the repository, for example:
+    python async_pipeline.py --begin 2018-01-01 --end 2018-12-31
+    python async_pipeline.py --fetch-workers 16 --queue-size 64
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from analysis.ledger import submission_id
+from analysis.returns import BENCHMARK, compute_returns, load_close_series
+from analysis.risk import RISK_COLUMNS, compute_risk_metrics
+from api_clients import get_client
+from instrumentation import count, timed
+from reddit.pmaw_api import filter_post, str_create_timestamp, \
+    stream_raw_posts
+from stock_info.pull_stock_info import get_bar_cache, get_datetime, \
+    get_multi_bars, get_ticker_index
+from symbol_registry import SymbolSet
+
+# The most items waiting between two stages
+QUEUE_SIZE = 32
+
+# How many items each stage works on at once. Validating and downloading
+# mostly wait on Alpaca, while computing keeps the event loop busy.
+DEFAULT_WORKERS = {"validate": 4, "fetch": 8, "compute": 1}
+
+RESULT_COLUMNS = ["submission", "ticker", "date", "period", "entry_date",
+                  "exit_date", "stock_roi", "spy_roi",
+                  "excess_return"] + RISK_COLUMNS
+
+# A step of a stream. handler is a coroutine function that takes one item
+# and returns a list of the items to pass on, workers is how many items it
+# handles at once, and queue_size is the most items that may wait for it.
+StreamStage = namedtuple("StreamStage", ["name", "handler", "workers",
+                                         "queue_size"])
+
+# Put on a queue once for each worker reading it after the last item
+_DONE = object()
+
+
+async def _pull(source, outbox, consumers):
+    iterator = iter(source)
+    while True:
+        # The source may wait on the network, so it is advanced in a thread
+        item = await asyncio.to_thread(next, iterator, _DONE)
+        if item is _DONE:
+            break
+        count("stream.source.items")
+        await outbox.put(item)
+    for _ in range(consumers):
+        await outbox.put(_DONE)
+
+
+async def _work(stage, inbox, outbox, running, consumers):
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            # The last worker of a stage to finish tells the next stage
+            running[stage.name] -= 1
+            if not running[stage.name]:
+                for _ in range(consumers):
+                    await outbox.put(_DONE)
+            return
+        start = time.perf_counter()
+        outputs = await stage.handler(item)
+        count(f"stream.{stage.name}.items")
+        count(f"stream.{stage.name}.seconds", time.perf_counter() - start)
+        for output in outputs:
+            await outbox.put(output)
+
+
+async def stream(source, stages):
+    """
+    Passes every item of a source through a list of stages, with a bounded
+    queue in front of each stage.
+
+    Args:
+        source: An iterable of the items for the first stage. It is advanced
+        in a thread, so it may wait on the network.
+        stages: A list of StreamStages, in order.
+
+    Returns:
+        A list of the items returned by the last stage, in the order they
+        were finished.
+
+    Raises:
+        Exception: The first error raised by the source or a handler, after
+        every other worker has been stopped.
+    """
+    queues = [asyncio.Queue(stage.queue_size) for stage in stages]
+    # Nothing reads the last queue until the end, so it is not bounded
+    queues.append(asyncio.Queue())
+    consumers = [stage.workers for stage in stages[1:]] + [1]
+    running = {stage.name: stage.workers for stage in stages}
+
+    tasks = [asyncio.ensure_future(
+        _pull(source, queues[0], stages[0].workers))]
+    for position, stage in enumerate(stages):
+        tasks += [asyncio.ensure_future(_work(
+            stage, queues[position], queues[position + 1], running,
+            consumers[position])) for _ in range(stage.workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    outputs = []
+    while not queues[-1].empty():
+        item = queues[-1].get_nowait()
+        if item is not _DONE:
+            outputs.append(item)
+    return outputs
+
+
+def run_stream(source, stages):
+    """
+    Runs stream in a new event loop, with enough threads for every worker
+    of every stage to wait on the network at once.
+
+    Args:
+        source: An iterable of the items for the first stage.
+        stages: A list of StreamStages, in order.
+
+    Returns:
+        A list of the items returned by the last stage.
+    """
+    async def main():
+        threads = 1 + sum(stage.workers for stage in stages)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=threads))
+        return await stream(source, stages)
+    return asyncio.run(main())
+
+
+def reddit_jobs(posts, period=365, matcher=None):
+    """
+    Filters posts as they are pulled and turns the ones that recommend
+    stocks into return jobs, as get_filtered_reddit_data and
+    reddit_overall_comparison do one after the other.
+
+    Args:
+        posts: An iterable of posts in order of created_utc, such as the one
+        returned by stream_raw_posts.
+        period: An integer of the number of days each stock is held.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
+
+    Yields:
+        A (submission, ticker, period, date) tuple for each ticker a post is
+        the first to recommend, where submission is the id made by
+        submission_id and date is a string in the format YYYY-MM-DD.
+    """
+    # Start with SPY, our S&P500 ETF and baseline
+    existing_tickers = SymbolSet([BENCHMARK])
+    for post in posts:
+        count("reddit.posts_filtered")
+        title = str(post['title'])
+        tickers = filter_post(title, str(post['selftext']), existing_tickers,
+                              matcher)
+        if not tickers:
+            continue
+        count("reddit.posts_accepted")
+        posted = datetime.datetime.fromtimestamp(post['created_utc'])
+        key = submission_id(title, str(posted))
+        for ticker in tickers:
+            yield key, ticker, period, posted.strftime("%Y-%m-%d")
+
+
+class TickerValidator:
+    """
+    A stage handler that drops jobs whose ticker is not valid on Alpaca.
+    Symbols missing from the ticker index are probed one at a time, so a
+    job never waits for symbols it does not use.
+
+    Attributes:
+        api: The Alpaca REST client to probe symbols with.
+        index: The TickerIndex to look symbols up in and add to.
+    """
+
+    def __init__(self, api=None, index=None):
+        self.api = api or get_client("alpaca")
+        self.index = index or get_ticker_index()
+        self._locks = {}
+
+    async def __call__(self, job):
+        ticker = job[1]
+        # Jobs for a ticker being probed wait for it instead of probing again
+        async with self._locks.setdefault(ticker, asyncio.Lock()):
+            is_valid = self.index.lookup(ticker)
+            if is_valid is None:
+                count("ticker_index.misses")
+                # Look for data from one day to see if we get results
+                dates = get_datetime("2018-01-01", 1)
+                bars = await asyncio.to_thread(
+                    get_multi_bars, self.api, [ticker], dates[0], dates[1])
+                is_valid = len(bars[ticker]) > 0
+                self.index.update({ticker: is_valid})
+            else:
+                count("ticker_index.hits")
+        return [job] if is_valid else []
+
+
+class BarFetcher:
+    """
+    A stage handler that downloads the bars a job needs, for its ticker and
+    the benchmark, that are not in the bar cache yet.
+
+    Attributes:
+        api: The Alpaca REST client to download bars with.
+        cache: The BarCache to read from and add to.
+        benchmark: A string of the ticker every job is compared against.
+    """
+
+    def __init__(self, api=None, cache=None, benchmark=BENCHMARK):
+        self.api = api or get_client("alpaca")
+        self.cache = cache or get_bar_cache()
+        self.benchmark = benchmark
+        self._locks = {}
+
+    async def __call__(self, job):
+        _, ticker, period, start_date = job
+        start_date, end_date = get_datetime(start_date, period)
+        for symbol in (ticker, self.benchmark):
+            # Gaps are found after waiting, so bars another job has just
+            # downloaded for the same symbol are not downloaded again
+            async with self._locks.setdefault(symbol, asyncio.Lock()):
+                gaps = self.cache.missing(symbol, start_date, end_date)
+                count("bar_cache.misses" if gaps else "bar_cache.hits")
+                for gap_start, gap_end in gaps:
+                    bars = await asyncio.to_thread(
+                        get_multi_bars, self.api, [symbol], gap_start,
+                        gap_end)
+                    self.cache.store(symbol, bars[symbol], gap_start,
+                                     gap_end)
+        return [job]
+
+
+class ReturnCalculator:
+    """
+    A stage handler that computes the return and risk metrics of a job from
+    the bar cache.
+
+    Attributes:
+        cache: The BarCache to read prices from.
+        benchmark: A string of the ticker every job is compared against.
+    """
+
+    def __init__(self, cache=None, benchmark=BENCHMARK):
+        self.cache = cache or get_bar_cache()
+        self.benchmark = benchmark
+
+    async def __call__(self, job):
+        submission, ticker, period, start_date = job
+        return_jobs = [(ticker, start_date, period)]
+        load_series = functools.partial(load_close_series, cache=self.cache)
+        results = compute_returns(return_jobs, load_series, self.benchmark)
+        risk = compute_risk_metrics(return_jobs, load_series, self.benchmark)
+        results = pd.concat([results, risk[RISK_COLUMNS]], axis=1)
+        results.insert(0, "submission", submission)
+        return [results]
+
+
+def return_stages(api=None, index=None, cache=None, workers=None,
+                  queue_size=QUEUE_SIZE):
+    """
+    Makes the stages that take return jobs from reddit_jobs to results.
+
+    Args:
+        api: The Alpaca REST client to use. Defaults to the shared Alpaca
+        client.
+        index: The TickerIndex to use. Defaults to the global ticker index.
+        cache: The BarCache to use. Defaults to the global bar cache.
+        workers: A dictionary mapping the stage names validate, fetch and
+        compute to how many jobs each works on at once. Stages left out use
+        DEFAULT_WORKERS.
+        queue_size: An integer of the most jobs waiting before each stage.
+
+    Returns:
+        A list of StreamStages.
+    """
+    workers = {**DEFAULT_WORKERS, **(workers or {})}
+    cache = cache or get_bar_cache()
+    handlers = {"validate": TickerValidator(api, index),
+                "fetch": BarFetcher(api, cache),
+                "compute": ReturnCalculator(cache)}
+    return [StreamStage(name, handler, workers[name], queue_size)
+            for name, handler in handlers.items()]
+
+
+@timed()
+def stream_returns(limit, beginning_day, end_day, period=365, posts=None,
+                   matcher=None, api=None, index=None, cache=None,
+                   workers=None, queue_size=QUEUE_SIZE):
+    """
+    Pulls posts from /r/wallstreetbets and finds the return of each stock
+    they recommend, and of SPY over the same time, all in one stream.
+
+    Args:
+        limit: An int representing the maximum amount of reddit submissions
+        you want to collect.
+        beginning_day: A date represented as a string in "YXXX-MX-DX" format
+        that is the beginning of your search time window.
+        end_day: A date represented as a string in "YXXX-MX-DX" format
+        that is the end of your search time window.
+        period: An integer of the number of days each stock is held.
+        posts: A function taking (limit, beginning_timestamp, end_timestamp)
+        and yielding posts in order of created_utc, as stream_raw_posts does.
+        Defaults to streaming /r/wallstreetbets from Pushshift.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
+        api: The Alpaca REST client to use. Defaults to the shared Alpaca
+        client.
+        index: The TickerIndex to use. Defaults to the global ticker index.
+        cache: The BarCache to use. Defaults to the global bar cache.
+        workers: A dictionary of how many jobs each stage works on at once,
+        as taken by return_stages.
+        queue_size: An integer of the most jobs waiting before each stage.
+
+    Returns:
+        A dataframe with a row per recommended ticker and the columns of
+        RESULT_COLUMNS, sorted by date and ticker.
+    """
+    if posts is None:
+        def posts(*args):
+            return stream_raw_posts("wallstreetbets", *args)
+
+    source = reddit_jobs(posts(limit, str_create_timestamp(beginning_day),
+                               str_create_timestamp(end_day)),
+                         period, matcher)
+    results = run_stream(source, return_stages(api, index, cache, workers,
+                                               queue_size))
+    if not results:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(results, ignore_index=True).sort_values(
+        ["date", "ticker"], ignore_index=True)[RESULT_COLUMNS]
+
+
+def main(argv=None):
+    """
+    Streams submissions to returns from the command line and prints the
+    average returns.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--limit", type=int, default=100000,
+                        help="most Reddit submissions to pull")
+    parser.add_argument("--begin", default="2018-01-01",
+                        help="first day to pull posts from, YYYY-MM-DD")
+    parser.add_argument("--end", default="2018-12-31",
+                        help="last day to pull posts from, YYYY-MM-DD")
+    parser.add_argument("--period", type=int, default=365,
+                        help="days to hold each stock for")
+    for name, default in DEFAULT_WORKERS.items():
+        parser.add_argument(f"--{name}-workers", type=int, default=default,
+                            help=f"jobs the {name} stage works on at once")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="most jobs waiting before each stage")
+    parser.add_argument("--output", help="CSV file to write the results to")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    workers = {name: getattr(args, f"{name}_workers")
+               for name in DEFAULT_WORKERS}
+    results = stream_returns(args.limit, args.begin, args.end, args.period,
+                             workers=workers, queue_size=args.queue_size)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    print(f"Reddit: {results['stock_roi'].mean()}")
+    print(f"S&P: {results['spy_roi'].mean()}")
+    print(f"Finished {len(results)} jobs in "
+          f"{time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
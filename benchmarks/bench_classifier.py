@@ -0,0 +1,96 @@
+"""
+Benchmark comparing the four separate regex scans used to filter Reddit
+posts against the single-pass classifier and the batch classifier, on a
+synthetic corpus of long selftexts.
+
+Run from the top of the repository with:
+    python -m benchmarks.bench_classifier
+"""
+import random
+import time
+import pandas as pd
+from reddit.pmaw_api import find_tickers, find_qmarks, find_long, find_short
+from reddit.classifier import classify_text, classify_series, \
+    is_recommendation
+
+WORDS = ["the", "stock", "moon", "going", "long", "calls", "puts",
+         "tendies", "hold", "diamond", "hands", "earnings", "buy", "dip",
+         "$TSLA", "$GME", "$AMC", "$AAPL", "$PLTR", "yolo", "rocket"]
+# Words that get a post rejected, one of which is put in half of the posts
+REJECT_WORDS = ["short", "why?"]
+
+
+def make_corpus(num_posts, words_per_post=300, seed=0):
+    """
+    Generates random post text that looks enough like /r/wallstreetbets for
+    the filters to accept some posts and reject others.
+
+    Args:
+        num_posts: An integer of the number of posts to generate.
+        words_per_post: An integer of the number of words in each post.
+        seed: An integer seed so every run generates the same corpus.
+
+    Returns:
+        A list of strings, one per post.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(num_posts):
+        words = rng.choices(WORDS, k=words_per_post)
+        if rng.random() < 0.5:
+            words[rng.randrange(words_per_post)] = rng.choice(REJECT_WORDS)
+        corpus.append(" ".join(words))
+    return corpus
+
+
+def four_scans(all_text):
+    """
+    The original filter from get_filtered_reddit_data, which searches for
+    tickers a second time to list them once a post is accepted.
+    """
+    if find_tickers(all_text) and not find_qmarks(all_text) and \
+            find_long(all_text) and not find_short(all_text):
+        return bool(find_tickers(all_text))
+    return False
+
+
+def single_pass(all_text):
+    """
+    The filter using the single-pass classifier.
+    """
+    return is_recommendation(classify_text(all_text))
+
+
+def time_call(func, *args):
+    """
+    Times one call of a function.
+
+    Returns:
+        A tuple of the function's result and the seconds it took.
+    """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(num_posts=20000):
+    """
+    Runs the benchmark and prints how long each approach took.
+    """
+    corpus = make_corpus(num_posts)
+    texts = pd.Series(corpus)
+
+    old, old_time = time_call(lambda: [four_scans(text) for text in corpus])
+    new, new_time = time_call(lambda: [single_pass(text) for text in corpus])
+    batch, batch_time = time_call(classify_series, texts)
+    assert old == new == list(batch["accepted"])
+
+    print(f"{num_posts} posts, {sum(old)} accepted")
+    print(f"four scans:      {old_time:.3f}s")
+    print(f"single pass:     {new_time:.3f}s ({old_time / new_time:.1f}x)")
+    print(f"batch (pandas):  {batch_time:.3f}s "
+          f"({old_time / batch_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
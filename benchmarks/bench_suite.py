@@ -0,0 +1,366 @@
+"""
+Benchmark suite for the Reddit ingestion, returns, and plotting hot paths.
+Everything runs offline on synthetic posts and bars served by fake Pushshift
+and Alpaca clients, at scales from a quick smoke test up to a million posts
+and five thousand tickers. The time and peak Python memory of each benchmark
+are written to a JSON file, and can be compared against an earlier run to
+catch regressions.
+
+Run from the top of the repository, for example:
+    python -m benchmarks.bench_suite --scale small --output baseline.json
+    python -m benchmarks.bench_suite --scale small --baseline baseline.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from api_clients import FakeAlpaca
+from generate_results import get_annual_return
+from graphing.graph_stock_info import prepare_color_plot
+from rate_limiter import RATE_LIMITS, set_rate_limit
+from series_cache import CACHE
+from reddit.pmaw_api import find_tickers, find_qmarks, find_long, \
+    find_short, get_filtered_reddit_data, remove_dupes, str_create_timestamp
+from stock_info.bar_cache import BarCache
+from stock_info.pull_stock_info import get_stock_info_batch
+
+SCALES = {
+    "small": {"posts": 1000, "tickers": 10},
+    "medium": {"posts": 100000, "tickers": 500},
+    "large": {"posts": 1000000, "tickers": 5000},
+}
+START_DAY = "2018-01-01"
+END_DAY = "2018-12-31"
+WORDS = ["the", "stock", "moon", "going", "long", "calls", "puts", "hold",
+         "earnings", "buy", "dip", "yolo", "short", "why?", "tendies"]
+
+
+def make_symbols(num_tickers):
+    """
+    Makes distinct ticker symbols of four uppercase letters.
+
+    Args:
+        num_tickers: An integer of the number of symbols to make.
+
+    Returns:
+        A list of ticker symbol strings.
+    """
+    symbols = []
+    for number in range(num_tickers):
+        letters = ""
+        for _ in range(4):
+            number, digit = divmod(number, 26)
+            letters = chr(ord("A") + digit) + letters
+        symbols.append(letters)
+    return symbols
+
+
+def make_posts(num_posts, symbols, words_per_post=20, seed=0):
+    """
+    Generates random posts that look enough like /r/wallstreetbets for the
+    filters to accept some posts and reject others.
+
+    Args:
+        num_posts: An integer of the number of posts to generate.
+        symbols: A list of the ticker symbols posts may mention.
+        words_per_post: An integer of the number of words in each post.
+        seed: An integer seed so every run generates the same posts.
+
+    Returns:
+        A list of post dictionaries with title, selftext, and created_utc
+        keys, in order of created_utc.
+    """
+    rng = random.Random(seed)
+    vocabulary = WORDS + [f"${symbol}" for symbol in symbols]
+    begin = str_create_timestamp(START_DAY)
+    end = str_create_timestamp(END_DAY)
+    times = sorted(rng.randrange(begin + 1, end) for _ in range(num_posts))
+    posts = []
+    for created_utc in times:
+        words = rng.choices(vocabulary, k=words_per_post)
+        posts.append({"title": " ".join(words[:5]),
+                      "selftext": " ".join(words[5:]),
+                      "created_utc": created_utc})
+    return posts
+
+
+class FakeStream:
+    """
+    A stand-in for stream_raw_posts that serves a list of posts.
+    """
+
+    def __init__(self, posts):
+        self.posts = posts
+
+    def __call__(self, limit, after, before):
+        served = 0
+        for post in self.posts:
+            if served >= limit:
+                return
+            if after < post["created_utc"] < before:
+                served += 1
+                yield post
+
+
+def make_bars(symbols, seed=0):
+    """
+    Generates one year of random daily bars for each symbol.
+
+    Returns:
+        A dictionary mapping each symbol to a dataframe of bars indexed by
+        UTC timestamp.
+    """
+    rng = np.random.default_rng(seed)
+    timestamps = pd.bdate_range(START_DAY, END_DAY, tz="UTC") + \
+        pd.Timedelta(hours=5)
+    bars = {}
+    for symbol in symbols:
+        closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.02, len(timestamps))))
+        bars[symbol] = pd.DataFrame(
+            {"open": closes, "high": closes * 1.01, "low": closes * 0.99,
+             "close": closes, "volume": 1000, "trade_count": 10,
+             "vwap": closes},
+            index=pd.Index(timestamps, name="timestamp"))
+    return bars
+
+
+def bench_filter_posts(data, work_dir):
+    """
+    Streams every post through get_filtered_reddit_data.
+    """
+    output_path = os.path.join(work_dir, "filtered.csv")
+    fake = FakeStream(data["posts"])
+
+    def run():
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            get_filtered_reddit_data(len(data["posts"]), START_DAY, END_DAY,
+                                     output_path, chunk_size=1000,
+                                     posts=fake)
+    return run
+
+
+def bench_find_scanners(data, work_dir):
+    """
+    Runs the four find_* scanners over the text of every post.
+    """
+    texts = [post["title"] + post["selftext"] for post in data["posts"]]
+
+    def run():
+        for text in texts:
+            find_tickers(text)
+            find_qmarks(text)
+            find_long(text)
+            find_short(text)
+    return run
+
+
+def bench_remove_dupes(data, work_dir):
+    """
+    Removes the duplicate tickers from every post's ticker list.
+    """
+    ticker_lists = [find_tickers(post["title"] + post["selftext"])
+                    for post in data["posts"]]
+
+    def run():
+        for tickers in ticker_lists:
+            remove_dupes(tickers)
+    return run
+
+
+def bench_fetch_bars(data, work_dir):
+    """
+    Downloads a year of bars for every ticker through get_stock_info_batch
+    into an empty cache.
+    """
+    jobs = [(symbol, START_DAY, 364) for symbol in data["symbols"]]
+    runs = []
+
+    def run():
+        cache = BarCache(os.path.join(work_dir, f"cache{len(runs)}"))
+        runs.append(cache)
+        get_stock_info_batch(jobs, FakeAlpaca(), cache)
+    return run
+
+
+def bench_annual_return(data, work_dir):
+    """
+    Reads every ticker's CSV file and finds its annual return.
+    """
+    paths = []
+    for symbol, bars in data["bars"].items():
+        paths.append(os.path.join(work_dir, f"{symbol}data.csv"))
+        bars.to_csv(paths[-1])
+
+    def run():
+        # Measure parsing every file rather than hits in the series cache
+        CACHE.clear()
+        for path in paths:
+            get_annual_return(path)
+    return run
+
+
+def bench_color_plot_prep(data, work_dir):
+    """
+    Prepares the color plot of every ticker.
+    """
+    def run():
+        for bars in data["bars"].values():
+            prepare_color_plot(bars.index, bars["close"])
+    return run
+
+
+BENCHMARKS = {
+    "filter_posts": bench_filter_posts,
+    "find_scanners": bench_find_scanners,
+    "remove_dupes": bench_remove_dupes,
+    "fetch_bars": bench_fetch_bars,
+    "annual_return": bench_annual_return,
+    "color_plot_prep": bench_color_plot_prep,
+}
+
+
+def measure(run, repeat=1):
+    """
+    Times a benchmark and measures the most Python memory it allocates.
+    Memory is measured on a separate run, since tracing slows it down.
+
+    Args:
+        run: A function taking no arguments that does the work once.
+        repeat: An integer of the number of timed runs to take the best of.
+
+    Returns:
+        A dictionary with the keys seconds and peak_mb.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_mb": peak / 2 ** 20}
+
+
+def run_suite(scale, names=None, repeat=1, seed=0):
+    """
+    Runs the benchmarks at one scale.
+
+    Args:
+        scale: A string key of SCALES, or a dictionary with the number of
+        posts and tickers to generate.
+        names: A list of the names of the benchmarks to run. Defaults to all
+        of them.
+        repeat: An integer of the number of timed runs to take the best of.
+        seed: An integer seed for the synthetic data.
+
+    Returns:
+        A dictionary mapping each benchmark name to its measurements.
+    """
+    sizes = SCALES[scale] if isinstance(scale, str) else scale
+    symbols = make_symbols(sizes["tickers"])
+    data = {"symbols": symbols,
+            "posts": make_posts(sizes["posts"], symbols, seed=seed),
+            "bars": make_bars(symbols, seed)}
+
+    # The fake client answers instantly, so don't wait between its requests
+    alpaca_limit = RATE_LIMITS["alpaca"]
+    set_rate_limit("alpaca", float("inf"), sys.maxsize)
+    results = {}
+    try:
+        for name in names or BENCHMARKS:
+            with tempfile.TemporaryDirectory() as work_dir:
+                results[name] = measure(BENCHMARKS[name](data, work_dir),
+                                        repeat)
+    finally:
+        set_rate_limit("alpaca", *alpaca_limit)
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """
+    Finds the benchmarks that got slower or used more memory than in a
+    baseline run.
+
+    Args:
+        results: A dictionary mapping each scale to the results of run_suite.
+        baseline: A dictionary in the same format from an earlier run.
+        tolerance: A float of how much worse than the baseline a measurement
+        may be, as a fraction, before it counts as a regression.
+
+    Returns:
+        A list of (scale, name, metric, baseline_value, value) tuples, one
+        for each regression.
+    """
+    regressions = []
+    for scale, scale_results in results.items():
+        for name, measurements in scale_results.items():
+            old = baseline.get(scale, {}).get(name)
+            if old is None:
+                continue
+            for metric, value in measurements.items():
+                if metric in old and value > old[metric] * (1 + tolerance):
+                    regressions.append((scale, name, metric, old[metric],
+                                        value))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks from the command line, prints the measurements, and
+    exits with status 1 if any regressed against the baseline.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", action="append", choices=list(SCALES),
+                        help="scale to run, may be repeated (default small)")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS),
+                        help="benchmark to run, may be repeated")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="timed runs to take the best of")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--baseline", help="JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed slowdown as a fraction (default 0.2)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for scale in args.scale or ["small"]:
+        results[scale] = run_suite(scale, args.only, args.repeat)
+        for name, measurements in results[scale].items():
+            print(f"{scale:7} {name:16} {measurements['seconds']:9.3f}s "
+                  f"{measurements['peak_mb']:9.1f} MB")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"python": platform.python_version(),
+                       "machine": platform.machine(),
+                       "results": results}, file, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)["results"]
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for scale, name, metric, old, new in regressions:
+            print(f"REGRESSION {scale} {name} {metric}: {old:.3f} -> "
+                  f"{new:.3f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,32 @@
 This library is used to create graphs of a specific stock price and the SPY
 price starting from a specific date and ending after one year.
 """
+from datetime import datetime
 import pandas as pd
+from analysis.ledger import KEY, LEDGER_PATH, ResultsLedger, submission_id
+from analysis.returns import compute_returns, window_fingerprints
+from analysis.risk import RISK_COLUMNS, compute_risk_metrics
 from graphing.graph_stock_info import make_color_plot
-from stock_info.pull_stock_info import get_stock_info, is_valid_ticker
+from instrumentation import count, span, timed
+from stock_info.pull_stock_info import (
+    get_stock_info_batch,
+    is_valid_ticker,
+    validate_tickers
+)
+from stock_info.bar_cache import read_bar_csv
+from stock_info.price_panel import load_panel, read_bars
 from reddit.pmaw_api import remove_dupes
-import datetime as dt
+from reddit.submission_store import build_store
+from series_cache import invalidate, memoize_file
+from symbol_registry import SymbolSet, load_snp500
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import time as t
+
+
+# The Reddit stocks drawn by compare_stock_plot
+COMPARE_TICKERS = ['NKE', 'L', 'TSLA', 'SVXY', 'SHOP',
+                   'DVN', 'PLNT', 'NVDA', 'CROX', 'GPRO']
 
 
 def str_to_list(list_string):
@@ -27,10 +44,12 @@ def str_to_list(list_string):
     return list_string[2:-2].split("', '")
 
 
+@timed()
+@memoize_file("annual_return")
 def get_annual_return(path):
     """
     Given a path to a csv containing 1 years worth of data from a stock, find
-    the annual return / ROI.
+    the annual return / ROI. The result is remembered until the file changes.
 
     Args:
         path: A string of the file path to the csv file containing stock market
@@ -39,7 +58,7 @@ def get_annual_return(path):
     Returns:
         A decimal value representing the percent return over the 1 year period.
     """
-    dataframe = pd.read_csv(path)
+    dataframe = read_bar_csv(path)
 
     start_val = list(dataframe['close'])[0]
     end_val = list(dataframe['close'])[-1]
@@ -49,6 +68,7 @@ def get_annual_return(path):
     return roi
 
 
+@timed()
 def get_reddit_stock_info():
     """
     Tallies all of the valid ticker symbols from our csv file filled with
@@ -57,22 +77,22 @@ def get_reddit_stock_info():
     are in the S&P 500.
     """
     # Pull S&P 500 stock ticker list from csv file
-    dataframe = pd.read_csv("reddit/snp500.csv")
-    snp_tickers = list(dataframe['Symbol'])
+    snp_tickers = load_snp500()
 
-    # Pull reddit submission info from csv file
-    dataframe = pd.read_csv("reddit/reddit_subs_filtered.csv")
+    # Pull the tickers of every reddit submission from the submission store
+    ticker_lists = build_store().frame(["tickers"])['tickers']
+
+    # Check every ticker up front so the loop below only does lookups
+    valid_tickers = SymbolSet(
+        ticker for ticker, is_valid in validate_tickers(
+            ticker for tickers in ticker_lists
+            for ticker in tickers).items() if is_valid)
 
     matching_tickers = 0
     valid_stocks = []
-    # itertuples maintains data format, but lists become strings
-    for submission in dataframe.itertuples():
-
-        ticker_str = submission.tickers
-        tickers = str_to_list(ticker_str)
-
+    for tickers in ticker_lists:
         for ticker in tickers:
-            if is_valid_ticker(ticker):
+            if ticker in valid_tickers:
                 valid_stocks.append(ticker)
             if ticker in snp_tickers:
                 matching_tickers += 1
@@ -82,6 +102,7 @@ def get_reddit_stock_info():
     print("Number of recommended stocks in the S&P 500: ", matching_tickers)
 
 
+@timed()
 def generate_results(ticker, date):
     """
     Creates a set of graphs to compare the overall stock market (The S&P 500)
@@ -97,16 +118,18 @@ def generate_results(ticker, date):
     SPY etf, which copies the S&P 500 and is our proxy for the general movement
     of the stock market.
     """
-    # Pull data from alpaca for the stock from the reddit post
-    get_stock_info(ticker, date, 365)
-    # Pull data from alpaca for S&P 500 to compare
-    get_stock_info("SPY", date, 365)
-
     # Create data paths to stock csv files
     stock_path = (f"stock_info/data/{ticker}data.csv")
     # This path will always be the same
     spy_path = "stock_info/data/SPYdata.csv"
 
+    # Pull data from alpaca for the stock from the reddit post and for the
+    # S&P 500 to compare in one request, then write each one out
+    bars = get_stock_info_batch([(ticker, date, 365), ("SPY", date, 365)])
+    for symbol, path in [(ticker, stock_path), ("SPY", spy_path)]:
+        bars[symbol].to_csv(path)
+        invalidate(path)
+
     make_color_plot(spy_path, "SPY")
 
     make_color_plot(stock_path, ticker)
@@ -118,74 +141,114 @@ def generate_results(ticker, date):
     print(f"{ticker} One Year Return: ", stock_ar)
 
 
-def reddit_overall_comparison():
+@timed()
+def reddit_overall_comparison(ledger_path=LEDGER_PATH):
     """
     Finds the annual return of each stock reddit recommended starting the date
     that the submission was posted. Finds the annual return of SPY over the
     same time periods. Averages the Reddit annual return and the S&P annual
-    return and prints those average values.
+    return and prints those average values, along with the average
+    volatility, Sharpe and Sortino ratios, maximum drawdown, and beta and
+    correlation to SPY of the recommended stocks over the same years.
+
+    Returns are remembered in a ledger between runs, so only submissions that
+    are new, whose year has not ended yet, or whose stock's price data has
+    changed are downloaded and computed again.
+
+    Args:
+        ledger_path: A string of the path of the ledger CSV file.
     """
-    dataframe = pd.read_csv("reddit/reddit_subs_filtered.csv")
-    reddit_annual_returns = []
-    snp_annual_returns = []
+    dataframe = build_store().frame(["title", "time", "tickers"])
 
+    rows = []
     for submission in dataframe.itertuples():
-        time = submission.time[:10]
-        tickers = remove_dupes(str_to_list(submission.tickers))
-
-        for ticker in tickers:
-            t.sleep(1.5)
-            if is_valid_ticker(ticker):
-                # Collect data on reddit recommended ticker
-                get_stock_info(ticker, time, 365)
-                path = (f'stock_info/data/{ticker}data.csv')
-                annual_return = get_annual_return(path)
-                reddit_annual_returns.append(annual_return)
-
-                # Then look at S&P 500 data over the same time period
-                get_stock_info("SPY", time, 365)
-                path = 'stock_info/data/SPYdata.csv'
-                annual_return = get_annual_return(path)
-                snp_annual_returns.append(annual_return)
-
-    average_reddit_ar = sum(reddit_annual_returns) / len(reddit_annual_returns)
-    average_snp_ar = sum(snp_annual_returns) / len(snp_annual_returns)
+        submission_key = submission_id(submission.title,
+                                       str(submission.time))
+        time = submission.time.strftime("%Y-%m-%d")
+        for ticker in remove_dupes(submission.tickers):
+            rows.append((submission_key, ticker, 365, time))
+    jobs = pd.DataFrame(rows, columns=KEY + ["date"])
+
+    ledger = ResultsLedger(ledger_path)
+    # Only the prices inside each holding period count, so downloading bars
+    # for new submissions leaves the rows already computed alone
+    fingerprints = window_fingerprints(
+        list(jobs[['ticker', 'date', 'period']].itertuples(index=False,
+                                                           name=None)))
+    pending = jobs[ledger.needs_update(jobs, fingerprints)]
+
+    # Only the tickers of submissions that need computing are checked
+    valid = validate_tickers(pending['ticker'])
+    pending = pending[pending['ticker'].map(valid).fillna(False).astype(bool)]
+
+    count("ledger.rows_reused", len(jobs) - len(pending))
+    count("ledger.rows_computed", len(pending))
+    if len(pending):
+        return_jobs = list(pending[['ticker', 'date', 'period']]
+                           .itertuples(index=False, name=None))
+        # Download every pending ticker, and SPY over the same time periods,
+        # using as few multi-symbol requests as possible
+        get_stock_info_batch(return_jobs + [("SPY", time, period)
+                                            for _, time, period in
+                                            return_jobs])
+        # Find the return of every ticker and of SPY over the same periods
+        with span("compute_returns"):
+            fingerprints = window_fingerprints(return_jobs)
+            results = compute_returns(return_jobs)
+        with span("compute_risk_metrics"):
+            risk = compute_risk_metrics(return_jobs)
+            results = pd.concat([results, risk[RISK_COLUMNS]], axis=1)
+        ledger.update(pending, results, fingerprints)
+
+    ledger.keep_only(jobs)
+    ledger.save()
+
+    average_reddit_ar, average_snp_ar = ledger.averages()
+    print("Computed returns for ", len(pending), " of ", len(jobs),
+          " recommendations")
     print("Average reddit AR: ", average_reddit_ar)
     print("Average S&P 500 AR: ", average_snp_ar)
-
-
-def make_bar_graph():
+    risk_averages = ledger.risk_averages()
+    print("Average reddit volatility: ", risk_averages["volatility"])
+    print("Average reddit Sharpe ratio: ", risk_averages["sharpe"])
+    print("Average reddit Sortino ratio: ", risk_averages["sortino"])
+    print("Average reddit max drawdown: ", risk_averages["max_drawdown"])
+    print("Average reddit beta to S&P 500: ", risk_averages["beta"])
+    print("Average reddit correlation to S&P 500: ",
+          risk_averages["correlation"])
+
+
+@timed()
+def make_bar_graph(save_path=None):
     """
     Graphs the annual return of several Reddit stocks compared to the S&P 500.
     Must be run after stock data has been collected.
+
+    Args:
+        save_path: A string of a file to save the graph to instead of showing
+        it. The format is taken from the extension, such as .png or .svg.
     """
-    dataframe = pd.read_csv("reddit/reddit_subs_filtered.csv")
-    reddit_annual_returns = []
-    snp_annual_returns = []
-    tickers_to_be_graphed = []
-    num_stocks = 0
+    dataframe = build_store().frame(["time", "tickers"])
+    jobs = []
+    validate_tickers(ticker for tickers in dataframe['tickers']
+                     for ticker in tickers)
     for submission in dataframe.itertuples():
-        time = submission.time[:10]
-        tickers = remove_dupes(str_to_list(submission.tickers))
+        time = submission.time.strftime("%Y-%m-%d")
+        tickers = remove_dupes(submission.tickers)
 
         for ticker in tickers:
-            # This is to prevent extra output from alpaca API calls
-            t.sleep(1)
-            if is_valid_ticker(ticker) and num_stocks < 8:
-                # Read stock data
-                tickers_to_be_graphed.append(ticker)
-                path = (f'stock_info/data/{ticker}data.csv')
-                reddit_annual_returns.append(get_annual_return(path))
-
-                # Then look at S&P 500 data over the same time period
-                get_stock_info("SPY", time, 365)
-                path = 'stock_info/data/SPYdata.csv'
-                snp_annual_returns.append(get_annual_return(path))
-                # Increment counter
-                num_stocks += 1
+            if is_valid_ticker(ticker) and len(jobs) < 8:
+                jobs.append((ticker, time, 365))
             else:
                 break
 
+    # Read stock data, and S&P 500 data over the same time periods
+    get_stock_info_batch([("SPY", time, period) for _, time, period in jobs])
+    returns = compute_returns(jobs)
+    tickers_to_be_graphed = list(returns['ticker'])
+    reddit_annual_returns = returns['stock_roi'].to_numpy()
+    snp_annual_returns = returns['spy_roi'].to_numpy()
+
     # Graphing section
 
     x = np.arange(len(tickers_to_be_graphed))  # the label locations
@@ -209,28 +272,55 @@ def make_bar_graph():
     fig.set_dpi(100)
     fig.set_facecolor('white')
 
-    plt.show()
+    if save_path:
+        fig.savefig(save_path)
+        plt.close(fig)
+    else:
+        plt.show()
 
 
-def compare_stock_plot():
+def write_stock_data(beginning_day="2018-01-01", end_day="2018-12-31",
+                     tickers=COMPARE_TICKERS):
     """
-    Graph the price of many Reddit stocks over time.
-    Must be run after stock data has been collected.
+    Downloads the bars of the stocks drawn by compare_stock_plot and writes
+    each one to its CSV file in stock_info/data, where the plot reads them.
+    Bars already in the bar cache are not downloaded again.
+
+    Args:
+        beginning_day: A string of the first day to write bars for, in the
+        format YYYY-MM-DD.
+        end_day: A string of the last day to write bars for, in the format
+        YYYY-MM-DD.
+        tickers: A list of ticker symbols.
     """
+    period = (datetime.strptime(end_day, "%Y-%m-%d") -
+              datetime.strptime(beginning_day, "%Y-%m-%d")).days
+    bars = get_stock_info_batch([(ticker, beginning_day, period)
+                                 for ticker in tickers])
+    for ticker in tickers:
+        path = f"stock_info/data/{ticker}data.csv"
+        bars[ticker].to_csv(path)
+        invalidate(path)
 
-    tickers = ['NKE', 'L', 'TSLA', 'SVXY', 'SHOP',
-               'DVN', 'PLNT', 'NVDA', 'CROX', 'GPRO']
 
-    fig, ax = plt.subplots()
-    for ticker in tickers:
-        path = (f'stock_info/data/{ticker}data.csv')
+@timed()
+def compare_stock_plot(save_path=None):
+    """
+    Graph the price of many Reddit stocks over time.
+    Must be run after stock data has been collected, such as by
+    write_stock_data.
 
-        dataframe = pd.read_csv(path)
-        x_coords = dataframe['timestamp']
+    Args:
+        save_path: A string of a file to save the graph to instead of showing
+        it. The format is taken from the extension, such as .png or .svg.
+    """
+    panel = load_panel()
+    fig, ax = plt.subplots()
+    for ticker in COMPARE_TICKERS:
+        dataframe = read_bars(ticker, panel)
+        x_coords = dataframe.index.date
         y_coords = dataframe['close']
 
-        x_coords = [dt.datetime.strptime(str(value)[0:10], '%Y-%m-%d').date()
-                    for value in x_coords]
         ax.plot(x_coords, y_coords, label=ticker)
 
     fig.set_size_inches(12, 6)
@@ -242,4 +332,8 @@ def compare_stock_plot():
     ax.set_title('Random Spread of Reddit Stocks')
     ax.legend()
 
-    plt.show()
+    if save_path:
+        fig.savefig(save_path)
+        plt.close(fig)
+    else:
+        plt.show()
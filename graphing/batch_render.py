@@ -0,0 +1,130 @@
+"""
+Library for saving the color plot of many stocks to image files without
+opening any windows. Charts are drawn on the Agg backend by a pool of worker
+processes, each of which reuses one figure for all of its charts, and charts
+whose source data has not changed since they were last saved are skipped.
+
+Run from the top of the repository to render every stock in stock_info/data:
+    python -m graphing.batch_render
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+from instrumentation import count, timed
+from graphing.graph_stock_info import draw_color_plot, prepare_color_plot
+from stock_info.price_panel import DATA_DIR, csv_fingerprint, \
+    find_data_files, load_panel, read_bars
+
+OUTPUT_DIR = "graphing/charts"
+
+# Each worker process keeps its own figure and price panel between charts
+_FIGURE = None
+_PANEL = None
+
+
+def _init_worker():
+    global _FIGURE, _PANEL
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    _FIGURE = plt.figure(figsize=(12, 6), dpi=100, facecolor="white")
+    _PANEL = load_panel()
+
+
+def render_chart(job):
+    """
+    Draws one stock's color plot and saves it. Must run in a process set up
+    by _init_worker.
+
+    Args:
+        job: A tuple (ticker, data_dir, output_path).
+
+    Returns:
+        A tuple (ticker, output_path), where output_path is None if the stock
+        has no bars to plot.
+    """
+    ticker, data_dir, output_path = job
+    bars = read_bars(ticker, _PANEL, data_dir)
+    if bars.empty:
+        return ticker, None
+
+    _FIGURE.clear()
+    draw_color_plot(_FIGURE.add_subplot(),
+                    *prepare_color_plot(bars.index, bars['close']), ticker)
+    _FIGURE.savefig(output_path)
+    return ticker, output_path
+
+
+@timed()
+def render_charts(tickers=None, data_dir=DATA_DIR, output_dir=OUTPUT_DIR,
+                  image_format="png", workers=None, force=False):
+    """
+    Saves the color plot of many stocks to image files in parallel.
+
+    Args:
+        tickers: A list of ticker symbols to plot. Defaults to every stock in
+        data_dir.
+        data_dir: A string of the folder holding {ticker}data.csv files.
+        output_dir: A string of the folder to save the charts to.
+        image_format: A string of the image format, such as "png" or "svg".
+        workers: An integer of the number of worker processes. Defaults to
+        the number of CPUs.
+        force: If True, redraw every chart even if its data has not changed.
+
+    Returns:
+        A list of the paths of the charts that were drawn. Tickers with no
+        data file or no bars are left out and printed.
+    """
+    paths = find_data_files(data_dir)
+    if tickers is None:
+        tickers = list(paths)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # The manifest remembers the fingerprint of the data each chart was drawn
+    # from, so charts of unchanged data can be skipped
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+
+    jobs = []
+    fingerprints = {}
+    unplotted = [ticker for ticker in tickers if ticker not in paths]
+    count("charts.missing", len(unplotted))
+    for ticker in tickers:
+        if ticker not in paths:
+            continue
+        output_path = os.path.join(output_dir, f"{ticker}.{image_format}")
+        fingerprints[ticker] = csv_fingerprint(paths[ticker])
+        if manifest.get(ticker) == fingerprints[ticker] and \
+                os.path.exists(output_path):
+            continue
+        jobs.append((ticker, data_dir, output_path))
+
+    count("charts.skipped", len(tickers) - len(unplotted) - len(jobs))
+    drawn = []
+    if jobs:
+        workers = workers or os.cpu_count() or 1
+        # A few chunks per worker balances the load without much overhead
+        chunksize = max(1, len(jobs) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker) as executor:
+            for ticker, output_path in executor.map(render_chart, jobs,
+                                                    chunksize=chunksize):
+                manifest[ticker] = fingerprints[ticker]
+                if output_path:
+                    drawn.append(output_path)
+                else:
+                    unplotted.append(ticker)
+
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, sort_keys=True)
+    count("charts.drawn", len(drawn))
+    if unplotted:
+        print(f"No data to plot for {', '.join(unplotted)}")
+    return drawn
+
+
+if __name__ == "__main__":
+    print(f"Drew {len(render_charts())} charts")
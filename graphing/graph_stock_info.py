@@ -8,6 +8,8 @@ import pandas as pd
 from matplotlib.collections import LineCollection
 from matplotlib.colors import ListedColormap, BoundaryNorm
 import matplotlib.pyplot as plt
+from instrumentation import count_read, span, timed
+from series_cache import cached
 
 def days_since_epoch(date):
     """
@@ -39,75 +41,140 @@ def date_from_epoch_time(num_days):
     return dt.date(1970, 1, 1) + dt.timedelta(num_days)
 
 
-def make_color_plot(path, ticker_symbol):
+def fill_calendar_days(bar_days, closes):
     """
-    Create a plot showing the price of a specified stock over time, where
-    increases in the price are green and decreases are red.
+    Fills in the days a stock was not traded, such as weekends, so that the
+    price stays constant while time continues.
 
     Args:
-        path: A string containing the path to the CSV file produced by
-        stock_info.get_stock_info.
-        ticker_symbol: A string of 1-6 uppercase letters representing the
-        ticker symbol for the desired stock.
+        bar_days: A sorted NumPy array of the number of days since January 1,
+        1970 of each bar.
+        closes: A NumPy array of the closing price of each bar.
 
     Returns:
-        A colormapped graph of the price (in USD) of the given stock over
-        time, labeled in terms of months.
+        A tuple (days, filled_closes) where days is every day from the first
+        bar to the last and filled_closes is the close of the most recent bar
+        on or before each day.
     """
-    # Read data from file
-    dataframe = pd.read_csv(path)
-    x_coords = dataframe['timestamp']
-
-    # Cast to list to use insert function later
-    y_coords = list(dataframe['close'])
-
-    # Convert timestamps to date objects
-    x_coords = [dt.datetime.strptime(str(value)[0:10], '%Y-%m-%d').date() for
-                value in x_coords]
+    days = np.arange(bar_days[0], bar_days[-1] + 1)
+    latest_bar = np.searchsorted(bar_days, days, side="right") - 1
+    return days, np.asarray(closes, dtype=np.float64)[latest_bar]
 
-    epoch_offset = days_since_epoch(x_coords[0])
 
-    days_covered = (x_coords[len(x_coords)-1] - x_coords[0]).days
+def prepare_color_plot(timestamps, closes):
+    """
+    Turns a stock's bars into the arrays needed to draw its color plot.
 
-    # Adds data points for weekends where stock prices remain constant
-    # but time continues.
-    for index in range(days_covered - 1):
-        if (days_since_epoch(x_coords[index]) != days_since_epoch(
-                x_coords[index+1]) - 1):
-            x_coords.insert(index + 1, date_from_epoch_time(
-                days_since_epoch(x_coords[index]) + 1))
-            y_coords.insert(index + 1, y_coords[index])
+    Args:
+        timestamps: A sequence of the timestamp of each bar, as strings in the
+        format written by stock_info.get_stock_info, datetime64 values, or a
+        pandas DatetimeIndex.
+        closes: A sequence of the closing price of each bar.
 
-    # Make a copy of x_coords that is integers, not date objects
-    x_coords_ints = np.linspace(epoch_offset, epoch_offset + days_covered,
-                                len(x_coords))
+    Returns:
+        A tuple (days, filled_closes, segments, slopes). days and
+        filled_closes are the calendar-filled arrays from fill_calendar_days.
+        segments is an array of shape (len(days) - 1, 2, 2) of the start and
+        end point of each line segment, and slopes is the change in price
+        over each segment, used to pick its color.
+    """
+    if isinstance(timestamps, pd.DatetimeIndex):
+        bar_days = timestamps.values.astype("datetime64[D]")
+    else:
+        # The first 10 characters of each timestamp are the date
+        bar_days = np.array([str(value)[:10] for value in timestamps],
+                            dtype="datetime64[D]")
+    days, filled_closes = fill_calendar_days(bar_days.astype(np.int64),
+                                             closes)
+
+    points = np.column_stack((days, filled_closes))
+    segments = np.stack((points[:-1], points[1:]), axis=1)
 
     # Get the first derivative of our data to use when
     # determining the color of the line segment
-    slope = np.diff(y_coords)
+    slopes = np.diff(filled_closes)
+    return days, filled_closes, segments, slopes
+
+
+def load_color_plot(path):
+    """
+    Reads a CSV file written by stock_info.get_stock_info and prepares its
+    color plot.
+
+    Args:
+        path: A string of the path to the CSV file.
+
+    Returns:
+        The tuple of arrays returned by prepare_color_plot.
+    """
+    dataframe = pd.read_csv(path, usecols=["timestamp", "close"])
+    count_read(path, len(dataframe))
+    return prepare_color_plot(dataframe['timestamp'], dataframe['close'])
+
+
+def draw_color_plot(axes, days, closes, segments, slopes, ticker_symbol):
+    """
+    Draws a stock's color plot onto a set of axes.
 
+    Args:
+        axes: The matplotlib Axes to draw on.
+        days: A NumPy array of the epoch day of each point.
+        closes: A NumPy array of the price on each day.
+        segments: A NumPy array of the line segments between points.
+        slopes: A NumPy array of the change in price over each segment.
+        ticker_symbol: A string of the ticker symbol, used as the title.
+    """
     # Create colormapping arguments
     colormap = ListedColormap(['r', 'g'])
     norm = BoundaryNorm([-1, 0], colormap.N)
 
-    points = np.array([x_coords_ints, y_coords]).T.reshape((-1, 1, 2))
-    segments = np.concatenate((points[:-1], points[1:]), axis=1)
-
     # Create the line collection object, setting the colormapping parameters.
     # Have to set the actual values used for colormapping separately.
     line_collection = LineCollection(segments, cmap=colormap, norm=norm)
-    line_collection.set_array(slope)
+    line_collection.set_array(slopes)
     line_collection.set_linewidth(2)
 
-    # Make the background of the graph white so we can read text
-    # in dark mode. Must be first.
-    plt.figure(figsize=(12, 6), dpi=100, facecolor="white")
-
     # Add the colored line segments to the graph
-    plt.gca().add_collection(line_collection)
+    axes.add_collection(line_collection)
+
+    axes.set_xlabel("Date")
+    axes.set_ylabel("Price (USD)")
+    axes.set_title(f"{ticker_symbol}")
+    axes.plot(days.astype("datetime64[D]"), closes, ".", color='black',
+              markersize=1)
 
-    plt.xlabel("Date")
-    plt.ylabel("Price (USD)")
-    plt.title(f"{ticker_symbol}")
-    plt.plot(x_coords, y_coords, ".", color='black', markersize=1)
-    plt.show()
+
+@timed()
+def make_color_plot(path, ticker_symbol, save_path=None):
+    """
+    Create a plot showing the price of a specified stock over time, where
+    increases in the price are green and decreases are red.
+
+    Args:
+        path: A string containing the path to the CSV file produced by
+        stock_info.get_stock_info.
+        ticker_symbol: A string of 1-6 uppercase letters representing the
+        ticker symbol for the desired stock.
+        save_path: A string of a file to save the graph to instead of showing
+        it. The format is taken from the extension, such as .png or .svg.
+
+    Returns:
+        A colormapped graph of the price (in USD) of the given stock over
+        time, labeled in terms of months.
+    """
+    # Read data from file, or reuse the arrays prepared from it last time
+    with span("prepare"):
+        plot_data = cached("color_plot", path, load_color_plot)
+
+    # Make the background of the graph white so we can read text
+    # in dark mode. Must be first.
+    with span("draw"):
+        figure = plt.figure(figsize=(12, 6), dpi=100, facecolor="white")
+        draw_color_plot(figure.gca(), *plot_data, ticker_symbol)
+
+    with span("output"):
+        if save_path:
+            figure.savefig(save_path)
+            plt.close(figure)
+        else:
+            plt.show()
@@ -0,0 +1,258 @@
+"""
+Library for measuring where the time goes in a long run. Code marks the
+parts worth timing with span and counts things such as API calls, cache
+hits, and rows parsed with count. Nothing is recorded unless instrumentation
+is enabled, and while it is disabled span and count return right away.
+
+Set the INSTRUMENT environment variable to the path of a JSON file to enable
+instrumentation for a whole run and write the report there when the run
+exits. Set INSTRUMENT_MEMORY=1 as well to record the peak memory of each
+span with tracemalloc. A flamegraph-friendly copy of the spans is written
+next to the report with a .folded extension.
+    INSTRUMENT=run_report.json python -c \
+        "import generate_results as g; g.reddit_overall_comparison()"
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+ENABLED = False
+TRACE_MEMORY = False
+
+# Totals for every span path, keyed by a tuple of the names of the spans it
+# is nested in, and every counter
+_SPANS = {}
+_COUNTERS = Counter()
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_STARTED = time.perf_counter()
+
+
+class _NoSpan:
+    """
+    The span returned while instrumentation is disabled, which does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    """
+    A timed section of code, recorded under the names of every span it is
+    nested in on the same thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.path = None
+        self.start = 0.0
+        self.child_seconds = 0.0
+        self.peak = 0
+
+    def __enter__(self):
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.path = (parent.path if parent else ()) + (self.name,)
+        if TRACE_MEMORY and tracemalloc.is_tracing():
+            # Fold the parent's peak so far into it before measuring ours
+            if parent:
+                parent.peak = max(parent.peak,
+                                  tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        stack = _stack()
+        stack.pop()
+        parent = stack[-1] if stack else None
+        if parent:
+            parent.child_seconds += seconds
+        if TRACE_MEMORY and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if parent:
+                parent.peak = max(parent.peak, self.peak)
+            tracemalloc.reset_peak()
+
+        with _LOCK:
+            totals = _SPANS.setdefault(self.path, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += seconds - self.child_seconds
+            totals[3] = max(totals[3], self.peak)
+        return False
+
+
+def _stack():
+    stack = getattr(_LOCAL, "stack", None)
+    if stack is None:
+        stack = _LOCAL.stack = []
+    return stack
+
+
+def span(name):
+    """
+    Times a section of code when instrumentation is enabled. Use it as a
+    context manager:
+        with span("alpaca.bars"):
+            ...
+
+    Args:
+        name: A string naming the section, such as "alpaca.bars".
+
+    Returns:
+        A context manager that records the section's time when it exits.
+    """
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(name)
+
+
+def timed(name=None):
+    """
+    Makes a decorator that times every call of a function as a span.
+
+    Args:
+        name: A string naming the span. Defaults to the function's module and
+        name.
+
+    Returns:
+        A decorator for a function.
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _Span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Adds to a counter when instrumentation is enabled.
+
+    Args:
+        name: A string naming the counter, such as "api_calls.alpaca".
+        value: The number to add.
+    """
+    if ENABLED:
+        with _LOCK:
+            _COUNTERS[name] += value
+
+
+def count_read(path, rows):
+    """
+    Counts a file that was read and the rows parsed from it when
+    instrumentation is enabled.
+
+    Args:
+        path: A string of the path of the file.
+        rows: An integer of the number of rows parsed from it.
+    """
+    if ENABLED:
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with _LOCK:
+            _COUNTERS["files_read"] += 1
+            _COUNTERS["bytes_read"] += size
+            _COUNTERS["rows_parsed"] += rows
+
+
+def enable(trace_memory=False):
+    """
+    Starts recording spans and counters.
+
+    Args:
+        trace_memory: If True, also record the peak memory of each span with
+        tracemalloc, which slows the program down noticeably.
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = True
+    TRACE_MEMORY = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Stops recording spans and counters. What was recorded is kept.
+    """
+    global ENABLED, TRACE_MEMORY
+    ENABLED = False
+    if TRACE_MEMORY and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    TRACE_MEMORY = False
+
+
+def reset():
+    """
+    Throws away every recorded span and counter.
+    """
+    global _STARTED
+    with _LOCK:
+        _SPANS.clear()
+        _COUNTERS.clear()
+        _STARTED = time.perf_counter()
+
+
+def report():
+    """
+    Summarizes everything recorded since the last reset.
+
+    Returns:
+        A dictionary with the keys wall_seconds; counters, mapping each
+        counter name to its value; and spans, a list with one dictionary per
+        span path, slowest first, giving the path (span names joined by ";"),
+        calls, total_seconds, self_seconds (excluding nested spans), and
+        peak_bytes (0 unless memory was traced).
+    """
+    with _LOCK:
+        spans = [{"path": ";".join(path), "calls": calls,
+                  "total_seconds": total, "self_seconds": own,
+                  "peak_bytes": peak}
+                 for path, (calls, total, own, peak) in _SPANS.items()]
+        counters = dict(sorted(_COUNTERS.items()))
+    spans.sort(key=lambda entry: entry["total_seconds"], reverse=True)
+    return {"wall_seconds": time.perf_counter() - _STARTED,
+            "counters": counters, "spans": spans}
+
+
+def write_report(path):
+    """
+    Writes the report to a JSON file, and the self time of every span in
+    microseconds to a .folded file next to it that flamegraph.pl and
+    speedscope can read.
+
+    Args:
+        path: A string of the path of the JSON file.
+    """
+    summary = report()
+    with open(path, "w") as file:
+        json.dump(summary, file, indent=2)
+    with open(os.path.splitext(path)[0] + ".folded", "w") as file:
+        for entry in summary["spans"]:
+            file.write(f"{entry['path']} "
+                       f"{round(entry['self_seconds'] * 1e6)}\n")
+
+
+if os.environ.get("INSTRUMENT"):
+    enable(trace_memory=os.environ.get("INSTRUMENT_MEMORY") == "1")
+    atexit.register(write_report, os.environ["INSTRUMENT"])
@@ -0,0 +1,392 @@
+"""
+Runs the whole analysis, from pulling Reddit posts to drawing the graphs, as
+a graph of stages. Each stage declares the files it reads and writes, so a
+stage runs after the stages that make its inputs, and stages that do not
+depend on each other run at the same time in separate processes. A
+fingerprint of each stage's inputs, settings, and outputs is saved after it
+runs, and stages whose fingerprint has not changed are skipped, so running
+the pipeline again without changes returns almost at once.
+
+Run from the top of the repository, for example:
+    python pipeline.py --begin 2018-01-01 --end 2018-12-31
+    python pipeline.py --dry-run
+    python pipeline.py --touch reddit_data
+    python pipeline.py --force bar_graph
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from analysis.ledger import LEDGER_PATH
+from generate_results import COMPARE_TICKERS
+from reddit.submission_store import STORE_DIR, SUBMISSIONS_PATH
+from stock_info.bar_cache import CACHE_DIR
+from stock_info.price_panel import DATA_DIR
+from stock_info.ticker_index import INDEX_PATH
+
+STATE_PATH = "pipeline_state.json"
+CHART_DIR = "graphing/charts"
+
+# A step of the pipeline. target is the function to run, written as
+# "module:function" so it is only imported by the process that runs it,
+# and params are the keyword arguments to call it with. inputs and outputs
+# are lists of the files or folders the stage reads and writes. after is a
+# list of the names of stages to wait for without reading their outputs,
+# such as stages that add to the same bar cache.
+Stage = namedtuple("Stage", ["name", "target", "inputs", "outputs",
+                             "params", "after"], defaults=[()])
+
+
+def default_stages(limit=100000, beginning_day="2018-01-01",
+                   end_day="2018-12-31"):
+    """
+    Lists the stages of the Reddit versus S&P 500 analysis.
+
+    Args:
+        limit: An int of the most Reddit submissions to pull.
+        beginning_day: A string of the first day to pull posts from, in the
+        format YYYY-MM-DD.
+        end_day: A string of the last day to pull posts from, in the format
+        YYYY-MM-DD.
+
+    Returns:
+        A list of Stages.
+    """
+    store = os.path.join(STORE_DIR, "meta.json")
+    bar_index = os.path.join(CACHE_DIR, "index.json")
+    stock_data = [os.path.join(DATA_DIR, f"{ticker}data.csv")
+                  for ticker in COMPARE_TICKERS]
+    return [
+        Stage("reddit_data", "reddit.pmaw_api:get_filtered_reddit_data",
+              [], [SUBMISSIONS_PATH],
+              {"limit": limit, "beginning_day": beginning_day,
+               "end_day": end_day, "output_path": SUBMISSIONS_PATH}),
+        Stage("submission_store", "reddit.submission_store:build_store",
+              [SUBMISSIONS_PATH], [store], {}),
+        Stage("reddit_stock_info", "generate_results:get_reddit_stock_info",
+              [store], [INDEX_PATH], {}),
+        Stage("overall_comparison",
+              "generate_results:reddit_overall_comparison",
+              [store, INDEX_PATH], [LEDGER_PATH], {}),
+        # The stages below read bars the comparison downloaded and top up
+        # the same bar cache, so they take turns with it
+        Stage("bar_graph", "generate_results:make_bar_graph",
+              [store, bar_index], [os.path.join(CHART_DIR, "bar_graph.png")],
+              {"save_path": os.path.join(CHART_DIR, "bar_graph.png")},
+              ["overall_comparison"]),
+        Stage("stock_data", "generate_results:write_stock_data",
+              [bar_index], stock_data,
+              {"beginning_day": beginning_day, "end_day": end_day},
+              ["bar_graph"]),
+        Stage("compare_plot", "generate_results:compare_stock_plot",
+              stock_data,
+              [os.path.join(CHART_DIR, "compare_stock_plot.png")],
+              {"save_path": os.path.join(CHART_DIR,
+                                         "compare_stock_plot.png")}),
+    ]
+
+
+def path_fingerprint(path):
+    """
+    Gets a cheap fingerprint of a file or of every file in a folder, which
+    changes whenever one of them is written, added, or removed.
+
+    Args:
+        path: A string of the path to a file or folder.
+
+    Returns:
+        A list of [relative path, modification time in nanoseconds, size]
+        entries, which is empty if the path does not exist.
+    """
+    if os.path.isfile(path):
+        stats = os.stat(path)
+        return [[".", stats.st_mtime_ns, stats.st_size]]
+    entries = []
+    for folder, _, names in os.walk(path):
+        for name in names:
+            file_path = os.path.join(folder, name)
+            stats = os.stat(file_path)
+            entries.append([os.path.relpath(file_path, path),
+                            stats.st_mtime_ns, stats.st_size])
+    return sorted(entries)
+
+
+def digest(stage, paths):
+    """
+    Hashes a stage's settings together with the fingerprints of some files.
+
+    Args:
+        stage: The Stage.
+        paths: A list of the files or folders to include.
+
+    Returns:
+        A string of hexadecimal digits.
+    """
+    contents = json.dumps([stage.target, stage.params,
+                           [[path, path_fingerprint(path)]
+                            for path in paths]], sort_keys=True)
+    return hashlib.sha1(contents.encode()).hexdigest()
+
+
+def stage_dependencies(stages):
+    """
+    Works out which stages each stage has to wait for, from the files they
+    read and write.
+
+    Args:
+        stages: A list of Stages.
+
+    Returns:
+        A dictionary mapping each stage name to the set of names of the
+        stages that write one of its inputs or that it is listed to run
+        after.
+    """
+    # Several stages may write into the same folder
+    writers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            writers.setdefault(os.path.normpath(output), set()).add(
+                stage.name)
+    dependencies = {}
+    for stage in stages:
+        dependencies[stage.name] = set(stage.after)
+        for path in map(os.path.normpath, stage.inputs):
+            for output, names in writers.items():
+                # A stage that writes into a folder also changes the folder,
+                # and one that writes a folder makes the files inside it
+                if path == output or output.startswith(path + os.sep) or \
+                        path.startswith(output + os.sep):
+                    dependencies[stage.name].update(names - {stage.name})
+    return dependencies
+
+
+def stage_order(stages, dependencies):
+    """
+    Sorts stages so that every stage comes after the stages it depends on.
+
+    Args:
+        stages: A list of Stages.
+        dependencies: The dictionary returned by stage_dependencies.
+
+    Returns:
+        A list of the Stages in an order they can be run in one at a time.
+
+    Raises:
+        ValueError: If the stages depend on each other in a cycle.
+    """
+    order = []
+    placed = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining
+                 if dependencies[stage.name] <= placed]
+        if not ready:
+            names = ", ".join(stage.name for stage in remaining)
+            raise ValueError(f"stages depend on each other in a cycle: "
+                             f"{names}")
+        order += ready
+        placed.update(stage.name for stage in ready)
+        remaining = [stage for stage in remaining if stage not in ready]
+    return order
+
+
+def is_up_to_date(stage, state):
+    """
+    Checks whether a stage's last run is still current: its inputs and
+    settings are unchanged and its outputs are still as it left them.
+
+    Args:
+        stage: The Stage.
+        state: A dictionary mapping stage names to their saved fingerprints.
+
+    Returns:
+        True if the stage can be skipped, False if it has to run.
+    """
+    saved = state.get(stage.name)
+    return saved is not None and \
+        all(os.path.exists(path) for path in stage.outputs) and \
+        saved["inputs"] == digest(stage, stage.inputs) and \
+        saved["outputs"] == digest(stage, stage.outputs)
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def run_target(target, params):
+    """
+    Imports and calls a stage's function. Runs in a worker process.
+
+    Args:
+        target: A string of the function, written as "module:function".
+        params: A dictionary of keyword arguments to call it with.
+    """
+    module_name, function_name = target.split(":")
+    getattr(importlib.import_module(module_name), function_name)(**params)
+
+
+def load_state(state_path=STATE_PATH):
+    """
+    Loads the fingerprints saved after each stage last ran.
+    """
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as file:
+        return json.load(file)
+
+
+def save_state(state, state_path=STATE_PATH):
+    """
+    Saves the fingerprints of each stage, replacing the file in one step.
+    """
+    with open(state_path + ".tmp", "w") as file:
+        json.dump(state, file, indent=1, sort_keys=True)
+    os.replace(state_path + ".tmp", state_path)
+
+
+def _record(stage, state, state_path):
+    # Inputs are fingerprinted after the run, so a stage that also updates
+    # one of its inputs is not rerun for it
+    state[stage.name] = {"inputs": digest(stage, stage.inputs),
+                         "outputs": digest(stage, stage.outputs)}
+    save_state(state, state_path)
+
+
+def run_pipeline(stages, state_path=STATE_PATH, force=(), touch=(),
+                 workers=None, dry_run=False, log=print):
+    """
+    Runs every stage that is out of date, after the stages it depends on,
+    with independent stages running in parallel.
+
+    Args:
+        stages: A list of Stages.
+        state_path: A string of the JSON file the fingerprints are saved in.
+        force: A list of the names of stages to run even if up to date.
+        touch: A list of the names of stages to record as up to date without
+        running them, for outputs that were made by hand or by an earlier
+        version of the code.
+        workers: An integer of the most stages to run at once. Defaults to
+        the number of CPUs.
+        dry_run: If True, only report which stages are out of date. A stage
+        downstream of one that will run is reported as out of date too.
+        log: A function that takes a line of progress to report.
+
+    Returns:
+        A dictionary mapping each stage name to "ran", "skipped", "touched",
+        "failed", or "blocked" (a stage it depends on failed). A dry run
+        gives "stale" or "skipped".
+    """
+    state = load_state(state_path)
+    dependencies = stage_dependencies(stages)
+    stages = stage_order(stages, dependencies)
+    by_name = {stage.name: stage for stage in stages}
+    results = {}
+
+    if dry_run:
+        for stage in stages:
+            stale = stage.name in force or \
+                not is_up_to_date(stage, state) or \
+                any(results[name] == "stale"
+                    for name in dependencies[stage.name])
+            results[stage.name] = "stale" if stale else "skipped"
+            log(f"{stage.name:20} {results[stage.name]}")
+        return results
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                             initializer=_init_worker) as executor:
+        while len(results) < len(stages):
+            for stage in stages:
+                if stage.name in results or stage.name in running.values():
+                    continue
+                waiting_on = [results.get(name) for name in
+                              dependencies[stage.name]]
+                if any(result in ("failed", "blocked")
+                       for result in waiting_on):
+                    results[stage.name] = "blocked"
+                    log(f"{stage.name:20} blocked")
+                elif None in waiting_on:
+                    continue
+                elif stage.name in touch:
+                    _record(stage, state, state_path)
+                    results[stage.name] = "touched"
+                    log(f"{stage.name:20} marked up to date")
+                elif stage.name not in force and \
+                        is_up_to_date(stage, state):
+                    results[stage.name] = "skipped"
+                    log(f"{stage.name:20} up to date")
+                else:
+                    log(f"{stage.name:20} running")
+                    for path in stage.outputs:
+                        os.makedirs(os.path.dirname(path) or ".",
+                                    exist_ok=True)
+                    future = executor.submit(run_target, stage.target,
+                                             stage.params)
+                    running[future] = stage.name
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = by_name[running.pop(future)]
+                if future.exception() is not None:
+                    # A failed run may have left partial outputs behind
+                    if state.pop(stage.name, None) is not None:
+                        save_state(state, state_path)
+                    results[stage.name] = "failed"
+                    log(f"{stage.name:20} failed: {future.exception()!r}")
+                    continue
+                _record(stage, state, state_path)
+                results[stage.name] = "ran"
+                log(f"{stage.name:20} done")
+    return results
+
+
+def main(argv=None):
+    """
+    Runs the pipeline from the command line, exiting with status 1 if any
+    stage failed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--limit", type=int, default=100000,
+                        help="most Reddit submissions to pull")
+    parser.add_argument("--begin", default="2018-01-01",
+                        help="first day to pull posts from, YYYY-MM-DD")
+    parser.add_argument("--end", default="2018-12-31",
+                        help="last day to pull posts from, YYYY-MM-DD")
+    parser.add_argument("--force", action="append", default=[],
+                        help="stage to run even if up to date, may be "
+                        "repeated, or 'all'")
+    parser.add_argument("--touch", action="append", default=[],
+                        help="stage to mark as up to date without running "
+                        "it, may be repeated, or 'all'")
+    parser.add_argument("--workers", type=int,
+                        help="most stages to run at once")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only list the stages that are out of date")
+    args = parser.parse_args(argv)
+
+    stages = default_stages(args.limit, args.begin, args.end)
+    names = [stage.name for stage in stages]
+    force = names if "all" in args.force else args.force
+    touch = names if "all" in args.touch else args.touch
+    unknown = set(force + touch) - set(names)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+
+    start = time.perf_counter()
+    results = run_pipeline(stages, force=force, touch=touch,
+                           workers=args.workers, dry_run=args.dry_run)
+    print(f"Finished in {time.perf_counter() - start:.2f}s")
+    if "failed" in results.values():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
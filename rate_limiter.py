@@ -0,0 +1,171 @@
+"""
+Library for keeping API requests under each service's rate limit. Requests
+only wait when they would go over the limit, and requests that are rejected
+for being too fast or because of a server error are retried with jittered
+exponential backoff.
+"""
+import random
+import threading
+import time
+from instrumentation import count, span
+
+# Requests per second and burst size for each API we use. Alpaca's free plan
+# allows 200 requests per minute, and Pushshift asks for about one a second.
+RATE_LIMITS = {
+    "alpaca": (200 / 60, 10),
+    "pushshift": (1, 5),
+}
+
+# HTTP status codes that mean a request should be tried again later
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    A token bucket that allows short bursts of requests while keeping the
+    long-run request rate under a limit. Safe to share between threads.
+
+    Attributes:
+        rate: A float of the number of tokens added to the bucket per second.
+        burst: An integer of the most tokens the bucket can hold.
+        tokens: A float of the number of tokens currently in the bucket.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic,
+                 sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, waiting only as long as it takes for
+        enough of them to be added.
+
+        Args:
+            tokens: The number of tokens the request uses.
+
+        Returns:
+            A float of the number of seconds spent waiting.
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0, (tokens - self.tokens) / self.rate)
+            # Spend the tokens now so other threads queue up behind us
+            self.tokens -= tokens
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+_LIMITERS = {}
+
+
+def get_limiter(api_name):
+    """
+    Gets the shared rate limiter for an API, creating it from RATE_LIMITS the
+    first time it is asked for.
+
+    Args:
+        api_name: A string key of RATE_LIMITS, such as "alpaca".
+
+    Returns:
+        The RateLimiter shared by every request to that API.
+    """
+    if api_name not in _LIMITERS:
+        rate, burst = RATE_LIMITS[api_name]
+        _LIMITERS[api_name] = RateLimiter(rate, burst)
+    return _LIMITERS[api_name]
+
+
+def set_rate_limit(api_name, rate, burst=1):
+    """
+    Changes the rate limit used for an API.
+
+    Args:
+        api_name: A string naming the API, such as "alpaca".
+        rate: A float of the number of requests allowed per second.
+        burst: An integer of the most requests allowed back to back.
+    """
+    RATE_LIMITS[api_name] = (rate, burst)
+    _LIMITERS[api_name] = RateLimiter(rate, burst)
+
+
+def get_status_code(error):
+    """
+    Finds the HTTP status code behind an exception raised by an API client.
+
+    Args:
+        error: The exception that was raised.
+
+    Returns:
+        An integer HTTP status code, or None if the error does not have one.
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=30):
+    """
+    Picks how long to wait before retrying a request, using "full jitter"
+    exponential backoff so that clients do not retry in lockstep.
+
+    Args:
+        attempt: The number of times the request has already failed.
+        base_delay: A float of the number of seconds to wait after the first
+        failure, on average doubled.
+        max_delay: A float of the longest wait in seconds.
+
+    Returns:
+        A float of the number of seconds to wait.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def call_with_backoff(api_name, func, *args, retries=5, sleep=time.sleep,
+                      **kwargs):
+    """
+    Calls an API function once the API's rate limiter allows it, retrying
+    with backoff if the request is rate limited or hits a server error.
+
+    Args:
+        api_name: A string key of RATE_LIMITS naming the API being called.
+        func: The function that makes the request.
+        *args: Positional arguments to pass to func.
+        retries: An integer of the most times to retry the request.
+        sleep: The function used to wait between retries.
+        **kwargs: Keyword arguments to pass to func.
+
+    Returns:
+        Whatever func returns.
+    """
+    limiter = get_limiter(api_name)
+    attempt = 0
+    while True:
+        with span(f"{api_name}.wait"):
+            limiter.acquire()
+        count(f"api_calls.{api_name}")
+        try:
+            with span(f"{api_name}.request"):
+                return func(*args, **kwargs)
+        except Exception as error:
+            if attempt >= retries or \
+                    get_status_code(error) not in RETRY_STATUS_CODES:
+                raise
+            count(f"api_retries.{api_name}")
+            with span(f"{api_name}.backoff"):
+                sleep(backoff_delay(attempt))
+            attempt += 1
@@ -0,0 +1,111 @@
+"""
+Library for deciding whether Reddit posts recommend buying a stock. A single
+call finds a post's tickers and whether it asks a question or mentions going
+long or short, replacing the four separate searches done by find_tickers,
+find_qmarks, find_long and find_short. The checks that reject a post run
+first and stop at the first hit, so rejected posts are usually only partly
+scanned and tickers are only extracted from posts that pass.
+"""
+import re
+from collections import namedtuple
+import pandas as pd
+
+TICKER_PATTERN = r"\$([A-Z]+)"
+LONG_PATTERN = r"[Ll]ong "
+SHORT_PATTERN = r"[Ss]hort "
+TICKER_REGEX = re.compile(TICKER_PATTERN)
+LONG_REGEX = re.compile(LONG_PATTERN)
+SHORT_REGEX = re.compile(SHORT_PATTERN)
+
+Classification = namedtuple(
+    "Classification", ["tickers", "has_qmark", "has_long", "has_short"])
+
+
+def classify_text(string, early_exit=True, matcher=None):
+    """
+    Searches a string for stock tickers, question marks, and the words long
+    and short.
+
+    Args:
+        string: A string to be searched.
+        early_exit: If True, stop as soon as the string is known to be
+        rejected, leaving the fields that were not checked yet as False or
+        empty.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
+
+    Returns:
+        A Classification of the list of tickers in the string, in order and
+        with repeats, and whether it contains a question mark, long, or short.
+    """
+    # A plain substring test is much faster than a regex for one character
+    has_qmark = "?" in string
+    if has_qmark and early_exit:
+        return Classification([], True, False, False)
+    has_short = SHORT_REGEX.search(string) is not None
+    if has_short and early_exit:
+        return Classification([], has_qmark, False, True)
+    has_long = LONG_REGEX.search(string) is not None
+    if not has_long and early_exit:
+        return Classification([], has_qmark, False, has_short)
+    if matcher is not None:
+        tickers = matcher.find_tickers(string)
+    else:
+        tickers = TICKER_REGEX.findall(string) if "$" in string else []
+    return Classification(tickers, has_qmark, has_long, has_short)
+
+
+def is_recommendation(classification):
+    """
+    Checks whether a classified post should be kept: it must contain a stock
+    ticker and the word long, and no question mark or the word short.
+
+    Args:
+        classification: A Classification returned by classify_text.
+
+    Returns:
+        True if the post recommends buying a stock, False otherwise.
+    """
+    return bool(classification.tickers) and classification.has_long and \
+        not classification.has_qmark and not classification.has_short
+
+
+def classify_series(texts, matcher=None):
+    """
+    Classifies a whole column of post text at once using pandas string
+    methods. Like classify_text, each check only runs on the posts that have
+    not been rejected by an earlier one.
+
+    Args:
+        texts: A pandas series of strings to be searched.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
+
+    Returns:
+        A dataframe with the same index as texts and the columns has_qmark,
+        has_short, has_long, tickers (a list per row, empty for rejected
+        posts), and accepted, which is True for posts that recommend buying a
+        stock. Checks that were skipped for a post are left as False.
+    """
+    texts = texts.astype(str)
+    result = pd.DataFrame(False, index=texts.index,
+                          columns=["has_qmark", "has_short", "has_long"])
+    result["has_qmark"] = texts.str.contains("?", regex=False)
+
+    remaining = ~result["has_qmark"]
+    result.loc[remaining, "has_short"] = \
+        texts[remaining].str.contains(SHORT_PATTERN, regex=True)
+    remaining &= ~result["has_short"]
+    result.loc[remaining, "has_long"] = \
+        texts[remaining].str.contains(LONG_PATTERN, regex=True)
+    remaining &= result["has_long"]
+
+    tickers = pd.Series([[] for _ in range(len(texts))], index=texts.index,
+                        dtype=object)
+    if matcher is not None:
+        tickers[remaining] = matcher.find_series(texts[remaining])
+    else:
+        tickers[remaining] = texts[remaining].str.findall(TICKER_PATTERN)
+    result["tickers"] = tickers
+    result["accepted"] = remaining & (tickers.str.len() > 0)
+    return result
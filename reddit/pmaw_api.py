@@ -3,23 +3,82 @@ Library for pulling and filtering Reddit data.
 """
 
 import re
+import os
+import json
 import datetime
+import heapq
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from pmaw import PushshiftAPI
+from api_clients import get_client
+from instrumentation import count, timed
+from reddit.classifier import classify_text, is_recommendation
+from symbol_registry import SymbolSet
 
-api = PushshiftAPI()
+# Length of the time slices posts are pulled in when streaming, in seconds
+STREAM_SLICE_SECONDS = 7 * 24 * 60 * 60
 
+# Number of time shards pulled at once by stream_sharded_posts
+SHARD_WORKERS = 4
 
-def find_tickers(string):
+# The only submission fields we use, which are all we ask Pushshift for
+SUBMISSION_FIELDS = ["id", "title", "selftext", "created_utc"]
+
+
+class Submission(namedtuple("Submission", SUBMISSION_FIELDS)):
+    """
+    A compact record of the fields we keep from a Reddit submission. Being a
+    tuple it is much smaller than the dictionary Pushshift returns, and its
+    fields can be read by name like a dictionary, such as post['title'].
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            # Only fields, not tuple methods such as count or index
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        """
+        Gets a field by name, or default if there is no such field.
+        """
+        return getattr(self, key) if key in self._fields else default
+
+
+def project_submissions(submissions):
+    """
+    Turns the submissions returned by Pushshift into compact records one at
+    a time, so the fields we don't use are dropped as soon as each one is
+    read.
+
+    Args:
+        submissions: An iterable of submission dictionaries.
+
+    Yields:
+        A Submission for each submission.
+    """
+    for post in submissions:
+        yield Submission(post.get('id'), post.get('title'),
+                         post.get('selftext'), post['created_utc'])
+
+
+def find_tickers(string, matcher=None):
     """
     Searches a string for stock tickers.
 
     Args:
         string: A string to be searched.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
 
     Returns:
         A list of all the stock tickers in the string.
     """
+    if matcher is not None:
+        return matcher.find_tickers(string)
     return re.findall(r"\$([A-Z]+)", string)
 
 
@@ -101,16 +160,14 @@ def remove_dupes(str_list):
         The original list of strings with any repeat elements or empty string
         elements removed.
     """
-    res = []
-    for string in str_list:
-        if string not in res:
-            res.append(string)
-    if '' in res:
-        res.remove('')
-    return res
+    # dict keys keep the first occurrence of each string, in order
+    res = dict.fromkeys(str_list)
+    res.pop('', None)
+    return list(res)
 
 
-def pull_raw_data(subreddit, limit, beginning_day, end_day):
+def pull_raw_data(subreddit, limit, beginning_day, end_day, shard_days=None,
+                  workers=SHARD_WORKERS):
     """
     Uses PMAW pushshift API wrapper to collect reddit Submission data from a
     specified subreddit.
@@ -124,6 +181,10 @@ def pull_raw_data(subreddit, limit, beginning_day, end_day):
         that is the beginning of your search time window.
         end_day: A date represented as a string in "YXXX-MX-DX" format
         that is the end of your search time window.
+        shard_days: An integer of the length in days of the time shards to
+        pull at once with stream_sharded_posts, or None to pull the whole
+        window with one request.
+        workers: An integer of the number of shards to pull at once.
 
     Returns:
         A dataframe containing the titles, body text, and date written
@@ -132,20 +193,317 @@ def pull_raw_data(subreddit, limit, beginning_day, end_day):
     beginning_timestamp = str_create_timestamp(beginning_day)
     end_timestamp = str_create_timestamp(end_day)
 
-    submissions = api.search_submissions(subreddit=subreddit, limit=limit,
-                                         before=end_timestamp, after=beginning_timestamp)
-
-    subs_df = pd.DataFrame(submissions)
+    if shard_days:
+        # The shards are merged in order, so there is nothing left to sort
+        subs_df = pd.DataFrame.from_records(
+            stream_sharded_posts(subreddit, limit, beginning_timestamp,
+                                 end_timestamp, shard_days * 86400, workers),
+            columns=SUBMISSION_FIELDS)
+        subs_df = subs_df[['title', 'selftext', 'created_utc']]
+        print(len(subs_df))
+        return subs_df
+
+    submissions = get_client("pushshift").search_submissions(
+        subreddit=subreddit, limit=limit, filter=SUBMISSION_FIELDS,
+        before=end_timestamp, after=beginning_timestamp)
+
+    subs_df = pd.DataFrame.from_records(
+        project_submissions(submissions), columns=SUBMISSION_FIELDS)
     subs_df = subs_df[['title', 'selftext', 'created_utc']]
     subs_df = subs_df.sort_values(by='created_utc')
     print(len(subs_df))
     return subs_df
 
 
-def get_filtered_reddit_data(limit, beginning_day, end_day):
+def split_window(beginning_timestamp, end_timestamp, shard_seconds):
+    """
+    Splits a time window into shards that can be pulled separately. Both
+    ends of a Pushshift search are exclusive, so each shard starts one
+    second before the previous one ends, and together they cover every
+    second of the window exactly once.
+
+    Args:
+        beginning_timestamp: An integer timestamp; only posts made after it
+        are covered.
+        end_timestamp: An integer timestamp; only posts made before it are
+        covered.
+        shard_seconds: An integer of the length of each shard, at least 2.
+
+    Returns:
+        A list of (after, before) timestamp pairs in time order.
+    """
+    shards = []
+    shard_start = beginning_timestamp
+    while shard_start < end_timestamp - 1:
+        shard_end = min(shard_start + shard_seconds, end_timestamp)
+        shards.append((shard_start, shard_end))
+        shard_start = shard_end - 1
+    return shards
+
+
+def _post_order(post):
+    return post['created_utc'], str(post['id'])
+
+
+def pull_shard(client, subreddit, limit, after, before):
+    """
+    Pulls the submissions in one time shard.
+
+    Args:
+        client: The Pushshift client to search with.
+        subreddit: A string that is the name of the subreddit.
+        limit: An int of the most submissions to pull.
+        after: An integer timestamp; only posts made after it are pulled.
+        before: An integer timestamp; only posts made before it are pulled.
+
+    Returns:
+        A list of the Submission of each post, sorted by created_utc and
+        then id.
+    """
+    submissions = client.search_submissions(
+        subreddit=subreddit, limit=limit, filter=SUBMISSION_FIELDS,
+        before=before, after=after)
+    posts = sorted(project_submissions(submissions), key=_post_order)
+    count("reddit.posts_pulled", len(posts))
+    return posts
+
+
+def merge_shards(shards):
+    """
+    Merges sorted lists of posts into one stream in time order, dropping
+    posts that appear more than once.
+
+    Args:
+        shards: A list of lists of posts, each sorted as pull_shard sorts
+        them.
+
+    Yields:
+        Each distinct post, in increasing order of created_utc.
+    """
+    # Copies of a post are posted at the same second, so they come out of
+    # the merge next to each other and only that second's ids are kept
+    current_second = None
+    seen = set()
+    for post in heapq.merge(*shards, key=_post_order):
+        if post['created_utc'] != current_second:
+            current_second = post['created_utc']
+            seen = set()
+        key = post['id'] if post['id'] is not None else \
+            (post['title'], post['selftext'])
+        if key not in seen:
+            seen.add(key)
+            yield post
+
+
+def stream_sharded_posts(subreddit, limit, beginning_timestamp,
+                         end_timestamp, shard_seconds=STREAM_SLICE_SECONDS,
+                         workers=SHARD_WORKERS, client=None):
+    """
+    Pulls Reddit submissions from many time shards at once and yields them
+    in the order they were posted. Shards are pulled by a pool of threads
+    that share the Pushshift rate limit, one group of shards ahead of the
+    posts being yielded, and each group of shards is combined with a k-way
+    merge. Shards past the limit are never requested.
+
+    Args:
+        subreddit: A string that is the name of the subreddit you want to pull
+        data from.
+        limit: An int representing the maximum amount of reddit submissions you
+        want to collect.
+        beginning_timestamp: An integer timestamp; only posts made after it
+        are pulled.
+        end_timestamp: An integer timestamp; only posts made before it are
+        pulled.
+        shard_seconds: An integer of the length of each time shard.
+        workers: An integer of the number of shards to pull at once.
+        client: The Pushshift client to search with. Defaults to the shared
+        client from get_client.
+
+    Yields:
+        A Submission for each post, in increasing order of created_utc.
+    """
+    client = client or get_client("pushshift")
+    shards = deque(split_window(beginning_timestamp, end_timestamp,
+                                shard_seconds))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    pulled = 0
+
+    def submit_group():
+        # No shard needs more than the posts still missing from the limit
+        for _ in range(min(workers, len(shards))):
+            after, before = shards.popleft()
+            pending.append(executor.submit(
+                pull_shard, client, subreddit, limit - pulled, after,
+                before))
+
+    try:
+        while shards or pending:
+            if not pending:
+                submit_group()
+            group = [pending.popleft().result()
+                     for _ in range(min(workers, len(pending)))]
+            # Keep the next group of shards downloading while this one is
+            # merged and yielded, unless this one already reaches the limit
+            if pulled + sum(len(shard) for shard in group) < limit:
+                submit_group()
+            for post in merge_shards(group):
+                if pulled >= limit:
+                    return
+                pulled += 1
+                yield post
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def stream_raw_posts(subreddit, limit, beginning_timestamp, end_timestamp,
+                     slice_seconds=STREAM_SLICE_SECONDS):
+    """
+    Pulls Reddit submissions one time slice at a time and yields them in the
+    order they were posted, so the whole window never has to be held in
+    memory at once.
+
+    Args:
+        subreddit: A string that is the name of the subreddit you want to pull
+        data from.
+        limit: An int representing the maximum amount of reddit submissions you
+        want to collect.
+        beginning_timestamp: An integer timestamp; only posts made after it
+        are pulled.
+        end_timestamp: An integer timestamp; only posts made before it are
+        pulled.
+        slice_seconds: An integer of the length of each time slice.
+
+    Yields:
+        A Submission for each post, in increasing order of created_utc. Only
+        one time slice of posts is held in memory at once, however many
+        posts are pulled.
+    """
+    pulled = 0
+    slice_start = beginning_timestamp
+    while slice_start < end_timestamp - 1 and pulled < limit:
+        slice_end = min(slice_start + slice_seconds, end_timestamp)
+        submissions = get_client("pushshift").search_submissions(
+            subreddit=subreddit, limit=limit - pulled,
+            filter=SUBMISSION_FIELDS, before=slice_end, after=slice_start)
+        posts = sorted(project_submissions(submissions),
+                       key=lambda post: post.created_utc)
+        count("reddit.posts_pulled", len(posts))
+        for post in posts:
+            yield post
+        pulled += len(posts)
+        # Pushshift's after is exclusive, so the next slice starts at the
+        # last second of this one
+        slice_start = slice_end - 1
+
+
+def filter_post(title, selftext, existing_tickers, matcher=None):
+    """
+    Decides whether a Reddit post recommends buying stocks we have not seen
+    yet, and records its new tickers as seen.
+
+    Args:
+        title: A string of the title of the post.
+        selftext: A string of the body text of the post.
+        existing_tickers: A SymbolSet of the tickers already recommended by
+        earlier posts. New tickers from this post are added to it.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign. Defaults to only finding $TICKER cashtags.
+
+    Returns:
+        A list of the tickers first recommended by this post, which is empty
+        if the post should be left out.
+    """
+    # Combine the title and text for string searches. Must separate with
+    # space to prevent first letter of text being added to ticker in title.
+    all_text = title + " " + selftext
+
+    # Removes reddit submissions that don't contain a stock ticker or
+    # the word long.
+    # Removes reddit submissions that contain a question mark or
+    # the word short.
+    classification = classify_text(all_text, matcher=matcher)
+    if not is_recommendation(classification):
+        return []
+
+    # Remove duplicates from the list of all the stock tickers in a post
+    ticker_list = remove_dupes(classification.tickers)
+
+    # filter out all but the first mention of each stock ticker
+    new_ticker_list = []
+    for ticker in ticker_list:
+        if existing_tickers.add(ticker):
+            new_ticker_list.append(ticker)
+    return new_ticker_list
+
+
+def load_checkpoint(checkpoint_path, run_args):
+    """
+    Loads the progress of an interrupted get_filtered_reddit_data run.
+
+    Args:
+        checkpoint_path: A string of the path of the checkpoint file.
+        run_args: A dictionary of the arguments of the current run. A
+        checkpoint saved by a run with different arguments is ignored.
+
+    Returns:
+        A dictionary with the keys last_created_utc, posts_seen,
+        existing_tickers and output_bytes, or None if there is nothing to
+        resume.
+    """
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path, "r") as file:
+        checkpoint = json.load(file)
+    if checkpoint.get('run_args') != run_args:
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Saves the progress of a get_filtered_reddit_data run, replacing the old
+    checkpoint in a single step so a crash never leaves half a file.
+
+    Args:
+        checkpoint_path: A string of the path of the checkpoint file.
+        checkpoint: A dictionary of the progress to save.
+    """
+    with open(checkpoint_path + ".tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+
+def append_rows(output_path, rows):
+    """
+    Appends accepted posts to the filtered submissions CSV, writing the header
+    if the file is new or empty.
+
+    Args:
+        output_path: A string of the path of the CSV file.
+        rows: A list of dictionaries with the keys title, selftext, time and
+        tickers.
+    """
+    if not rows:
+        return
+    # Every row used to be its own one row dataframe, so the index is all 0
+    chunk = pd.DataFrame(rows, index=[0] * len(rows))
+    # A fresh run truncates an old output to nothing rather than removing it
+    chunk.to_csv(output_path, mode='a',
+                 header=not os.path.exists(output_path) or
+                 os.path.getsize(output_path) == 0)
+
+
+@timed()
+def get_filtered_reddit_data(limit, beginning_day, end_day,
+                             output_path="reddit/reddit_subs_filtered.csv",
+                             chunk_size=100, posts=None, matcher=None):
     """
     Pulls data from /r/wallstreetbets over a specified time interval and
-    filters out posts that don't meet specific parameters.
+    filters out posts that don't meet specific parameters. Posts are filtered
+    as they stream in and accepted ones are appended to the output in chunks.
+    After each chunk a checkpoint is saved next to the output, so running the
+    same pull again after a crash picks up where it stopped.
 
     Args:
         limit: An int representing the maximum amount of reddit submissions you
@@ -154,62 +512,81 @@ def get_filtered_reddit_data(limit, beginning_day, end_day):
         that is the beginning of your search time window.
         end_day: A date represented as a string in "YXXX-MX-DX" format
         that is the end of your search time window.
+        output_path: A string of the path of the CSV file to write.
+        chunk_size: An integer of the number of posts to filter between
+        checkpoints.
+        posts: A function taking (limit, beginning_timestamp, end_timestamp)
+        and yielding posts in order of created_utc, as stream_raw_posts does.
+        Defaults to streaming /r/wallstreetbets from Pushshift.
+        matcher: A TickerMatcher to also find known symbols written without a
+        dollar sign, such as the one made by load_matcher. Defaults to only
+        finding $TICKER cashtags.
 
     Returns:
         Creates a csv file containing all key elements of the reddit
         submissions that met our search parameters.
     """
-
-    all_data = pull_raw_data("wallstreetbets", limit, beginning_day, end_day)
-
-    # Init new dataframe
-    dataframe = pd.DataFrame()
-
-    # Create a list of exixting tickers to remove posts talking about
-    # the same stock. Start with SPY, our S&P500 ETF and baseline
-    existing_tickers = ['SPY']
-
-    # Makes each row in the dataframe a tuple
-    for post in all_data.itertuples():
-
-        # post[0] is an index added by the itertuples function
-        title = str(post.title)
-        selftext = str(post.selftext)
-        created_utc = post.created_utc
-
-        # Combine the title and text for string searches. Must separate with
-        # space to prevent first letter of text being added to ticker in title.
-        all_text = title + " " + selftext
-
-        # Removes reddit submissions that don't contain a stock ticker or
-        # the word long.
-        # Removes reddit submissions that contain a question mark or
-        # the word short.
-        if find_tickers(all_text) and not find_qmarks(all_text) and \
-                find_long(all_text) and not find_short(all_text):
-
-            # Generate a list of all the stock tickers in a post
-            #  and remove duplicates
-            ticker_list = find_tickers(all_text)
-            ticker_list = remove_dupes(ticker_list)
-
-            # filter out all but the first mention of each stock ticker
-            new_ticker_list = []
-            for ticker in ticker_list:
-                if ticker not in existing_tickers:
-                    existing_tickers.append(ticker)
-                    new_ticker_list.append(ticker)
-
-            if new_ticker_list:
-                # censored_title = post['title']  #pf.censor()
-                # censored_selftext = post['selftext']
-                time = datetime.datetime.fromtimestamp(created_utc)
-
-                # Add specific, relevant information from the reddit submission
-                # to our dataframe.
-                dataframe = pd.concat(
-                    [dataframe, pd.DataFrame({'title': [title],
-                                              'selftext': [selftext],
-                                              'time': [time],
-                                              'tickers': [new_ticker_list]})])
-    dataframe.to_csv("reddit/reddit_subs_filtered.csv")
+    if posts is None:
+        def posts(*args):
+            return stream_raw_posts("wallstreetbets", *args)
+
+    checkpoint_path = output_path + ".checkpoint.json"
+    run_args = {'limit': limit, 'beginning_day': beginning_day,
+                'end_day': end_day}
+    checkpoint = load_checkpoint(checkpoint_path, run_args)
+    if checkpoint is None:
+        # Create a list of exixting tickers to remove posts talking about
+        # the same stock. Start with SPY, our S&P500 ETF and baseline
+        checkpoint = {'run_args': run_args,
+                      'last_created_utc': str_create_timestamp(beginning_day),
+                      'posts_seen': 0, 'existing_tickers': ['SPY'],
+                      'output_bytes': 0}
+    existing_tickers = SymbolSet(checkpoint['existing_tickers'])
+
+    # Drop anything written after the last checkpoint, since those posts are
+    # about to be filtered again
+    if os.path.exists(output_path):
+        with open(output_path, "r+") as file:
+            file.truncate(checkpoint['output_bytes'])
+
+    rows = []
+    unsaved = 0
+    for post in posts(limit - checkpoint['posts_seen'],
+                      checkpoint['last_created_utc'],
+                      str_create_timestamp(end_day)):
+        created_utc = post['created_utc']
+
+        # Only checkpoint between posts made at different times, so resuming
+        # after last_created_utc never skips or repeats a post
+        if unsaved >= chunk_size and \
+                created_utc != checkpoint['last_created_utc']:
+            append_rows(output_path, rows)
+            count("reddit.posts_filtered", unsaved)
+            count("reddit.posts_accepted", len(rows))
+            checkpoint['posts_seen'] += unsaved
+            checkpoint['existing_tickers'] = existing_tickers.to_list()
+            checkpoint['output_bytes'] = os.path.getsize(output_path) \
+                if os.path.exists(output_path) else 0
+            save_checkpoint(checkpoint_path, checkpoint)
+            rows = []
+            unsaved = 0
+
+        new_ticker_list = filter_post(str(post['title']),
+                                      str(post['selftext']),
+                                      existing_tickers, matcher)
+        if new_ticker_list:
+            # Add specific, relevant information from the reddit submission
+            # to our output.
+            rows.append({'title': str(post['title']),
+                         'selftext': str(post['selftext']),
+                         'time': datetime.datetime.fromtimestamp(created_utc),
+                         'tickers': new_ticker_list})
+        checkpoint['last_created_utc'] = created_utc
+        unsaved += 1
+
+    append_rows(output_path, rows)
+    count("reddit.posts_filtered", unsaved)
+    count("reddit.posts_accepted", len(rows))
+    print(checkpoint['posts_seen'] + unsaved)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
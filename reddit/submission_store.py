@@ -0,0 +1,274 @@
+"""
+Library for storing the filtered Reddit submissions in an indexed, columnar
+format instead of a CSV file with lists written out as strings. Every column
+is saved as its own .npy file, so reading the times and tickers never parses
+the post text. Submissions are sorted by time, and an inverted index lists
+the submissions that mention each ticker, so finding the posts about a stock
+over a date range only touches those posts.
+"""
+import ast
+import json
+import os
+import numpy as np
+import pandas as pd
+from stock_info.price_panel import csv_fingerprint
+
+SUBMISSIONS_PATH = "reddit/reddit_subs_filtered.csv"
+STORE_DIR = "reddit/store"
+TEXT_COLUMNS = ["title", "selftext"]
+
+
+def _save(store_dir, name, array):
+    # Write next to the old file and swap it in, so readers that still have
+    # the old file memory-mapped are not affected.
+    path = os.path.join(store_dir, f"{name}.npy")
+    with open(path + ".tmp", "wb") as file:
+        np.save(file, array)
+    os.replace(path + ".tmp", path)
+
+
+def _encode_text(strings):
+    # Strings are stored as one UTF-8 byte array plus the offset of each
+    # string's first byte, with the total length at the end
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+class SubmissionStore:
+    """
+    A read-only, time-sorted table of filtered Reddit submissions.
+
+    Attributes:
+        store_dir: A string of the folder the store is saved in.
+        source: The fingerprint of the CSV file the store was built from.
+        symbols: A sorted list of every ticker symbol mentioned.
+        times: A datetime64[s] array of when each submission was posted, in
+        increasing order.
+    """
+
+    def __init__(self, store_dir, source, symbols):
+        self.store_dir = store_dir
+        self.source = source
+        self.symbols = symbols
+        self.symbol_ids = {symbol: index for index, symbol in
+                           enumerate(symbols)}
+        self._arrays = {}
+        self.times = self._array("time")
+
+    def __len__(self):
+        return len(self.times)
+
+    def _array(self, name):
+        # Columns are only memory-mapped the first time they are used
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.store_dir, f"{name}.npy"), mmap_mode="r")
+        return self._arrays[name]
+
+    def rows_between(self, start=None, end=None):
+        """
+        Finds the submissions posted in a time range using the time index.
+
+        Args:
+            start: The first time to include, as anything np.datetime64
+            accepts, such as "2021-03-01". None starts from the first post.
+            end: The first time to leave out. None goes to the last post.
+
+        Returns:
+            An int64 array of row numbers in time order.
+        """
+        first = 0 if start is None else np.searchsorted(
+            self.times, np.datetime64(start, "s"), side="left")
+        last = len(self) if end is None else np.searchsorted(
+            self.times, np.datetime64(end, "s"), side="left")
+        return np.arange(first, max(first, last), dtype=np.int64)
+
+    def rows_mentioning(self, ticker, start=None, end=None):
+        """
+        Finds the submissions that mention a ticker using the inverted index,
+        optionally only those posted in a time range.
+
+        Args:
+            ticker: A string of the ticker symbol.
+            start: The first time to include, or None for no lower bound.
+            end: The first time to leave out, or None for no upper bound.
+
+        Returns:
+            An int64 array of row numbers in time order.
+        """
+        symbol_id = self.symbol_ids.get(ticker)
+        if symbol_id is None:
+            return np.array([], dtype=np.int64)
+        offsets = self._array("postings_offsets")
+        rows = np.asarray(self._array("postings")[
+            offsets[symbol_id]:offsets[symbol_id + 1]], dtype=np.int64)
+        # Postings are in time order, so the range is found by bisection
+        times = self.times[rows]
+        first = 0 if start is None else np.searchsorted(
+            times, np.datetime64(start, "s"), side="left")
+        last = len(rows) if end is None else np.searchsorted(
+            times, np.datetime64(end, "s"), side="left")
+        return rows[first:last]
+
+    def tickers(self, rows=None):
+        """
+        Gets the tickers each submission recommends.
+
+        Args:
+            rows: An array of row numbers. Defaults to every row.
+
+        Returns:
+            A list with a list of ticker symbols per row.
+        """
+        rows = np.arange(len(self)) if rows is None else rows
+        offsets = self._array("ticker_offsets")
+        ticker_ids = self._array("ticker_ids")
+        return [[self.symbols[symbol_id] for symbol_id in
+                 ticker_ids[offsets[row]:offsets[row + 1]]] for row in rows]
+
+    def text(self, column, rows=None):
+        """
+        Gets the title or selftext of each submission.
+
+        Args:
+            column: A string of the column name, one of TEXT_COLUMNS.
+            rows: An array of row numbers. Defaults to every row.
+
+        Returns:
+            A list of strings, one per row.
+        """
+        rows = np.arange(len(self)) if rows is None else rows
+        data = self._array(column)
+        offsets = self._array(f"{column}_offsets")
+        return [bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8")
+                for row in rows]
+
+    def frame(self, columns=("time", "tickers"), rows=None):
+        """
+        Loads some of the columns of some of the submissions.
+
+        Args:
+            columns: A list of the columns to load, from time, tickers, and
+            TEXT_COLUMNS. Columns that are not asked for are never read.
+            rows: An array of row numbers. Defaults to every row.
+
+        Returns:
+            A dataframe with the requested columns, where time holds
+            timestamps and tickers holds lists of ticker symbols.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        data = {}
+        for column in columns:
+            if column == "time":
+                data[column] = pd.to_datetime(np.asarray(self.times[rows]))
+            elif column == "tickers":
+                data[column] = self.tickers(rows)
+            elif column in TEXT_COLUMNS:
+                data[column] = self.text(column, rows)
+            else:
+                raise KeyError(f"unknown submission column {column!r}")
+        return pd.DataFrame(data, index=pd.RangeIndex(len(rows)))
+
+    def exploded(self, rows=None):
+        """
+        Lists every (submission, ticker) pair.
+
+        Args:
+            rows: An array of row numbers. Defaults to every row.
+
+        Returns:
+            A dataframe with one row per ticker mentioned and the columns
+            row, time, and ticker.
+        """
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        offsets = self._array("ticker_offsets")
+        counts = offsets[rows + 1] - offsets[rows]
+        positions = np.concatenate(
+            [np.arange(offsets[row], offsets[row + 1]) for row in rows]) \
+            if len(rows) else np.array([], dtype=np.int64)
+        ticker_ids = np.asarray(self._array("ticker_ids"))[positions]
+        return pd.DataFrame({
+            "row": np.repeat(rows, counts),
+            "time": pd.to_datetime(np.repeat(np.asarray(self.times[rows]),
+                                             counts)),
+            "ticker": np.array(self.symbols, dtype=object)[ticker_ids]
+            if len(ticker_ids) else np.array([], dtype=object),
+        })
+
+
+def load_store(store_dir=STORE_DIR):
+    """
+    Opens a saved submission store.
+
+    Args:
+        store_dir: A string of the folder the store was saved to.
+
+    Returns:
+        A SubmissionStore, or None if no store has been built in store_dir.
+    """
+    meta_path = os.path.join(store_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as file:
+        meta = json.load(file)
+    return SubmissionStore(store_dir, meta["source"], meta["symbols"])
+
+
+def build_store(csv_path=SUBMISSIONS_PATH, store_dir=STORE_DIR):
+    """
+    Builds the submission store from the CSV file written by
+    get_filtered_reddit_data, unless it is already up to date with the file.
+
+    Args:
+        csv_path: A string of the path of the filtered submissions CSV file.
+        store_dir: A string of the folder to save the store to.
+
+    Returns:
+        The SubmissionStore, loaded from store_dir.
+    """
+    old_store = load_store(store_dir)
+    source = csv_fingerprint(csv_path)
+    if old_store is not None and old_store.source == source:
+        return old_store
+
+    dataframe = pd.read_csv(csv_path, keep_default_na=False,
+                            usecols=["title", "selftext", "time", "tickers"])
+    times = pd.to_datetime(dataframe["time"]).to_numpy("datetime64[s]")
+    order = np.argsort(times, kind="stable")
+    ticker_lists = [ast.literal_eval(dataframe["tickers"].iloc[row])
+                    for row in order]
+
+    symbols = sorted({ticker for tickers in ticker_lists
+                      for ticker in tickers})
+    symbol_ids = {symbol: index for index, symbol in enumerate(symbols)}
+    ticker_ids = np.array([symbol_ids[ticker] for tickers in ticker_lists
+                           for ticker in tickers], dtype=np.int32)
+    counts = np.array([len(tickers) for tickers in ticker_lists],
+                      dtype=np.int64)
+    ticker_offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # The inverted index sorts every (ticker, row) pair by ticker, then row,
+    # which is time order
+    pairs = np.unique(ticker_ids.astype(np.int64) * max(len(order), 1) +
+                      np.repeat(np.arange(len(order)), counts))
+    postings = (pairs % max(len(order), 1)).astype(np.int32)
+    postings_offsets = np.searchsorted(pairs // max(len(order), 1),
+                                       np.arange(len(symbols) + 1))
+
+    os.makedirs(store_dir, exist_ok=True)
+    _save(store_dir, "time", times[order])
+    _save(store_dir, "ticker_ids", ticker_ids)
+    _save(store_dir, "ticker_offsets", ticker_offsets)
+    _save(store_dir, "postings", postings)
+    _save(store_dir, "postings_offsets", postings_offsets)
+    for column in TEXT_COLUMNS:
+        data, offsets = _encode_text(
+            dataframe[column].astype(str).to_numpy()[order])
+        _save(store_dir, column, data)
+        _save(store_dir, f"{column}_offsets", offsets)
+
+    with open(os.path.join(store_dir, "meta.json"), "w") as file:
+        json.dump({"source": source, "symbols": symbols}, file)
+    return load_store(store_dir)
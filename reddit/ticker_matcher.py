@@ -0,0 +1,101 @@
+"""
+Library for finding the stocks a Reddit post mentions without a dollar sign,
+such as "TSLA to the moon", as well as $TSLA cashtags. The known symbols,
+the S&P 500 plus every ticker Alpaca has confirmed is valid, are loaded once
+into a set. Each post is then scanned a single time by one compiled regular
+expression that only stops at whole uppercase words, and each word is looked
+up in the set, so scanning takes time linear in the length of the post no
+matter how many symbols are known. Symbols that are also common words or
+Reddit slang are ignored unless they are written as cashtags.
+"""
+import re
+from stock_info.ticker_index import INDEX_PATH, TickerIndex
+from symbol_registry import load_snp500
+
+# Symbols that are more often English words, abbreviations, or Reddit slang
+# than mentions of the stock
+STOPWORDS = frozenset(
+    [chr(letter) for letter in range(ord("A"), ord("Z") + 1)] +
+    ["ALL", "AM", "AN", "ARE", "AT", "BE", "BIO", "BY", "CAN", "CAT", "DD",
+     "DIS", "DO", "DOW", "ED", "EL", "FAST", "FOR", "FOX", "GO", "GOOD",
+     "HAS", "HE", "IF", "IN", "IS", "IT", "KEY", "LOW", "ME", "MY", "NEW",
+     "NO", "NOW", "OF", "ON", "ONE", "OR", "OUT", "PEAK", "POOL", "RE",
+     "REAL", "SEE", "SO", "TECH", "TO", "UP", "US", "WE", "WELL",
+     # Reddit and finance abbreviations
+     "ATH", "ATM", "CEO", "CFO", "EOD", "EPS", "ETF", "EU", "FD", "FOMO",
+     "GDP", "IMO", "IPO", "ITM", "IV", "OTM", "PE", "SEC", "TLDR", "UK",
+     "USA", "USD", "WSB", "YOLO"])
+
+# A cashtag, or a whole uppercase word that may have a class suffix like
+# BRK.B. Words joined to other letters, digits, or a dot, like the AMD in
+# www.AMD.com, are skipped.
+MENTION_PATTERN = (r"\$([A-Z]+)|(?<![\w$.])([A-Z]+(?:\.[A-Z]+)?)"
+                   r"(?!\w|\.\w)")
+MENTION_REGEX = re.compile(MENTION_PATTERN)
+
+
+class TickerMatcher:
+    """
+    Finds the cashtags and the bare mentions of known symbols in text.
+
+    Attributes:
+        symbols: A frozenset of the symbols matched without a dollar sign,
+        which leaves out the stopwords.
+    """
+
+    def __init__(self, symbols, stopwords=STOPWORDS):
+        self.symbols = frozenset(symbols) - frozenset(stopwords)
+
+    def find_tickers(self, string):
+        """
+        Searches a string for stock tickers. Can be used in place of
+        pmaw_api.find_tickers.
+
+        Args:
+            string: A string to be searched.
+
+        Returns:
+            A list of all the stock tickers in the string, in order and with
+            repeats. Every cashtag is included, while bare words are only
+            included if they are known symbols.
+        """
+        tickers = []
+        for cashtag, word in MENTION_REGEX.findall(string):
+            if cashtag:
+                tickers.append(cashtag)
+            elif word in self.symbols:
+                tickers.append(word)
+        return tickers
+
+    def find_series(self, texts):
+        """
+        Searches a whole column of text for stock tickers.
+
+        Args:
+            texts: A pandas series of strings to be searched.
+
+        Returns:
+            A pandas series with the same index as texts holding the list
+            find_tickers returns for each string.
+        """
+        # Pulling every match out with str.extractall and regrouping it is
+        # several times slower than scanning each string in turn
+        return texts.astype(str).map(self.find_tickers)
+
+
+def load_matcher(snp500_path="reddit/snp500.csv", index_path=INDEX_PATH):
+    """
+    Builds a matcher for the S&P 500 and every ticker the ticker index has
+    found to be valid.
+
+    Args:
+        snp500_path: A string of the path to a CSV file with a Symbol column.
+        index_path: A string of the path of the ticker index JSON file.
+
+    Returns:
+        A TickerMatcher.
+    """
+    index = TickerIndex(index_path)
+    valid = [ticker for ticker, (is_valid, _) in index.entries.items()
+             if is_valid]
+    return TickerMatcher(load_snp500(snp500_path).to_list() + valid)
@@ -0,0 +1,204 @@
+"""
+Library for keeping parsed price files, and values worked out from them such
+as annual returns and plot arrays, in memory for the life of the process so
+that the same CSV file is not parsed again every time it is used. Entries are
+keyed by the file's path and what was made from it, and are only reused while
+the file's modification time and size are unchanged. The least recently used
+entries are dropped once the cache holds more than MAX_BYTES, and code that
+rewrites a file calls invalidate so a rewrite is never missed, even on file
+systems with coarse modification times.
+
+The size of the cache in megabytes can be set with the SERIES_CACHE_MB
+environment variable, where 0 turns caching off.
+"""
+import collections
+import functools
+import os
+import sys
+import threading
+import numpy as np
+import pandas as pd
+from instrumentation import count
+
+MAX_BYTES = int(os.environ.get("SERIES_CACHE_MB", "256")) * 2 ** 20
+
+
+def file_fingerprint(path):
+    """
+    Gets a cheap fingerprint of a file that changes whenever it is rewritten.
+
+    Args:
+        path: A string of the path to the file.
+
+    Returns:
+        A tuple of the file's modification time in nanoseconds and its size
+        in bytes, or None if the file does not exist.
+    """
+    try:
+        stats = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stats.st_mtime_ns, stats.st_size
+
+
+def value_size(value):
+    """
+    Estimates how many bytes of memory a cached value takes up.
+
+    Args:
+        value: A dataframe, series, NumPy array, number, or a tuple or list
+        of them.
+
+    Returns:
+        An integer number of bytes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(value_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _share(value):
+    # Every caller gets the same arrays, so they are made read-only, while
+    # dataframes are copied since callers often add or change columns
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, tuple):
+        return tuple(_share(item) for item in value)
+    return value
+
+
+class SeriesCache:
+    """
+    A least recently used cache of values loaded from files.
+
+    Attributes:
+        max_bytes: An integer of the most bytes of values to keep.
+        nbytes: An integer of the bytes of values currently kept.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, path, load):
+        """
+        Gets a value made from a file, loading it only if it is not cached
+        or the file has changed since it was.
+
+        Args:
+            kind: A string naming what is made from the file, such as "bars".
+            path: A string of the path to the file.
+            load: A function that takes path and returns the value.
+
+        Returns:
+            The value. Dataframes are copies and arrays are read-only, so
+            callers cannot change the cached value.
+        """
+        key = (os.path.abspath(path), kind)
+        fingerprint = file_fingerprint(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                count("series_cache.hits")
+                return _share(entry[1])
+        count("series_cache.misses")
+
+        value = load(path)
+        size = value_size(value)
+        if fingerprint is None or size > self.max_bytes:
+            return value
+        value = _share(value)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[2]
+            self._entries[key] = (fingerprint, value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self.nbytes -= old_size
+                count("series_cache.evictions")
+        return _share(value)
+
+    def invalidate(self, path):
+        """
+        Drops every value made from a file.
+
+        Args:
+            path: A string of the path to the file.
+        """
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self.nbytes -= self._entries.pop(key)[2]
+
+    def clear(self):
+        """
+        Drops every value.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+# The cache shared by everything in the process
+CACHE = SeriesCache()
+
+
+def cached(kind, path, load):
+    """
+    Gets a value made from a file through the shared cache.
+
+    Args:
+        kind: A string naming what is made from the file, such as "bars".
+        path: A string of the path to the file.
+        load: A function that takes path and returns the value.
+
+    Returns:
+        The value, as returned by SeriesCache.get.
+    """
+    return CACHE.get(kind, path, load)
+
+
+def invalidate(path):
+    """
+    Drops every value made from a file from the shared cache. Must be called
+    after rewriting a file that may have been cached.
+
+    Args:
+        path: A string of the path to the file.
+    """
+    CACHE.invalidate(path)
+
+
+def memoize_file(kind):
+    """
+    Makes a function of a file path remember its result in the shared cache
+    until the file changes.
+
+    Args:
+        kind: A string naming what the function makes from the file.
+
+    Returns:
+        A decorator for functions that take only the path of a file.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(path):
+            return CACHE.get(kind, path, function)
+        return wrapper
+    return decorator
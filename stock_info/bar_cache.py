@@ -0,0 +1,255 @@
+"""
+Library for keeping a local cache of daily stock bars pulled from the Alpaca
+Market API. Each ticker's bars are stored in a single CSV file, and an index
+file records which date ranges have already been requested so that later
+requests only need to download the dates that are missing.
+"""
+import json
+import os
+from datetime import date, datetime, timedelta
+import pandas as pd
+from instrumentation import count_read
+from series_cache import invalidate, memoize_file
+
+CACHE_DIR = "stock_info/cache"
+
+
+def merge_ranges(ranges):
+    """
+    Merges a list of date ranges so that no two ranges overlap or touch.
+
+    Args:
+        ranges: A list of [start, end] pairs of datetime.date objects, where
+        both ends are included in the range.
+
+    Returns:
+        A list of [start, end] pairs sorted by start date, where overlapping
+        or back-to-back ranges have been combined.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def missing_ranges(held_ranges, start_date, end_date):
+    """
+    Finds the parts of a date range that are not covered by a list of ranges.
+
+    Args:
+        held_ranges: A list of merged [start, end] pairs of datetime.date
+        objects, as returned by merge_ranges.
+        start_date: The first datetime.date in the requested range.
+        end_date: The last datetime.date in the requested range.
+
+    Returns:
+        A list of [start, end] pairs of datetime.date objects covering every
+        day in the requested range that is not in held_ranges.
+    """
+    missing = []
+    next_day = start_date
+    for held_start, held_end in held_ranges:
+        if held_end < next_day:
+            continue
+        if held_start > end_date:
+            break
+        if held_start > next_day:
+            missing.append([next_day, held_start - timedelta(days=1)])
+        next_day = max(next_day, held_end + timedelta(days=1))
+    if next_day <= end_date:
+        missing.append([next_day, end_date])
+    return missing
+
+
+@memoize_file("bars")
+def read_bar_csv(path):
+    """
+    Reads a CSV file of bars written by get_stock_info or the bar cache. The
+    parsed file is kept in the series cache until the file changes.
+
+    Args:
+        path: A string of the path to the CSV file.
+
+    Returns:
+        A dataframe of bars indexed by UTC timestamp. Files written for a
+        ticker without any bars give an empty dataframe.
+    """
+    bars = pd.read_csv(path)
+    count_read(path, len(bars))
+    if "timestamp" not in bars.columns:
+        return pd.DataFrame(
+            index=pd.DatetimeIndex([], tz="UTC", name="timestamp"))
+    bars["timestamp"] = pd.to_datetime(bars["timestamp"], utc=True)
+    return bars.set_index("timestamp")
+
+
+def slice_bars(bars, start_date, end_date):
+    """
+    Selects the bars that fall between two dates.
+
+    Args:
+        bars: A dataframe of bars indexed by UTC timestamp.
+        start_date: The first datetime.date to keep.
+        end_date: The last datetime.date to keep.
+
+    Returns:
+        A dataframe containing only the bars from start_date to end_date,
+        including both ends.
+    """
+    start_ts = pd.Timestamp(start_date, tz="UTC")
+    end_ts = pd.Timestamp(end_date + timedelta(days=1), tz="UTC")
+    return bars[(bars.index >= start_ts) & (bars.index < end_ts)]
+
+
+class BarCache:
+    """
+    A persistent, range-aware store of daily bars keyed by ticker symbol.
+
+    Attributes:
+        cache_dir: A string of the folder the cached CSV files and the range
+        index are kept in.
+        ranges: A dictionary mapping ticker symbols to lists of merged
+        [start, end] date ranges that have already been downloaded.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.ranges = self._read_index()
+
+    @property
+    def index_path(self):
+        """
+        The path to the JSON file that records the cached date ranges.
+        """
+        return os.path.join(self.cache_dir, "index.json")
+
+    def bars_path(self, ticker_symbol):
+        """
+        Gets the path to the CSV file holding a ticker's cached bars.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+
+        Returns:
+            A string of the path to the ticker's cache file.
+        """
+        return os.path.join(self.cache_dir, f"{ticker_symbol}.csv")
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r") as file:
+            raw_index = json.load(file)
+        return {ticker: [[datetime.strptime(start, "%Y-%m-%d").date(),
+                          datetime.strptime(end, "%Y-%m-%d").date()]
+                         for start, end in ranges]
+                for ticker, ranges in raw_index.items()}
+
+    def save(self):
+        """
+        Writes the recorded date ranges to the index file. Ranges another
+        BarCache on the same folder has saved since this one loaded the index
+        are merged in first, so neither overwrites the other.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for ticker, ranges in self._read_index().items():
+            self.ranges[ticker] = merge_ranges(
+                self.ranges.get(ticker, []) + ranges)
+        raw_index = {ticker: [[start.isoformat(), end.isoformat()]
+                              for start, end in ranges]
+                     for ticker, ranges in self.ranges.items()}
+        # Replacing the file in one step means a reader never sees half of it
+        with open(self.index_path + ".tmp", "w") as file:
+            json.dump(raw_index, file, indent=1, sort_keys=True)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def missing(self, ticker_symbol, start_date, end_date):
+        """
+        Finds the date ranges that still need to be downloaded for a request.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            start_date: The first datetime.date of the request.
+            end_date: The last datetime.date of the request.
+
+        Returns:
+            A list of [start, end] pairs of datetime.date objects that are
+            not yet in the cache.
+        """
+        # Days that have not finished trading yet can never be complete, so
+        # they are treated as already covered and simply come back empty.
+        end_date = min(end_date, date.today() - timedelta(days=1))
+        if start_date > end_date:
+            return []
+        return missing_ranges(self.ranges.get(ticker_symbol, []),
+                              start_date, end_date)
+
+    def read(self, ticker_symbol):
+        """
+        Reads every cached bar for a ticker.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+
+        Returns:
+            A dataframe of bars indexed by UTC timestamp, or None if nothing
+            has been cached for the ticker.
+        """
+        path = self.bars_path(ticker_symbol)
+        if not os.path.exists(path):
+            return None
+        return read_bar_csv(path)
+
+    def get(self, ticker_symbol, start_date, end_date):
+        """
+        Reads the cached bars for a ticker between two dates.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            start_date: The first datetime.date to return bars for.
+            end_date: The last datetime.date to return bars for.
+
+        Returns:
+            A dataframe of bars indexed by UTC timestamp, which is empty if
+            no bars have been cached for that range.
+        """
+        bars = self.read(ticker_symbol)
+        if bars is None:
+            return pd.DataFrame()
+        return slice_bars(bars, start_date, end_date)
+
+    def store(self, ticker_symbol, new_bars, start_date, end_date,
+              save=True):
+        """
+        Adds newly downloaded bars to the cache and records the date range
+        they were requested for.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            new_bars: A dataframe of bars indexed by UTC timestamp, as given
+            by the .df attribute of an Alpaca get_bars response. May be empty.
+            start_date: The first datetime.date that was requested.
+            end_date: The last datetime.date that was requested.
+            save: If False, the range is only recorded in memory until save
+            is called, so storing many downloads rewrites the index once.
+        """
+        if len(new_bars):
+            new_bars = new_bars.rename_axis("timestamp")
+            old_bars = self.read(ticker_symbol)
+            if old_bars is not None and len(old_bars):
+                new_bars = pd.concat([old_bars, new_bars])
+                new_bars = new_bars[
+                    ~new_bars.index.duplicated(keep="last")]
+            os.makedirs(self.cache_dir, exist_ok=True)
+            new_bars.sort_index().to_csv(self.bars_path(ticker_symbol))
+            invalidate(self.bars_path(ticker_symbol))
+
+        end_date = min(end_date, date.today() - timedelta(days=1))
+        if start_date <= end_date:
+            self.ranges[ticker_symbol] = merge_ranges(
+                self.ranges.get(ticker_symbol, []) + [[start_date, end_date]])
+            if save:
+                self.save()
@@ -0,0 +1,296 @@
+"""
+Library for storing minute or hour bars from the Alpaca Market API compactly
+enough to keep them for hundreds of tickers. Bars are saved in one
+compressed .npz file per ticker and month, with prices as float32, bar
+counts as uint32, and each bar's time as the number of seconds since the
+bar before it, so a month of minute bars takes a few hundred kilobytes.
+Reading a date range only opens the months it covers, and finding the first
+bar after a moment, such as when a Reddit post was made, is a binary search.
+"""
+import os
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+from instrumentation import count_read
+
+INTRADAY_DIR = "stock_info/intraday"
+PRICE_FIELDS = ["open", "high", "low", "close", "vwap"]
+COUNT_FIELDS = ["volume", "trade_count"]
+
+# The length in seconds of each bar size the store is used for
+TIMEFRAMES = {"1Min": 60, "5Min": 5 * 60, "15Min": 15 * 60, "1Hour": 60 * 60}
+
+
+def month_range(start_date, end_date):
+    """
+    Lists the months that a date range touches.
+
+    Args:
+        start_date: The first datetime.date in the range.
+        end_date: The last datetime.date in the range.
+
+    Returns:
+        A list of strings in the format YYYY-MM, in order.
+    """
+    months = np.arange(np.datetime64(start_date, "M"),
+                       np.datetime64(end_date, "M") + 1)
+    return [str(month) for month in months]
+
+
+def month_bounds(month):
+    """
+    Gets the first and last day of a month.
+
+    Args:
+        month: A string in the format YYYY-MM.
+
+    Returns:
+        A tuple of the first and last datetime.date of the month.
+    """
+    first = np.datetime64(month, "M")
+    return (first.astype("datetime64[D]").item(),
+            ((first + 1).astype("datetime64[D]") - 1).item())
+
+
+def encode_bars(bars):
+    """
+    Packs a dataframe of bars into the compact arrays saved for each month.
+
+    Args:
+        bars: A dataframe of bars indexed by UTC timestamp, with the columns
+        of PRICE_FIELDS and COUNT_FIELDS. Missing columns are saved as 0.
+
+    Returns:
+        A dictionary of NumPy arrays: first_time (the Unix time of the first
+        bar), time_deltas (the seconds from each bar to the next), and one
+        array per field.
+    """
+    bars = bars.sort_index()
+    times = bars.index.values.astype("datetime64[s]").astype(np.int64)
+    arrays = {"first_time": times[:1],
+              "time_deltas": np.diff(times).astype(np.uint32)}
+    for field in PRICE_FIELDS:
+        arrays[field] = bars[field].to_numpy(np.float32) \
+            if field in bars else np.zeros(len(bars), dtype=np.float32)
+    for field in COUNT_FIELDS:
+        arrays[field] = bars[field].to_numpy(np.uint32) \
+            if field in bars else np.zeros(len(bars), dtype=np.uint32)
+    return arrays
+
+
+def decode_times(arrays):
+    """
+    Rebuilds the Unix time of every bar from the arrays saved for a month.
+
+    Args:
+        arrays: A mapping with the first_time and time_deltas arrays made by
+        encode_bars.
+
+    Returns:
+        An int64 array of the Unix time of each bar, in increasing order.
+    """
+    first_time = np.asarray(arrays["first_time"], dtype=np.int64)
+    if not len(first_time):
+        return first_time
+    return np.concatenate([first_time, first_time[0] + np.cumsum(
+        arrays["time_deltas"], dtype=np.int64)])
+
+
+class IntradayStore:
+    """
+    A persistent store of bars of one size, split by ticker and month.
+
+    Attributes:
+        store_dir: A string of the folder all timeframes are stored under.
+        timeframe: A string key of TIMEFRAMES, such as "1Min".
+    """
+
+    def __init__(self, store_dir=INTRADAY_DIR, timeframe="1Min"):
+        if timeframe not in TIMEFRAMES:
+            raise ValueError(f"unknown intraday timeframe {timeframe!r}")
+        self.store_dir = store_dir
+        self.timeframe = timeframe
+
+    def month_path(self, ticker_symbol, month):
+        """
+        Gets the path of the file holding a ticker's bars for one month.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            month: A string in the format YYYY-MM.
+
+        Returns:
+            A string of the path of the .npz file.
+        """
+        return os.path.join(self.store_dir, self.timeframe, ticker_symbol,
+                            f"{month}.npz")
+
+    def missing_months(self, ticker_symbol, start_date, end_date):
+        """
+        Finds the months of a date range that still need to be downloaded:
+        ones never stored, and ones that had not ended when they were.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            start_date: The first datetime.date of the range.
+            end_date: The last datetime.date of the range.
+
+        Returns:
+            A list of strings in the format YYYY-MM.
+        """
+        missing = []
+        for month in month_range(start_date, end_date):
+            path = self.month_path(ticker_symbol, month)
+            if not os.path.exists(path):
+                missing.append(month)
+                continue
+            with np.load(path) as arrays:
+                if not arrays["complete"]:
+                    missing.append(month)
+        return missing
+
+    def write_month(self, ticker_symbol, month, bars, complete=True):
+        """
+        Saves a ticker's bars for one month, replacing any saved before.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            month: A string in the format YYYY-MM.
+            bars: A dataframe of the month's bars indexed by UTC timestamp,
+            as returned by get_multi_bars. May be empty.
+            complete: False if the month had not ended yet, so it is
+            downloaded again next time.
+        """
+        if len(bars):
+            bars = bars[np.datetime_as_string(
+                bars.index.values.astype("datetime64[M]")) == month]
+        path = self.month_path(ticker_symbol, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the old file and swap it in, so a crash never leaves
+        # a half written month behind
+        with open(path + ".tmp", "wb") as file:
+            np.savez_compressed(file, complete=np.array(complete),
+                                **encode_bars(bars))
+        os.replace(path + ".tmp", path)
+
+    def read_month(self, ticker_symbol, month):
+        """
+        Reads a ticker's bars for one month.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            month: A string in the format YYYY-MM.
+
+        Returns:
+            A tuple (times, fields) where times is an int64 array of the Unix
+            time of each bar and fields maps each field name to its array,
+            or None if the month has not been stored.
+        """
+        path = self.month_path(ticker_symbol, month)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as arrays:
+            times = decode_times(arrays)
+            fields = {field: arrays[field]
+                      for field in PRICE_FIELDS + COUNT_FIELDS}
+        count_read(path, len(times))
+        return times, fields
+
+    def _read_months(self, ticker_symbol, months):
+        times = [np.array([], dtype=np.int64)]
+        fields = {field: [np.array([], dtype=np.float32)]
+                  for field in PRICE_FIELDS}
+        fields.update({field: [np.array([], dtype=np.uint32)]
+                       for field in COUNT_FIELDS})
+        for month in months:
+            month_bars = self.read_month(ticker_symbol, month)
+            if month_bars is None:
+                continue
+            times.append(month_bars[0])
+            for field, values in month_bars[1].items():
+                fields[field].append(values)
+        return np.concatenate(times), {
+            field: np.concatenate(values) for field, values in fields.items()}
+
+    def load(self, ticker_symbol, start_date, end_date):
+        """
+        Reads a ticker's bars between two dates, only opening the months in
+        between.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            start_date: The first datetime.date to return bars for.
+            end_date: The last datetime.date to return bars for.
+
+        Returns:
+            A dataframe of bars indexed by UTC timestamp with the columns of
+            PRICE_FIELDS and COUNT_FIELDS, which is empty if none are stored.
+        """
+        times, fields = self._read_months(
+            ticker_symbol, month_range(start_date, end_date))
+        first = np.datetime64(start_date, "s").astype(np.int64)
+        last = np.datetime64(end_date + timedelta(days=1),
+                             "s").astype(np.int64)
+        keep = (times >= first) & (times < last)
+        index = pd.DatetimeIndex(
+            pd.to_datetime(times[keep], unit="s", utc=True), name="timestamp")
+        return pd.DataFrame({field: values[keep]
+                             for field, values in fields.items()},
+                            index=index)
+
+    def bars_after(self, ticker_symbol, timestamps):
+        """
+        Finds the first bar at or after each of many moments, such as the
+        times Reddit posts were made. Only bars in the same month as a moment
+        or the month after it are considered.
+
+        Args:
+            ticker_symbol: A string of the ticker symbol.
+            timestamps: A list or array of the moments as Unix times in
+            seconds, like the created_utc of a post.
+
+        Returns:
+            A dataframe with a row per moment, in the same order, with the
+            columns timestamp (the start of the bar) and the fields of
+            PRICE_FIELDS and COUNT_FIELDS. Rows are NaT and NaN where there
+            is no bar.
+        """
+        moments = np.asarray(timestamps, dtype=np.int64)
+        moment_months = moments.astype("datetime64[s]").astype(
+            "datetime64[M]")
+        months = np.union1d(moment_months, moment_months + 1)
+        times, fields = self._read_months(
+            ticker_symbol, [str(month) for month in months])
+
+        # Each search is O(log n) in the number of bars read
+        found = np.searchsorted(times, moments, side="left")
+        limits = (moment_months + 2).astype("datetime64[s]").astype(np.int64)
+        has_bar = found < len(times)
+        has_bar[has_bar] = times[found[has_bar]] < limits[has_bar]
+        rows = found[has_bar]
+        result = pd.DataFrame(
+            {"timestamp": pd.Series(pd.NaT, index=range(len(moments)),
+                                    dtype="datetime64[s, UTC]")})
+        result.loc[has_bar, "timestamp"] = pd.to_datetime(
+            times[rows], unit="s", utc=True)
+        for field, values in fields.items():
+            column = np.full(len(moments), np.nan)
+            column[has_bar] = values[rows]
+            result[field] = column
+        return result
+
+
+def is_complete(month, today=None):
+    """
+    Checks whether every bar of a month is final, which is once the day
+    after its last day has begun, as for the daily bar cache.
+
+    Args:
+        month: A string in the format YYYY-MM.
+        today: The datetime.date of the run. Defaults to today.
+
+    Returns:
+        True if the month will not get any more bars, False otherwise.
+    """
+    today = today or date.today()
+    return month_bounds(month)[1] < today - timedelta(days=1)
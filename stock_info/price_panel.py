@@ -0,0 +1,228 @@
+"""
+Library for storing every stock in stock_info/data as one ticker by date
+price panel. Each price field is a dense NumPy array saved in .npy format
+with a row per ticker and a column per trading day, so opening the panel only
+memory-maps the files and reading a ticker's prices does not parse any text.
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+from stock_info.bar_cache import read_bar_csv
+
+DATA_DIR = "stock_info/data"
+PANEL_DIR = "stock_info/panel"
+FIELDS = ["open", "high", "low", "close", "volume", "vwap"]
+
+
+def csv_fingerprint(path):
+    """
+    Gets a cheap fingerprint of a file that changes whenever it is rewritten.
+
+    Args:
+        path: A string of the path to the file.
+
+    Returns:
+        A list of the file's modification time in nanoseconds and its size in
+        bytes.
+    """
+    stats = os.stat(path)
+    return [stats.st_mtime_ns, stats.st_size]
+
+
+def find_data_files(data_dir=DATA_DIR):
+    """
+    Finds the CSV files written by get_stock_info.
+
+    Args:
+        data_dir: A string of the folder holding {ticker}data.csv files.
+
+    Returns:
+        A dictionary mapping each ticker symbol to the path of its CSV file.
+    """
+    return {name[:-len("data.csv")]: os.path.join(data_dir, name)
+            for name in sorted(os.listdir(data_dir))
+            if name.endswith("data.csv")}
+
+
+class PricePanel:
+    """
+    A read-only ticker by date panel of daily prices.
+
+    Attributes:
+        days: An int64 array of the number of days since January 1, 1970 of
+        each column, in increasing order.
+        tickers: A list of the ticker symbol of each row.
+        rows: A dictionary mapping each ticker symbol to its row number.
+        fields: A dictionary mapping each field name in FIELDS to a float64
+        array with a row per ticker and a column per day, where days without a
+        bar are NaN.
+        sources: A dictionary mapping each ticker symbol to the fingerprint of
+        the CSV file its row was built from.
+    """
+
+    def __init__(self, days, tickers, fields, sources):
+        self.days = days
+        self.tickers = list(tickers)
+        self.rows = {ticker: row for row, ticker in enumerate(self.tickers)}
+        self.fields = fields
+        self.sources = sources
+
+    def __contains__(self, ticker):
+        return ticker in self.rows
+
+    def series(self, ticker, field="close"):
+        """
+        Gets one price field of a ticker on the days it has bars.
+
+        Args:
+            ticker: A string of the ticker symbol.
+            field: A string of the field name, one of FIELDS.
+
+        Returns:
+            A tuple (days, values) of an int64 array of epoch days and a
+            float64 array of the field's value on each of those days.
+        """
+        values = np.asarray(self.fields[field][self.rows[ticker]])
+        has_bar = ~np.isnan(self.fields["close"][self.rows[ticker]])
+        return self.days[has_bar], values[has_bar]
+
+    def frame(self, ticker):
+        """
+        Gets every field of a ticker as a dataframe laid out like the CSV
+        files written by get_stock_info.
+
+        Args:
+            ticker: A string of the ticker symbol.
+
+        Returns:
+            A dataframe indexed by the UTC date of each bar with a column
+            per field.
+        """
+        row = self.rows[ticker]
+        has_bar = ~np.isnan(self.fields["close"][row])
+        index = pd.DatetimeIndex(
+            self.days[has_bar].astype("datetime64[D]"), name="timestamp")
+        return pd.DataFrame(
+            {field: np.asarray(self.fields[field][row])[has_bar]
+             for field in FIELDS},
+            index=index.tz_localize("UTC"))
+
+
+def load_panel(panel_dir=PANEL_DIR):
+    """
+    Opens a saved price panel, memory-mapping its arrays instead of reading
+    them into memory.
+
+    Args:
+        panel_dir: A string of the folder the panel was saved to.
+
+    Returns:
+        A PricePanel, or None if no panel has been built in panel_dir.
+    """
+    meta_path = os.path.join(panel_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r") as file:
+        meta = json.load(file)
+    days = np.load(os.path.join(panel_dir, "days.npy"))
+    fields = {field: np.load(os.path.join(panel_dir, f"{field}.npy"),
+                             mmap_mode="r")
+              for field in FIELDS}
+    return PricePanel(days, meta["tickers"], fields, meta["sources"])
+
+
+def _save_array(path, array):
+    # Write next to the old file and swap it in, so readers that still have
+    # the old file memory-mapped are not affected.
+    with open(path + ".tmp", "wb") as file:
+        np.save(file, array)
+    os.replace(path + ".tmp", path)
+
+
+def build_panel(data_dir=DATA_DIR, panel_dir=PANEL_DIR, paths=None):
+    """
+    Builds or updates the price panel from the CSV files in data_dir. Only
+    files that are new or have changed since the last build are parsed; the
+    rows of every other ticker are copied over from the existing panel.
+
+    Args:
+        data_dir: A string of the folder holding {ticker}data.csv files.
+        panel_dir: A string of the folder to save the panel to.
+        paths: A dictionary mapping ticker symbols to the CSV files to build
+        the panel from instead of the files in data_dir, such as the files
+        of a BarCache.
+
+    Returns:
+        The updated PricePanel, loaded from panel_dir.
+    """
+    old_panel = load_panel(panel_dir)
+    if paths is None:
+        paths = find_data_files(data_dir)
+    sources = {ticker: csv_fingerprint(path)
+               for ticker, path in paths.items()}
+    if old_panel is not None and old_panel.sources == sources:
+        return old_panel
+
+    parsed = {}
+    for ticker, path in paths.items():
+        if old_panel is None or old_panel.sources.get(ticker) != \
+                sources[ticker]:
+            bars = read_bar_csv(path)
+            parsed[ticker] = (
+                bars.index.values.astype("datetime64[D]").astype(np.int64),
+                bars)
+    kept = [ticker for ticker in paths if ticker not in parsed]
+
+    # The shared date axis is every day any of the tickers has a bar on
+    all_days = [days for days, _ in parsed.values()]
+    if old_panel is not None:
+        all_days.append(old_panel.days)
+    days = np.unique(np.concatenate(all_days)) if all_days else \
+        np.array([], dtype=np.int64)
+
+    tickers = sorted(paths)
+    rows = {ticker: row for row, ticker in enumerate(tickers)}
+    os.makedirs(panel_dir, exist_ok=True)
+    for field in FIELDS:
+        values = np.full((len(tickers), len(days)), np.nan)
+        if kept:
+            old_columns = np.searchsorted(days, old_panel.days)
+            for ticker in kept:
+                values[rows[ticker], old_columns] = \
+                    old_panel.fields[field][old_panel.rows[ticker]]
+        for ticker, (bar_days, bars) in parsed.items():
+            if field in bars.columns:
+                values[rows[ticker], np.searchsorted(days, bar_days)] = \
+                    bars[field].to_numpy(dtype=np.float64)
+        _save_array(os.path.join(panel_dir, f"{field}.npy"), values)
+    _save_array(os.path.join(panel_dir, "days.npy"), days)
+
+    with open(os.path.join(panel_dir, "meta.json"), "w") as file:
+        json.dump({"tickers": tickers, "sources": sources}, file)
+    return load_panel(panel_dir)
+
+
+def read_bars(ticker, panel=None, data_dir=DATA_DIR):
+    """
+    Reads the bars of a ticker from the price panel, or from its CSV file if
+    the panel does not have the ticker or the file has changed since the
+    panel was built. Used in place of pd.read_csv on the data files.
+
+    Args:
+        ticker: A string of the ticker symbol.
+        panel: The PricePanel to read from. Defaults to opening the panel in
+        PANEL_DIR.
+        data_dir: A string of the folder holding {ticker}data.csv files.
+
+    Returns:
+        A dataframe indexed by UTC timestamp with the price fields as
+        columns.
+    """
+    panel = panel if panel is not None else load_panel()
+    path = os.path.join(data_dir, f"{ticker}data.csv")
+    if panel is not None and ticker in panel and (
+            not os.path.exists(path) or
+            panel.sources.get(ticker) == csv_fingerprint(path)):
+        return panel.frame(ticker)
+    return read_bar_csv(path)
@@ -1,40 +1,68 @@
 """
 This library uses the Alpaca Market API to obtain stock data given a start and
 end date, and checks whether stock tickers are valid and can be found on
-Alpaca Market.
+Alpaca Market. Bars that have already been downloaded are kept in a local
+cache so that overlapping requests only fetch the dates that are missing, and
+the results of ticker checks are kept in a local index.
 """
-import json
 from datetime import datetime, timedelta
-import alpaca_trade_api as tradeapi
+import pandas as pd
+from instrumentation import count, timed
+from api_clients import get_client
+from rate_limiter import call_with_backoff
+from series_cache import invalidate
+from stock_info.bar_cache import BarCache, merge_ranges
+from stock_info.intraday_store import IntradayStore, is_complete, \
+    month_bounds, month_range
+from stock_info.ticker_index import TickerIndex
 
 
 def get_alpaca_account():
     """
-    Loads the Alpaca credentials and displays the Alpaca account used to make
-    the API requests. Will error if the user does not have Alpaca credentials.
+    Gets the Alpaca client used to make the API requests, loading the Alpaca
+    credentials the first time it is called. Will error if the user does not
+    have Alpaca credentials and the real API backend is used.
 
     Args:
         None.
 
     Returns:
-        account: A dictionary containing strings of information about the
-        Alpaca account.
+        The shared Alpaca REST client from api_clients.get_client.
     """
-    with open("stock_info/alpaca_credentials.json", "r") as file:
-        creds = json.load(file)
+    return get_client("alpaca")
 
-    apca_api_key_id = creds['CLIENT_ID']
-    apca_api_secret_key = creds['CLIENT_SECRET']
 
-    apca_api_base_url = "https://paper-API.alpaca.markets"
+# The bar cache and ticker index are only read from disk once they are used
+BAR_CACHE = None
+TICKER_INDEX = None
 
-    api = tradeapi.REST(apca_api_key_id, apca_api_secret_key,
-                        apca_api_base_url, api_version='v2')
-    return api
 
+def get_bar_cache():
+    """
+    Gets the global bar cache, loading it the first time it is used.
+    """
+    global BAR_CACHE
+    if BAR_CACHE is None:
+        BAR_CACHE = BarCache()
+    return BAR_CACHE
+
+
+def get_ticker_index():
+    """
+    Gets the global ticker index, loading it the first time it is used.
+    """
+    global TICKER_INDEX
+    if TICKER_INDEX is None:
+        TICKER_INDEX = TickerIndex()
+    return TICKER_INDEX
+
+
+# Alpaca allows up to 10,000 bars per page on the multi-symbol bars endpoint
+MAX_BARS_PER_PAGE = 10000
 
-# Global Constants
-API = get_alpaca_account()
+# Column names the SDK gives to the short keys of a raw bar
+BAR_COLUMNS = {'t': 'timestamp', 'o': 'open', 'h': 'high', 'l': 'low',
+               'c': 'close', 'v': 'volume', 'n': 'trade_count', 'vw': 'vwap'}
 
 
 def get_datetime(start_date, time_period):
@@ -59,32 +87,89 @@ def get_datetime(start_date, time_period):
     return [start_date, end_date]
 
 
-def is_valid_ticker(ticker):
+def is_valid_ticker(ticker, api=None, index=None):
     """
-    Checks if a ticker symbol is valid.
+    Checks if a ticker symbol is valid. The answer is taken from the ticker
+    index when it has one for the symbol, and checked with Alpaca otherwise.
 
     Args:
         ticker: A ticker symbol.
+        api: The Alpaca REST client to check the symbol with. Defaults to the
+        shared Alpaca client.
+        index: The TickerIndex to look the symbol up in. Defaults to the
+        global ticker index.
 
     Returns:
         True if the ticker is valid, False otherwise.
     """
+    index = index or get_ticker_index()
+    is_valid = index.lookup(ticker)
+    if is_valid is None:
+        is_valid = validate_tickers([ticker], api, index)[ticker]
+    return is_valid
+
+
+@timed()
+def validate_tickers(tickers, api=None, index=None, batch_size=100):
+    """
+    Checks many ticker symbols at once. Symbols missing from the ticker index
+    are probed in batches by looking for data from one day, and the results
+    are saved to the index.
+
+    Args:
+        tickers: An iterable of ticker symbols. May contain duplicates.
+        api: The Alpaca REST client to check symbols with. Defaults to the
+        shared Alpaca client.
+        index: The TickerIndex to look symbols up in and add to. Defaults to
+        the global ticker index.
+        batch_size: An integer of the most symbols to probe in one request.
+
+    Returns:
+        A dictionary mapping each unique ticker symbol to True if it is valid
+        and False otherwise.
+    """
+    api = api or get_client("alpaca")
+    index = index or get_ticker_index()
+    tickers = set(tickers)
+
     # Look for data from one day to see if we get results
     dates = get_datetime("2018-01-01", 1)
-    start_date = dates[0]
-    end_date = dates[1]
+    unknown = index.unknown(tickers)
+    count("ticker_index.hits", len(tickers) - len(unknown))
+    count("ticker_index.misses", len(unknown))
+    for batch_start in range(0, len(unknown), batch_size):
+        batch = unknown[batch_start:batch_start + batch_size]
+        bars = get_multi_bars(api, batch, dates[0], dates[1])
+        index.update({ticker: len(bars[ticker]) > 0 for ticker in batch})
 
-    any_data = API.get_bars(ticker, tradeapi.TimeFrame.Day,
-                            start_date, end_date, adjustment='raw')
-    if any_data:
-        return True
-    return False
+    return {ticker: index.lookup(ticker) for ticker in tickers}
 
 
-def get_stock_info(ticker_symbol, start_date, time_period):
+def build_ticker_index(tickers, api=None, index=None):
+    """
+    Fills the ticker index from a single listing of every asset on Alpaca
+    instead of probing each symbol for data.
+
+    Args:
+        tickers: An iterable of the ticker symbols to record.
+        api: The Alpaca REST client to list assets with. Defaults to the
+        shared Alpaca client.
+        index: The TickerIndex to add to. Defaults to the global ticker index.
+    """
+    api = api or get_client("alpaca")
+    index = index or get_ticker_index()
+    listed = {asset.symbol for asset in
+              call_with_backoff("alpaca", api.list_assets)}
+    index.update({ticker: ticker in listed for ticker in set(tickers)})
+
+
+@timed()
+def get_stock_info(ticker_symbol, start_date, time_period, api=None,
+                   cache=None):
     """
     Creates a CSV file containing the open and close price for the desired
-    stock each day.
+    stock each day. Only the dates that are not already in the local bar cache
+    are requested from Alpaca.
 
     Args:
         ticker_symbol: A string of 1-4 uppercase letters representing the
@@ -92,16 +177,244 @@ def get_stock_info(ticker_symbol, start_date, time_period):
         start_date: A string containing the first date to pull data for in the
         format YYYY-MM-DD.
         time_period: An integer of the number of days to pull data for.
+        api: The Alpaca REST client to download missing bars with. Defaults
+        to the shared Alpaca client.
+        cache: The BarCache to read from and add to. Defaults to the global
+        bar cache.
 
     Returns:
-        A CSV file of the stock information containing the following headings:
-        timestamp, open, high, low, close, volume, trade_count, and vwap. It
-        appears in the stock_info folder.
+        A dataframe of the stock information, which is also written to a CSV
+        file with the following headings: timestamp, open, high, low, close,
+        volume, trade_count, and vwap. It appears in the stock_info folder.
     """
+    api = api or get_client("alpaca")
+    cache = cache or get_bar_cache()
+
     dates = get_datetime(start_date, time_period)
     start_date = dates[0]
     end_date = dates[1]
 
-    stock_data = API.get_bars(ticker_symbol, tradeapi.TimeFrame.Day,
-                              start_date, end_date, adjustment='raw').df
-    stock_data.to_csv(f'stock_info/data/{ticker_symbol}data.csv')
+    # Only download the head or tail of the range we haven't seen before
+    gaps = cache.missing(ticker_symbol, start_date, end_date)
+    count("bar_cache.misses" if gaps else "bar_cache.hits")
+    for gap_start, gap_end in gaps:
+        new_data = get_multi_bars(api, [ticker_symbol], gap_start,
+                                  gap_end)[ticker_symbol]
+        cache.store(ticker_symbol, new_data, gap_start, gap_end)
+
+    stock_data = cache.get(ticker_symbol, start_date, end_date)
+    path = f'stock_info/data/{ticker_symbol}data.csv'
+    stock_data.to_csv(path)
+    invalidate(path)
+    return stock_data
+
+
+def bars_to_dataframe(raw_bars):
+    """
+    Converts raw bars from the Alpaca data API into a dataframe laid out like
+    the .df attribute of a get_bars response.
+
+    Args:
+        raw_bars: A list of dictionaries with the short keys t, o, h, l, c, v,
+        n and vw used by the Alpaca bars endpoint.
+
+    Returns:
+        A dataframe of bars indexed by UTC timestamp with the columns open,
+        high, low, close, volume, trade_count, and vwap.
+    """
+    bars = pd.DataFrame(raw_bars).rename(columns=BAR_COLUMNS)
+    if bars.empty:
+        return bars
+    bars['timestamp'] = pd.to_datetime(bars['timestamp'], utc=True)
+    bars = bars.set_index('timestamp')
+    return bars[[column for column in BAR_COLUMNS.values()
+                 if column in bars.columns]]
+
+
+def plan_bar_batches(ranges, max_symbols=100, max_span_days=730):
+    """
+    Groups per-ticker date ranges into multi-symbol requests. Ranges are
+    taken in order of start date and added to the current request while it
+    has room for another symbol and its window stays under max_span_days.
+
+    Args:
+        ranges: A list of (ticker, start, end) tuples of date ranges to
+        download, where start and end are datetime.date objects.
+        max_symbols: An integer of the most symbols to put in one request.
+        max_span_days: An integer of the longest window, in days, that one
+        request may cover.
+
+    Returns:
+        A list of (tickers, start, end) tuples, where tickers is a sorted list
+        of ticker symbols to request over the window from start to end.
+    """
+    batches = []
+    tickers = set()
+    window_start = window_end = None
+    for ticker, start, end in sorted(ranges, key=lambda item: item[1]):
+        if tickers:
+            new_end = max(window_end, end)
+            has_room = ticker in tickers or len(tickers) < max_symbols
+            if has_room and (new_end - window_start).days <= max_span_days:
+                tickers.add(ticker)
+                window_end = new_end
+                continue
+            batches.append((sorted(tickers), window_start, window_end))
+        tickers = {ticker}
+        window_start, window_end = start, end
+    if tickers:
+        batches.append((sorted(tickers), window_start, window_end))
+    return batches
+
+
+@timed()
+def get_multi_bars(api, tickers, start_date, end_date,
+                   page_limit=MAX_BARS_PER_PAGE, timeframe="1Day"):
+    """
+    Downloads bars for several tickers at once, following the
+    next_page_token of the Alpaca bars endpoint until every page is read.
+
+    Args:
+        api: The Alpaca REST client to make the requests with.
+        tickers: A list of ticker symbols to request.
+        start_date: The first datetime.date to pull bars for.
+        end_date: The last datetime.date to pull bars for.
+        page_limit: An integer of the most bars to ask for in one page.
+        timeframe: A string of the bar size, such as "1Day", "1Hour" or
+        "1Min".
+
+    Returns:
+        A dictionary mapping each ticker symbol to a dataframe of its bars.
+        Tickers without any bars map to an empty dataframe.
+    """
+    raw_bars = {ticker: [] for ticker in tickers}
+    start, end = start_date.isoformat(), end_date.isoformat()
+    if timeframe != '1Day':
+        # A bare date would end the range at the start of the last day
+        start, end = f"{start}T00:00:00Z", f"{end}T23:59:59Z"
+    params = {'symbols': ','.join(tickers), 'timeframe': timeframe,
+              'start': start, 'end': end, 'adjustment': 'raw',
+              'limit': page_limit}
+    while True:
+        resp = call_with_backoff("alpaca", api.data_get, '/stocks/bars',
+                                 data=dict(params), api_version='v2')
+        for ticker, bars in (resp.get('bars') or {}).items():
+            raw_bars.setdefault(ticker, []).extend(bars or [])
+            count("alpaca.bars_received", len(bars or []))
+        page_token = resp.get('next_page_token')
+        if not page_token:
+            break
+        params['page_token'] = page_token
+    return {ticker: bars_to_dataframe(bars)
+            for ticker, bars in raw_bars.items()}
+
+
+@timed()
+def get_stock_info_batch(jobs, api=None, cache=None, max_symbols=100,
+                         max_span_days=730):
+    """
+    Downloads the bars for many (ticker, start date, time period) jobs using
+    as few multi-symbol requests as possible. Every job's dates are added to
+    the bar cache, so get_stock_info can be called afterwards for any of them
+    without touching the API.
+
+    Args:
+        jobs: A list of (ticker_symbol, start_date, time_period) tuples using
+        the same formats as the arguments to get_stock_info.
+        api: The Alpaca REST client to download missing bars with. Defaults
+        to the shared Alpaca client.
+        cache: The BarCache to read from and add to. Defaults to the global
+        bar cache.
+        max_symbols: An integer of the most symbols to put in one request.
+        max_span_days: An integer of the longest window, in days, that one
+        request may cover.
+
+    Returns:
+        A dictionary mapping each ticker symbol to a dataframe of its bars
+        from the first to the last date requested for it.
+    """
+    api = api or get_client("alpaca")
+    cache = cache or get_bar_cache()
+
+    wanted = {}
+    for ticker_symbol, start_date, time_period in jobs:
+        wanted.setdefault(ticker_symbol, []).append(
+            get_datetime(start_date, time_period))
+
+    # Overlapping jobs for the same ticker only need to be downloaded once
+    missing = []
+    for ticker_symbol, ranges in wanted.items():
+        wanted[ticker_symbol] = merge_ranges(ranges)
+        for start_date, end_date in wanted[ticker_symbol]:
+            gaps = cache.missing(ticker_symbol, start_date, end_date)
+            count("bar_cache.misses" if gaps else "bar_cache.hits")
+            for gap_start, gap_end in gaps:
+                missing.append((ticker_symbol, gap_start, gap_end))
+
+    # The cache index is written once for the whole batch, including the
+    # downloads that finished before any failure
+    try:
+        for tickers, start_date, end_date in plan_bar_batches(
+                missing, max_symbols, max_span_days):
+            bars = get_multi_bars(api, tickers, start_date, end_date)
+            for ticker_symbol in tickers:
+                cache.store(ticker_symbol, bars[ticker_symbol], start_date,
+                            end_date, save=False)
+    finally:
+        if missing:
+            cache.save()
+
+    return {ticker_symbol: cache.get(ticker_symbol, ranges[0][0],
+                                     ranges[-1][1])
+            for ticker_symbol, ranges in wanted.items()}
+
+
+@timed()
+def get_intraday_info(tickers, start_date, time_period, timeframe="1Min",
+                      api=None, store=None, max_symbols=100):
+    """
+    Downloads minute or hour bars for several tickers into the intraday
+    store. Bars are downloaded a whole month at a time, with up to
+    max_symbols tickers per request, and only months that are not already
+    stored are requested.
+
+    Args:
+        tickers: A list of ticker symbols.
+        start_date: A string containing the first date to pull data for in the
+        format YYYY-MM-DD.
+        time_period: An integer of the number of days to pull data for.
+        timeframe: A string of the bar size, a key of
+        intraday_store.TIMEFRAMES such as "1Min".
+        api: The Alpaca REST client to download missing bars with. Defaults
+        to the shared Alpaca client.
+        store: The IntradayStore to add to. Defaults to the store for the
+        timeframe in the standard folder.
+        max_symbols: An integer of the most symbols to put in one request.
+
+    Returns:
+        The IntradayStore holding the bars, to read them back with load or
+        bars_after.
+    """
+    api = api or get_client("alpaca")
+    store = store or IntradayStore(timeframe=timeframe)
+    start_date, end_date = get_datetime(start_date, time_period)
+    last_day = datetime.now().date() - timedelta(days=1)
+
+    tickers = sorted(set(tickers))
+    for month in month_range(start_date, end_date):
+        month_start, month_end = month_bounds(month)
+        if month_start > last_day:
+            break
+        missing = [ticker for ticker in tickers if store.missing_months(
+            ticker, month_start, month_start)]
+        count("intraday.hits", len(tickers) - len(missing))
+        count("intraday.misses", len(missing))
+        for batch_start in range(0, len(missing), max_symbols):
+            batch = missing[batch_start:batch_start + max_symbols]
+            bars = get_multi_bars(api, batch, month_start,
+                                  min(month_end, last_day),
+                                  timeframe=timeframe)
+            for ticker in batch:
+                store.write_month(ticker, month, bars[ticker],
+                                  is_complete(month))
+    return store
@@ -0,0 +1,92 @@
+"""
+Library for remembering which ticker symbols are valid on Alpaca Market. The
+results of earlier checks, both valid and invalid, are saved to disk with the
+time they were made so that each symbol only has to be checked again once its
+entry has expired.
+"""
+import json
+import os
+import time
+
+INDEX_PATH = "stock_info/cache/tickers.json"
+
+# Listings change slowly, so a month-old answer is still trusted
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+class TickerIndex:
+    """
+    A persistent lookup table of whether ticker symbols are valid.
+
+    Attributes:
+        path: A string of the path of the JSON file the index is saved to.
+        ttl: A number of seconds an entry is trusted for after it is made.
+        entries: A dictionary mapping ticker symbols to [is_valid, checked_at]
+        pairs, where checked_at is a Unix timestamp.
+    """
+
+    def __init__(self, path=INDEX_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.entries = json.load(file)
+
+    def lookup(self, ticker, now=None):
+        """
+        Looks up whether a ticker symbol is valid.
+
+        Args:
+            ticker: A string of the ticker symbol.
+            now: The current Unix timestamp. Defaults to the system time.
+
+        Returns:
+            True or False if the symbol has an entry that has not expired,
+            or None if it needs to be checked again.
+        """
+        entry = self.entries.get(ticker)
+        if entry is None:
+            return None
+        now = time.time() if now is None else now
+        if now - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def unknown(self, tickers, now=None):
+        """
+        Finds the ticker symbols that have no entry or an expired one.
+
+        Args:
+            tickers: An iterable of ticker symbol strings.
+            now: The current Unix timestamp. Defaults to the system time.
+
+        Returns:
+            A sorted list of the unique symbols that need to be checked.
+        """
+        now = time.time() if now is None else now
+        return sorted({ticker for ticker in tickers
+                       if self.lookup(ticker, now) is None})
+
+    def update(self, results, now=None):
+        """
+        Records the outcome of checking some ticker symbols and saves the
+        index to disk.
+
+        Args:
+            results: A dictionary mapping ticker symbols to True if they are
+            valid and False otherwise.
+            now: The current Unix timestamp. Defaults to the system time.
+        """
+        now = time.time() if now is None else now
+        for ticker, is_valid in results.items():
+            self.entries[ticker] = [bool(is_valid), now]
+        self.save()
+
+    def save(self):
+        """
+        Writes the index to its JSON file.
+        """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w") as file:
+            json.dump(self.entries, file, sort_keys=True)
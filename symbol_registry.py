@@ -0,0 +1,134 @@
+"""
+Library for keeping track of ticker symbols. Every symbol is given a small
+integer ID the first time it is seen, and sets of symbols, such as the S&P
+500 or the tickers already recommended on Reddit, are stored as byte arrays
+indexed by those IDs so adding a symbol or checking membership takes
+constant time.
+"""
+import pandas as pd
+
+
+class SymbolRegistry:
+    """
+    A two-way mapping between ticker symbols and compact integer IDs.
+
+    Attributes:
+        ids: A dictionary mapping each symbol to its ID.
+        symbols: A list of the symbols, where each symbol is at the index of
+        its ID.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.symbols = []
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def intern(self, symbol):
+        """
+        Gets the ID of a symbol, giving it the next free ID if it is new.
+
+        Args:
+            symbol: A string of the ticker symbol.
+
+        Returns:
+            An integer ID that is the same every time symbol is interned.
+        """
+        symbol_id = self.ids.get(symbol)
+        if symbol_id is None:
+            symbol_id = len(self.symbols)
+            self.ids[symbol] = symbol_id
+            self.symbols.append(symbol)
+        return symbol_id
+
+    def lookup(self, symbol):
+        """
+        Gets the ID of a symbol without adding it.
+
+        Args:
+            symbol: A string of the ticker symbol.
+
+        Returns:
+            The integer ID of the symbol, or None if it has not been interned.
+        """
+        return self.ids.get(symbol)
+
+
+# The registry shared by the reddit, stock_info and results code
+REGISTRY = SymbolRegistry()
+
+
+class SymbolSet:
+    """
+    A set of ticker symbols stored as a byte array indexed by registry ID.
+
+    Attributes:
+        registry: The SymbolRegistry that gives each symbol its ID.
+        flags: A bytearray with one byte per registry ID, set to 1 for the
+        symbols in the set.
+    """
+
+    def __init__(self, symbols=(), registry=None):
+        # An empty registry is falsy, so it is checked against None
+        self.registry = registry if registry is not None else REGISTRY
+        self.flags = bytearray()
+        self._size = 0
+        for symbol in symbols:
+            self.add(symbol)
+
+    def __contains__(self, symbol):
+        symbol_id = self.registry.lookup(symbol)
+        return symbol_id is not None and symbol_id < len(self.flags) and \
+            self.flags[symbol_id] == 1
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for symbol_id, flag in enumerate(self.flags):
+            if flag:
+                yield self.registry.symbols[symbol_id]
+
+    def add(self, symbol):
+        """
+        Adds a symbol to the set.
+
+        Args:
+            symbol: A string of the ticker symbol.
+
+        Returns:
+            True if the symbol was not in the set before, False otherwise.
+        """
+        symbol_id = self.registry.intern(symbol)
+        if symbol_id >= len(self.flags):
+            # Grow to cover every ID handed out so far in one step
+            self.flags.extend(bytes(len(self.registry) - len(self.flags)))
+        if self.flags[symbol_id]:
+            return False
+        self.flags[symbol_id] = 1
+        self._size += 1
+        return True
+
+    def to_list(self):
+        """
+        Lists the symbols in the set, in the order they were first interned.
+
+        Returns:
+            A list of ticker symbol strings.
+        """
+        return list(self)
+
+
+def load_snp500(path="reddit/snp500.csv"):
+    """
+    Loads the tickers of the companies in the S&P 500.
+
+    Args:
+        path: A string of the path to a CSV file with a Symbol column.
+
+    Returns:
+        A SymbolSet of the S&P 500 ticker symbols.
+    """
+    dataframe = pd.read_csv(path, encoding="utf-8-sig")
+    return SymbolSet(dataframe['Symbol'])
@@ -1,12 +1,19 @@
 """
 This library contains all of our unit tests for our functions.
 """
+import asyncio
+import collections
 import datetime
+import functools
+import os
+import tracemalloc
 import pytest
 from generate_results import str_to_list
 from graphing.graph_stock_info import (
     days_since_epoch,
-    date_from_epoch_time
+    date_from_epoch_time,
+    fill_calendar_days,
+    prepare_color_plot
 )
 from reddit.pmaw_api import (
     find_tickers,
@@ -14,12 +21,56 @@ from reddit.pmaw_api import (
     find_long,
     find_short,
     str_create_timestamp,
-    remove_dupes
+    remove_dupes,
+    get_filtered_reddit_data,
+    split_window,
+    stream_raw_posts,
+    stream_sharded_posts,
+    Submission
 )
 
+import numpy as np
+import pandas as pd
+from analysis.ledger import ResultsLedger
+from analysis.risk import compute_risk_metrics, range_max_drawdowns
+from benchmarks.bench_suite import compare_to_baseline, run_suite
+from analysis.returns import (
+    compute_returns,
+    load_close_series,
+    series_returns,
+    window_fingerprints
+)
+from analysis.sweep import run_sweep
+from reddit.submission_store import build_store
+from reddit.ticker_matcher import TickerMatcher, load_matcher
+from series_cache import SeriesCache
+from async_pipeline import StreamStage, run_stream, stream_returns
+from pipeline import Stage, default_stages, run_pipeline, stage_dependencies
+from symbol_registry import SymbolRegistry, SymbolSet, load_snp500
+from rate_limiter import RateLimiter, call_with_backoff, set_rate_limit
+import instrumentation
+import api_clients
+import rate_limiter
+
 # Scraping and analyzing Alpaca data
 
-from stock_info.pull_stock_info import get_datetime
+from reddit.classifier import (
+    Classification,
+    classify_series,
+    classify_text
+)
+from stock_info.pull_stock_info import (
+    get_datetime,
+    get_intraday_info,
+    get_stock_info_batch,
+    plan_bar_batches,
+    validate_tickers
+)
+from stock_info.bar_cache import BarCache, merge_ranges, missing_ranges
+from stock_info.intraday_store import IntradayStore, is_complete
+from stock_info.ticker_index import TickerIndex
+from graphing.batch_render import render_charts
+from stock_info.price_panel import build_panel, load_panel, read_bars
 
 find_tickers_cases = [
     # Check that a string with no tickers returns an empty list.
@@ -66,6 +117,8 @@ remove_dupes_cases = [
     (['hello', '', 'hi'], ['hello', 'hi']),
     # Check that repeats in a list are removed.
     (['hello', 'hello', 'hi'], ['hello', 'hi']),
+    # Check that the order of first occurrences is kept.
+    (['hi', 'hello', '', 'hi', ''], ['hi', 'hello']),
 ]
 
 days_since_epoch_cases = [
@@ -109,6 +162,120 @@ get_datetime_cases = [
                          datetime.date(2022, 1, 1)]),
 ]
 
+merge_ranges_cases = [
+    # Check that overlapping ranges are combined.
+    ([[datetime.date(2021, 1, 1), datetime.date(2021, 1, 10)],
+      [datetime.date(2021, 1, 5), datetime.date(2021, 1, 20)]],
+     [[datetime.date(2021, 1, 1), datetime.date(2021, 1, 20)]]),
+    # Check that back-to-back ranges are combined.
+    ([[datetime.date(2021, 1, 11), datetime.date(2021, 1, 20)],
+      [datetime.date(2021, 1, 1), datetime.date(2021, 1, 10)]],
+     [[datetime.date(2021, 1, 1), datetime.date(2021, 1, 20)]]),
+    # Check that ranges with a gap between them are kept separate.
+    ([[datetime.date(2021, 1, 1), datetime.date(2021, 1, 5)],
+      [datetime.date(2021, 1, 7), datetime.date(2021, 1, 9)]],
+     [[datetime.date(2021, 1, 1), datetime.date(2021, 1, 5)],
+      [datetime.date(2021, 1, 7), datetime.date(2021, 1, 9)]]),
+]
+
+missing_ranges_cases = [
+    # Check that a request with nothing cached is missing entirely.
+    ([], datetime.date(2021, 1, 1), datetime.date(2021, 1, 31),
+     [[datetime.date(2021, 1, 1), datetime.date(2021, 1, 31)]]),
+    # Check that a request inside a cached range is not missing anything.
+    ([[datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)]],
+     datetime.date(2021, 3, 1), datetime.date(2021, 4, 1), []),
+    # Check that only the head and tail around a cached range are missing.
+    ([[datetime.date(2021, 1, 10), datetime.date(2021, 1, 20)]],
+     datetime.date(2021, 1, 1), datetime.date(2021, 1, 31),
+     [[datetime.date(2021, 1, 1), datetime.date(2021, 1, 9)],
+      [datetime.date(2021, 1, 21), datetime.date(2021, 1, 31)]]),
+]
+
+plan_bar_batches_cases = [
+    # Check that ranges close together are requested together.
+    ([('AAPL', datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)),
+      ('TSLA', datetime.date(2021, 2, 1), datetime.date(2022, 1, 31))],
+     [(['AAPL', 'TSLA'], datetime.date(2021, 1, 1),
+       datetime.date(2022, 1, 31))]),
+    # Check that ranges too far apart are split into separate requests.
+    ([('AAPL', datetime.date(2018, 1, 1), datetime.date(2018, 12, 31)),
+      ('TSLA', datetime.date(2021, 1, 1), datetime.date(2021, 12, 31))],
+     [(['AAPL'], datetime.date(2018, 1, 1), datetime.date(2018, 12, 31)),
+      (['TSLA'], datetime.date(2021, 1, 1), datetime.date(2021, 12, 31))]),
+]
+
+
+class FakeBarsREST:
+    """
+    A stand-in for the Alpaca REST client that serves one bar per weekday
+    from the multi-symbol bars endpoint, a few bars per page. Symbols in
+    invalid never have any bars.
+    """
+
+    def __init__(self, page_size=3, invalid=()):
+        self.page_size = page_size
+        self.invalid = set(invalid)
+        self.requests = 0
+
+    def data_get(self, path, data=None, api_version='v1'):
+        """
+        Returns one page of fake bars in the format of the Alpaca API.
+        """
+        assert path == '/stocks/bars' and api_version == 'v2'
+        self.requests += 1
+        days = [day for day in
+                (datetime.date.fromisoformat(data['start']) +
+                 datetime.timedelta(days=offset) for offset in range(
+                     (datetime.date.fromisoformat(data['end']) -
+                      datetime.date.fromisoformat(data['start'])).days + 1))
+                if day.weekday() < 5]
+        rows = [(ticker, day) for ticker in data['symbols'].split(',')
+                if ticker not in self.invalid for day in days]
+        start = int(data.get('page_token') or 0)
+        page = rows[start:start + self.page_size]
+        bars = {}
+        for ticker, day in page:
+            bars.setdefault(ticker, []).append(
+                {'t': f'{day.isoformat()}T05:00:00Z', 'o': 1.0, 'h': 2.0,
+                 'l': 0.5, 'c': 1.5, 'v': 100, 'n': 10, 'vw': 1.2})
+        next_token = None
+        if start + self.page_size < len(rows):
+            next_token = str(start + self.page_size)
+        return {'bars': bars, 'next_page_token': next_token}
+
+
+series_returns_cases = [
+    # Check that a window covering the whole series uses the first and last
+    # closes.
+    ([10, 11, 14], [100.0, 90.0, 150.0], [10], [14], [50.0], [10], [14]),
+    # Check that a window starting on a weekend enters on the next bar and a
+    # window ending on a weekend exits on the bar before.
+    ([10, 11, 14, 15], [100.0, 50.0, 75.0, 80.0], [12], [13], [np.nan],
+     [-1], [-1]),
+    ([10, 11, 14, 15], [100.0, 50.0, 75.0, 80.0], [11, 9], [16, 11],
+     [60.0, -50.0], [11, 10], [15, 11]),
+]
+
+classify_text_cases = [
+    # Check that a post with tickers and long is fully classified.
+    ("Long $TSLA and $AAPL ", Classification(['TSLA', 'AAPL'], False, True,
+                                             False)),
+    # Check that scanning stops at a question mark.
+    ("Long $TSLA?", Classification([], True, False, False)),
+    # Check that scanning stops at the word short.
+    ("Long $TSLA, short $GME", Classification([], False, False, True)),
+    # Check that long is found right after a ticker.
+    ("$TSLong ", Classification(['TSL'], False, True, False)),
+]
+
+fill_calendar_days_cases = [
+    # Check that consecutive days are left alone.
+    ([10, 11, 12], [1.0, 2.0, 3.0], [10, 11, 12], [1.0, 2.0, 3.0]),
+    # Check that a weekend is filled with Friday's close.
+    ([4, 7, 8], [1.0, 2.0, 3.0], [4, 5, 6, 7, 8], [1.0, 1.0, 1.0, 2.0, 3.0]),
+]
+
 # Define additional testing lists and functions that check other properties of
 # functions in gene_finder.py.
 
@@ -124,6 +291,31 @@ def test_find_tickers(string, tickers):
     assert find_tickers(string) == tickers
 
 
+def test_ticker_matcher(tmp_path):
+    """
+    Check that bare tickers are only found when they are known symbols
+    written as whole words, that stopwords need a dollar sign, and that the
+    batch and single-string searches agree.
+    """
+    matcher = TickerMatcher(["TSLA", "AAPL", "AMD", "BRK.B", "NOW"])
+    string = "TSLA to the moon, NOW or never. $NOW and $GME, " \
+        "www.AMD.com, BRK.B TSLAQ xAAPL AAPL's"
+    tickers = ["TSLA", "NOW", "GME", "BRK.B", "AAPL"]
+    assert matcher.find_tickers(string) == tickers
+    assert find_tickers(string, matcher) == tickers
+    assert find_tickers(string) == ["NOW", "GME"]
+    texts = pd.Series([string, "no tickers", "long AMD"], index=[5, 6, 7])
+    assert matcher.find_series(texts).to_dict() == \
+        {5: tickers, 6: [], 7: ["AMD"]}
+
+    # The validated tickers in the ticker index are matched too
+    index = TickerIndex(str(tmp_path / "tickers.json"))
+    index.update({"GME": True, "ZZZZ": False})
+    matcher = load_matcher(index_path=index.path)
+    assert "GME" in matcher.symbols and "AAPL" in matcher.symbols
+    assert "ZZZZ" not in matcher.symbols and "IT" not in matcher.symbols
+
+
 @ pytest.mark.parametrize("string,boolean", find_qmarks_cases)
 def test_find_qmarks(string, boolean):
     """
@@ -227,3 +419,1142 @@ def test_get_datetime(start_date, time_period, dates):
         time_period: An integer of the number of days to pull data for.
     """
     assert get_datetime(start_date, time_period) == dates
+
+
+@ pytest.mark.parametrize("ranges,merged", merge_ranges_cases)
+def test_merge_ranges(ranges, merged):
+    """
+    Tests that overlapping and touching date ranges are combined.
+
+    Args:
+        ranges: A list of [start, end] pairs of datetime.date objects.
+    """
+    assert merge_ranges(ranges) == merged
+
+
+@ pytest.mark.parametrize("held,start_date,end_date,missing",
+                          missing_ranges_cases)
+def test_missing_ranges(held, start_date, end_date, missing):
+    """
+    Tests that only the parts of a request not already cached are returned.
+
+    Args:
+        held: A list of merged [start, end] pairs of datetime.date objects.
+        start_date: The first datetime.date of the request.
+        end_date: The last datetime.date of the request.
+    """
+    assert missing_ranges(held, start_date, end_date) == missing
+
+
+@ pytest.mark.parametrize("ranges,batches", plan_bar_batches_cases)
+def test_plan_bar_batches(ranges, batches):
+    """
+    Tests that per-ticker date ranges are grouped into multi-symbol requests.
+
+    Args:
+        ranges: A list of (ticker, start, end) tuples of date ranges.
+    """
+    assert plan_bar_batches(ranges, max_span_days=400) == batches
+
+
+def test_get_stock_info_batch(tmp_path):
+    """
+    Tests that batched jobs are paged through, split back out per ticker, and
+    served from the cache when they are requested a second time.
+    """
+    api = FakeBarsREST()
+    cache = BarCache(str(tmp_path))
+    jobs = [('AAPL', '2021-01-04', 4), ('TSLA', '2021-01-04', 2),
+            ('AAPL', '2021-01-06', 4)]
+
+    bars = get_stock_info_batch(jobs, api=api, cache=cache)
+    # Two tickers over Jan 4th-10th 2021 is ten weekday bars in four pages
+    assert api.requests == 4
+    assert sorted(bars) == ['AAPL', 'TSLA']
+    assert len(bars['AAPL']) == 5 and len(bars['TSLA']) == 3
+
+    get_stock_info_batch(jobs, api=api, cache=cache)
+    assert api.requests == 4
+
+
+def test_bar_cache_index(tmp_path, monkeypatch):
+    """
+    Tests that a batch download writes the range index once, that two caches
+    on the same folder keep each other's ranges, and that storing bars
+    leaves the caller's dataframe alone.
+    """
+    saves = []
+    save = BarCache.save
+    monkeypatch.setattr(BarCache, 'save',
+                        lambda self: saves.append(1) or save(self))
+    first = BarCache(str(tmp_path))
+    second = BarCache(str(tmp_path))
+    get_stock_info_batch([(ticker, '2021-01-04', 4) for ticker in
+                          ['AAPL', 'TSLA', 'GME']], api=FakeBarsREST(),
+                         cache=first)
+    assert len(saves) == 1
+
+    bars = pd.DataFrame({'close': [1.0]}, index=pd.DatetimeIndex(
+        ['2021-02-01'], tz='UTC', name='t'))
+    second.store('NKE', bars, datetime.date(2021, 2, 1),
+                 datetime.date(2021, 2, 1))
+    assert bars.index.name == 't'
+    assert sorted(BarCache(str(tmp_path)).ranges) == \
+        ['AAPL', 'GME', 'NKE', 'TSLA']
+
+
+def test_series_cache(tmp_path):
+    """
+    Tests that cached values are reused until their file changes or is
+    invalidated, that the least recently used values are dropped to stay
+    under the memory limit, and that callers cannot change cached values.
+    """
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        with open(path, "r") as file:
+            return np.full(100, float(file.read()))
+
+    paths = [str(tmp_path / f"{name}.txt") for name in "abc"]
+    for path in paths:
+        with open(path, "w") as file:
+            file.write("1")
+    cache = SeriesCache(max_bytes=2000)
+    first = cache.get("values", paths[0], load)
+    assert cache.get("values", paths[0], load)[0] == 1.0
+    assert len(loads) == 1
+    with pytest.raises(ValueError):
+        first[0] = 5.0
+
+    with open(paths[0], "w") as file:
+        file.write("22")
+    assert cache.get("values", paths[0], load)[0] == 22.0
+    cache.invalidate(paths[0])
+    cache.get("values", paths[0], load)
+    assert len(loads) == 3
+
+    # Each value takes 800 bytes, so only the two most recent are kept
+    cache.get("values", paths[1], load)
+    cache.get("values", paths[0], load)
+    cache.get("values", paths[2], load)
+    assert len(cache) == 2 and cache.nbytes <= 2000
+    cache.get("values", paths[0], load)
+    cache.get("values", paths[1], load)
+    assert loads[3:] == [paths[1], paths[2], paths[1]]
+
+    frame_path = tmp_path / "bars.csv"
+    write_bar_csv(frame_path, ['2021-01-04'], [10.0])
+    bars = cache.get("bars", str(frame_path), pd.read_csv)
+    bars['close'] = 0.0
+    assert list(cache.get("bars", str(frame_path), pd.read_csv)['close']) \
+        == [10.0]
+
+
+def test_run_pipeline(tmp_path):
+    """
+    Tests that stages run after the stages making their inputs, are skipped
+    while their inputs and outputs are unchanged, and that a failed stage
+    blocks the stages after it.
+    """
+    paths = {name: str(tmp_path / f"{name}.txt") for name in "abcde"}
+    with open(paths["a"], "w") as file:
+        file.write("a")
+
+    def copy(name, source, target):
+        return Stage(name, "shutil:copyfile", [paths[source]],
+                     [paths[target]], {"src": paths[source],
+                                       "dst": paths[target]})
+
+    stages = [copy("second", "b", "c"), copy("first", "a", "b"),
+              copy("other", "a", "d"), copy("broken", "e", "e")]
+    state_path = str(tmp_path / "state.json")
+    log = []
+    results = run_pipeline(stages, state_path, workers=2, log=log.append)
+    assert results == {"first": "ran", "second": "ran", "other": "ran",
+                       "broken": "failed"}
+    assert log.index("second               running") > \
+        log.index("first                done")
+    assert open(paths["c"]).read() == "a"
+
+    results = run_pipeline(stages[:3], state_path, log=log.append)
+    assert set(results.values()) == {"skipped"}
+    assert run_pipeline(stages[:3], state_path, dry_run=True,
+                        force=["first"], log=log.append)["second"] == "stale"
+
+    # Changing a stage's output reruns it, and so the stages after it
+    with open(paths["b"], "w") as file:
+        file.write("b")
+    results = run_pipeline(stages[:3], state_path, log=log.append)
+    assert results == {"first": "ran", "second": "ran", "other": "skipped"}
+
+    stages.append(Stage("after", "shutil:copyfile", [paths["e"]],
+                        [str(tmp_path / "f.txt")], {}))
+    assert run_pipeline(stages, state_path, log=log.append)["after"] == \
+        "blocked"
+
+
+def test_default_stage_dependencies():
+    """
+    Tests that every stage of the full analysis waits for the stages that
+    make the files it reads or is listed to run after, so the price plot
+    comes after the downloads.
+    """
+    assert stage_dependencies(default_stages()) == {
+        "reddit_data": set(),
+        "submission_store": {"reddit_data"},
+        "reddit_stock_info": {"submission_store"},
+        "overall_comparison": {"submission_store", "reddit_stock_info"},
+        "bar_graph": {"submission_store", "overall_comparison"},
+        "stock_data": {"bar_graph"},
+        "compare_plot": {"stock_data"},
+    }
+    # Every file the price plot reads is made by a stage
+    stages = {stage.name: stage for stage in default_stages()}
+    assert stages["compare_plot"].inputs == stages["stock_data"].outputs
+    # A stage reading a file inside a folder waits for the folder's writer
+    assert stage_dependencies([
+        Stage("write", "os:mkdir", [], ["data"], {}),
+        Stage("read", "os:stat", [os.path.join("data", "a.csv")], [], {}),
+    ])["read"] == {"write"}
+
+
+def test_intraday_store(tmp_path):
+    """
+    Tests that hour bars are downloaded a month at a time, saved compactly,
+    read back for only the dates asked for, and looked up as of a moment.
+    """
+    api = api_clients.FakeAlpaca()
+    store = IntradayStore(str(tmp_path), "1Hour")
+    get_intraday_info(['AAPL', 'TSLA'], '2021-01-28', 7, "1Hour", api, store)
+    assert api.requests == 2
+    get_intraday_info(['AAPL'], '2021-02-01', 3, "1Hour", api, store)
+    assert api.requests == 2
+
+    times, fields = store.read_month('AAPL', '2021-02')
+    assert fields['close'].dtype == np.float32
+    # Seven bars a day over the twenty weekdays of February 2021
+    assert len(times) == 140
+    bars = store.load('AAPL', datetime.date(2021, 1, 29),
+                      datetime.date(2021, 2, 1))
+    assert len(bars) == 14
+    assert str(bars.index[0]) == '2021-01-29 14:30:00+00:00'
+
+    moments = pd.to_datetime(['2021-01-29 15:00:01', '2021-01-29 21:00:00',
+                              '2021-04-01 00:00:00'], utc=True)
+    found = store.bars_after('AAPL', moments.as_unit('s').asi8)
+    assert [str(time) for time in found['timestamp']] == \
+        ['2021-01-29 15:30:00+00:00', '2021-02-01 14:30:00+00:00', 'NaT']
+    np.testing.assert_allclose(found['close'][:2],
+                               bars['close'].iloc[[1, 7]], rtol=1e-6)
+
+    assert is_complete('2021-02', datetime.date(2021, 3, 2))
+    assert not is_complete('2021-02', datetime.date(2021, 3, 1))
+
+
+def test_stream_returns(tmp_path):
+    """
+    Tests that the stream runs each stage's workers at once without letting
+    items pile up between stages, stops on an error, and finds the same
+    returns as computing every job at the end.
+    """
+    progress = {"pulled": 0, "done": 0, "ahead": 0, "busy": 0, "most": 0}
+
+    def source():
+        for item in range(30):
+            progress["pulled"] += 1
+            progress["ahead"] = max(progress["ahead"],
+                                    progress["pulled"] - progress["done"])
+            yield item
+
+    async def square(item):
+        progress["busy"] += 1
+        progress["most"] = max(progress["most"], progress["busy"])
+        await asyncio.sleep(0.001)
+        progress["busy"] -= 1
+        progress["done"] += 1
+        return [item * item]
+
+    async def split(item):
+        return [item, -item] if item % 2 else []
+
+    stages = [StreamStage("square", square, 3, 2),
+              StreamStage("split", split, 2, 2)]
+    assert sorted(run_stream(source(), stages)) == \
+        sorted(sign * item * item for item in range(1, 30, 2)
+               for sign in (1, -1))
+    assert progress["most"] == 3
+    # At most the queue, the workers, and the item waiting to be queued
+    assert progress["ahead"] <= 2 + 3 + 1
+
+    async def fail(item):
+        raise ValueError(item)
+
+    with pytest.raises(ValueError):
+        run_stream(range(10), [StreamStage("fail", fail, 2, 2)])
+
+    def posts(limit, after, before):
+        times = [str_create_timestamp("2021-01-04") + 3600 * hour
+                 for hour in range(4)]
+        texts = ["Long $AAPL and $FAKE", "Long $TSLA", "Is $GME a buy?",
+                 "Long $AAPL again"]
+        return [{"title": text, "selftext": "", "created_utc": time}
+                for text, time in zip(texts, times)]
+
+    api = api_clients.FakeAlpaca(invalid=["FAKE"])
+    cache = BarCache(str(tmp_path / "cache"))
+    index = TickerIndex(str(tmp_path / "tickers.json"))
+    results = stream_returns(10, "2021-01-01", "2021-02-01", 30, posts,
+                             api=api, index=index, cache=cache,
+                             workers={"fetch": 4}, queue_size=1)
+    assert list(results["ticker"]) == ["AAPL", "TSLA"]
+    assert index.lookup("FAKE") is False
+    expected = compute_returns(
+        [("AAPL", "2021-01-04", 30), ("TSLA", "2021-01-04", 30)],
+        functools.partial(load_close_series, cache=cache))
+    np.testing.assert_allclose(results["stock_roi"], expected["stock_roi"])
+    np.testing.assert_allclose(results["spy_roi"], expected["spy_roi"])
+    assert results["volatility"].notna().all()
+
+
+def test_api_backends(tmp_path):
+    """
+    Tests that clients are only made when first used, that the offline
+    backend refuses requests the cache cannot answer, and that recorded
+    responses are replayed without a client.
+    """
+    try:
+        api_clients.set_backend('offline')
+        cache = BarCache(str(tmp_path / 'cache'))
+        with pytest.raises(api_clients.OfflineError):
+            get_stock_info_batch([('AAPL', '2021-01-04', 4)], cache=cache)
+
+        api_clients.set_backend('fake')
+        assert api_clients.get_client('alpaca') is \
+            api_clients.get_client('alpaca')
+        bars = get_stock_info_batch([('AAPL', '2021-01-04', 4)],
+                                    cache=cache)
+        assert len(bars['AAPL']) == 5
+    finally:
+        api_clients.set_backend('real')
+
+    replay_dir = str(tmp_path / 'replay')
+    params = {'symbols': 'AAPL', 'start': '2021-01-04', 'end': '2021-01-05'}
+    recorder = api_clients.ReplayClient('alpaca', api_clients.FakeAlpaca(),
+                                        replay_dir)
+    recorded = recorder.data_get('/stocks/bars', data=params)
+    player = api_clients.ReplayClient('alpaca', None, replay_dir)
+    assert player.data_get('/stocks/bars', data=params) == recorded
+    with pytest.raises(api_clients.OfflineError):
+        player.data_get('/stocks/bars', data={'symbols': 'TSLA'})
+
+
+def test_ticker_index_ttl(tmp_path):
+    """
+    Tests that ticker index entries are saved to disk and expire after their
+    time to live.
+    """
+    index = TickerIndex(str(tmp_path / 'tickers.json'), ttl=100)
+    index.update({'AAPL': True, 'ZZZZ': False}, now=1000)
+
+    index = TickerIndex(str(tmp_path / 'tickers.json'), ttl=100)
+    assert index.lookup('AAPL', now=1050) is True
+    assert index.lookup('ZZZZ', now=1050) is False
+    assert index.lookup('AAPL', now=1101) is None
+    assert index.unknown(['AAPL', 'TSLA', 'TSLA'], now=1050) == ['TSLA']
+
+
+def test_validate_tickers(tmp_path):
+    """
+    Tests that unknown tickers are probed together once and then answered
+    from the ticker index.
+    """
+    api = FakeBarsREST(page_size=10, invalid=['ZZZZ'])
+    index = TickerIndex(str(tmp_path / 'tickers.json'))
+    tickers = ['AAPL', 'ZZZZ', 'TSLA', 'AAPL']
+
+    assert validate_tickers(tickers, api=api, index=index) == {
+        'AAPL': True, 'TSLA': True, 'ZZZZ': False}
+    assert api.requests == 1
+
+    validate_tickers(tickers, api=api, index=index)
+    assert api.requests == 1
+
+
+def test_rate_limiter_burst():
+    """
+    Tests that the rate limiter lets a burst through without waiting and only
+    waits once the bucket is empty.
+    """
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    limiter = RateLimiter(2, burst=3, clock=lambda: now[0], sleep=sleep)
+    assert [limiter.acquire() for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire() == 0.5
+    # After a long pause the bucket is full again, but no fuller
+    now[0] += 60
+    assert [limiter.acquire() for _ in range(3)] == [0, 0, 0]
+    assert waits == [0.5]
+
+
+class FakeHTTPError(Exception):
+    """
+    An exception carrying an HTTP status code, like alpaca_trade_api.APIError.
+    """
+
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+def test_call_with_backoff():
+    """
+    Tests that rate limited requests are retried and other errors are not.
+    """
+    set_rate_limit("test", 1000, burst=1000)
+    failures = [FakeHTTPError(429), FakeHTTPError(503)]
+
+    def flaky():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    assert call_with_backoff("test", flaky, sleep=lambda _: None) == "ok"
+
+    def not_found():
+        raise FakeHTTPError(404)
+
+    with pytest.raises(FakeHTTPError):
+        call_with_backoff("test", not_found, sleep=lambda _: None)
+
+
+def test_pushshift_client_rate_limit(monkeypatch):
+    """
+    Tests that every HTTP request pmaw makes for the Pushshift client waits
+    for the shared Pushshift rate limiter.
+    """
+    pmaw_base = pytest.importorskip("pmaw.PushshiftAPIBase")
+    response = collections.namedtuple("Response", "status_code reason text")
+    monkeypatch.setattr(pmaw_base.requests, "get", lambda url, params:
+                        response(200, "OK", '{"data": []}'))
+    waits = []
+    monkeypatch.setitem(rate_limiter._LIMITERS, "pushshift", RateLimiter(
+        1, burst=1, clock=lambda: 0.0, sleep=waits.append))
+
+    client = api_clients.make_pushshift_client()
+    for _ in range(3):
+        assert client._get("https://api.pushshift.io/") == []
+    assert waits == [1.0, 2.0]
+
+
+def test_instrumentation(tmp_path):
+    """
+    Tests that nothing is recorded while instrumentation is disabled, and
+    that nested spans, API calls, and retries are recorded while it is
+    enabled.
+    """
+    set_rate_limit("test", 1000, burst=1000)
+    failures = [FakeHTTPError(429)]
+
+    def flaky():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+
+    instrumentation.reset()
+    call_with_backoff("test", lambda: "ok")
+    assert instrumentation.report()['spans'] == []
+    assert instrumentation.report()['counters'] == {}
+
+    instrumentation.enable()
+    try:
+        with instrumentation.span("run"):
+            call_with_backoff("test", flaky, sleep=lambda _: None)
+            instrumentation.count_read(__file__, 3)
+    finally:
+        instrumentation.disable()
+    summary = instrumentation.report()
+    paths = {entry['path']: entry for entry in summary['spans']}
+    assert set(paths) == {'run', 'run;test.wait', 'run;test.request',
+                          'run;test.backoff'}
+    assert paths['run;test.request']['calls'] == 2
+    assert paths['run']['self_seconds'] <= paths['run']['total_seconds']
+    assert summary['counters']['api_calls.test'] == 2
+    assert summary['counters']['api_retries.test'] == 1
+    assert summary['counters']['rows_parsed'] == 3
+
+    instrumentation.write_report(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.folded", "r") as file:
+        assert len(file.read().splitlines()) == 4
+    instrumentation.reset()
+
+
+@ pytest.mark.parametrize(
+    "days,closes,start_days,end_days,roi,entry_days,exit_days",
+    series_returns_cases)
+def test_series_returns(days, closes, start_days, end_days, roi, entry_days,
+                        exit_days):
+    """
+    Tests that the entry and exit bars of each window are found and the
+    return between them is calculated.
+
+    Args:
+        days: A list of the epoch day of each bar.
+        closes: A list of the close of each bar.
+        start_days: A list of the epoch day each window starts on.
+        end_days: A list of the epoch day each window ends on.
+    """
+    result = series_returns(np.array(days), np.array(closes),
+                            np.array(start_days), np.array(end_days))
+    np.testing.assert_allclose(result[0], roi)
+    assert list(result[1]) == entry_days
+    assert list(result[2]) == exit_days
+
+
+def test_compute_returns():
+    """
+    Tests that each series is loaded once and the returns of the stock and
+    SPY over the same window are compared.
+    """
+    start = int(np.datetime64('2021-01-04', 'D').astype(np.int64))
+    series = {
+        'AAPL': (np.arange(start, start + 10), np.linspace(100, 109, 10)),
+        'SPY': (np.arange(start, start + 10), np.linspace(100, 104.5, 10)),
+    }
+    loaded = []
+
+    def load_series(ticker):
+        loaded.append(ticker)
+        return series.get(ticker, (np.array([], dtype=np.int64),
+                                   np.array([])))
+
+    returns = compute_returns([('AAPL', '2021-01-04', 9),
+                               ('ZZZZ', '2021-01-04', 9),
+                               ('AAPL', '2021-01-05', 1)], load_series)
+    assert sorted(loaded) == ['AAPL', 'SPY', 'ZZZZ']
+    np.testing.assert_allclose(returns['stock_roi'], [9.0, np.nan, 100 / 101])
+    np.testing.assert_allclose(returns['spy_roi'], [4.5, 4.5, 50 / 100.5])
+    np.testing.assert_allclose(returns['excess_return'],
+                               [4.5, np.nan, 100 / 101 - 50 / 100.5])
+
+
+def test_compute_risk_metrics():
+    """
+    Tests that the risk metrics of many windows found from running sums and
+    the drawdown tree match computing each window on its own.
+    """
+    np.testing.assert_allclose(
+        range_max_drawdowns(np.array([100, 120, 90, 110, 60, 80.0]),
+                            np.array([0, 1, 3, 2, 5]),
+                            np.array([5, 2, 5, 3, 5])),
+        [50.0, 25.0, 500 / 11, 0.0, 0.0])
+    # Full trees, where a range can end on the very last leaf
+    for length in [1, 2, 16]:
+        closes = 100 * np.exp(np.sin(np.arange(length, dtype=float)))
+        first, last = np.triu_indices(length)
+        expected = [100 * (1 - np.min(closes[a:b + 1] / np.maximum.accumulate(
+            closes[a:b + 1]))) for a, b in zip(first, last)]
+        np.testing.assert_allclose(range_max_drawdowns(closes, first, last),
+                                   expected, atol=1e-9)
+
+    rng = np.random.default_rng(0)
+    start = int(np.datetime64('2021-01-04', 'D').astype(np.int64))
+    days = np.sort(rng.choice(np.arange(start, start + 200), 140,
+                              replace=False))
+    stock = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, 140)))
+    # SPY only has a bar every fourth day, so its last close is carried over
+    spy = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, 50)))
+    series = {'SPY': (np.arange(start, start + 200, 4), spy),
+              'AAPL': (days, stock)}
+    jobs = [('AAPL', str(np.datetime64(start + offset, 'D')), period)
+            for offset in range(0, 150, 7) for period in [10, 45, 90]]
+    metrics = compute_risk_metrics(jobs, series.__getitem__,
+                                   risk_free_rate=0.02)
+
+    spy_days, spy_closes = series['SPY']
+    for job, row in zip(jobs, metrics.itertuples()):
+        first_day = np.datetime64(job[1], 'D').astype(np.int64)
+        inside = (days >= first_day) & (days <= first_day + job[2])
+        closes = stock[inside]
+        if len(closes) < 3:
+            assert np.isnan(row.volatility)
+            continue
+        daily = np.diff(closes) / closes[:-1]
+        excess = daily - 0.02 / 252
+        assert row.trading_days == len(closes)
+        np.testing.assert_allclose(
+            row.volatility, np.std(daily, ddof=1) * np.sqrt(252) * 100)
+        np.testing.assert_allclose(
+            row.sharpe, excess.mean() / np.std(daily, ddof=1) * np.sqrt(252))
+        np.testing.assert_allclose(
+            row.sortino, excess.mean() / np.sqrt(np.mean(
+                np.minimum(excess, 0) ** 2)) * np.sqrt(252))
+        np.testing.assert_allclose(
+            row.max_drawdown,
+            np.max(1 - closes / np.maximum.accumulate(closes)) * 100)
+
+        bench_index = np.searchsorted(spy_days, days[inside], 'right') - 1
+        bench = spy_closes[bench_index[bench_index >= 0]]
+        bench_daily = np.diff(bench) / bench[:-1]
+        paired = daily[len(daily) - len(bench_daily):]
+        if len(bench_daily) < 2 or np.var(bench_daily) == 0:
+            assert np.isnan(row.beta)
+            continue
+        covariance = np.cov(paired, bench_daily)
+        np.testing.assert_allclose(
+            row.beta, covariance[0, 1] / covariance[1, 1])
+        np.testing.assert_allclose(
+            row.correlation, np.corrcoef(paired, bench_daily)[0, 1])
+
+
+def test_results_ledger(tmp_path):
+    """
+    Tests that only new, unfinished, or repriced rows are recomputed, that
+    the running averages follow replaced and removed rows, and that the
+    ledger survives being saved and loaded.
+    """
+    def make_jobs(rows):
+        return pd.DataFrame(rows, columns=['submission', 'ticker', 'period',
+                                           'date'])
+
+    def make_results(stock_rois, spy_rois):
+        return pd.DataFrame({'entry_date': '', 'exit_date': '',
+                             'stock_roi': stock_rois, 'spy_roi': spy_rois,
+                             'excess_return': 0.0})
+
+    today = datetime.date(2022, 6, 1)
+    path = str(tmp_path / "ledger.csv")
+    ledger = ResultsLedger(path)
+    jobs = make_jobs([('a', 'AAPL', 365, '2020-01-02'),
+                      ('b', 'TSLA', 365, '2021-12-01')])
+    prints = ['1:10', '2:20']
+    assert list(ledger.needs_update(jobs, prints)) == [True, True]
+    ledger.update(jobs, make_results([10.0, np.nan], [5.0, 3.0]), prints,
+                  today)
+    assert ledger.averages() == (10.0, 4.0)
+    ledger.save()
+
+    ledger = ResultsLedger(path)
+    jobs = make_jobs([('a', 'AAPL', 365, '2020-01-02'),
+                      ('b', 'TSLA', 365, '2021-12-01'),
+                      ('c', 'NVDA', 365, '2020-03-02')])
+    prints.append('3:30')
+    # b's year has not ended yet and c is new
+    pending = ledger.needs_update(jobs, prints)
+    assert list(pending) == [False, True, True]
+    ledger.update(jobs[pending], make_results([20.0, 30.0], [1.0, 2.0]),
+                  prints[1:], today)
+    assert ledger.averages() == (20.0, 8 / 3)
+
+    prints[0] = '4:10'
+    assert list(ledger.needs_update(jobs, prints)) == [True, True, False]
+    ledger.keep_only(jobs[jobs['submission'] != 'b'])
+    assert ledger.averages() == (20.0, 3.5)
+    ledger.save()
+
+    # The running sums are rebuilt from the rows if their file is lost
+    os.remove(ledger.sums_path)
+    assert ResultsLedger(path).averages() == (20.0, 3.5)
+
+    # Only new prices inside a window, the ticker's or SPY's, change its
+    # fingerprint
+    start = int(np.datetime64('2021-01-04', 'D').astype(np.int64))
+    series = {'AAPL': (np.arange(start, start + 30), np.arange(30.0) + 1),
+              'SPY': (np.arange(start, start + 30), np.arange(30.0) + 2)}
+    windows = [('AAPL', '2021-01-04', 10), ('AAPL', '2021-01-24', 10)]
+    before = window_fingerprints(windows, series.__getitem__)
+    series['SPY'] = (np.arange(start, start + 40), np.arange(40.0) + 2)
+    after = window_fingerprints(windows, series.__getitem__)
+    assert after[0] == before[0] and after[1] != before[1]
+    series['AAPL'][1][5] = 100.0
+    assert window_fingerprints(windows, series.__getitem__)[0] != after[0]
+
+
+def write_bar_csv(path, dates, closes):
+    """
+    Writes a CSV file laid out like the ones made by get_stock_info.
+
+    Args:
+        path: The path to write the file to.
+        dates: A list of date strings in the format YYYY-MM-DD.
+        closes: A list of the close on each date.
+    """
+    lines = ["timestamp,open,high,low,close,volume,trade_count,vwap"]
+    lines += [f"{date} 05:00:00+00:00,1,1,1,{close},100,10,1"
+              for date, close in zip(dates, closes)]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def test_build_panel(tmp_path):
+    """
+    Tests that the price panel lines tickers up on a shared date axis and
+    only picks up files that changed when it is rebuilt.
+    """
+    data_dir = tmp_path / 'data'
+    panel_dir = str(tmp_path / 'panel')
+    data_dir.mkdir()
+    write_bar_csv(data_dir / 'AAPLdata.csv', ['2021-01-04', '2021-01-05'],
+                  [10, 11])
+    write_bar_csv(data_dir / 'TSLAdata.csv', ['2021-01-05', '2021-01-06'],
+                  [20, 21])
+
+    panel = build_panel(str(data_dir), panel_dir)
+    assert panel.tickers == ['AAPL', 'TSLA']
+    assert len(panel.days) == 3
+    assert list(panel.series('TSLA')[1]) == [20, 21]
+
+    write_bar_csv(data_dir / 'AAPLdata.csv', ['2021-01-07'], [12])
+    build_panel(str(data_dir), panel_dir)
+    panel = load_panel(panel_dir)
+    assert len(panel.days) == 4
+    assert list(panel.series('AAPL')[1]) == [12]
+    assert list(panel.series('TSLA')[1]) == [20, 21]
+    assert list(read_bars('TSLA', panel, str(data_dir))['close']) == [20, 21]
+
+
+FAKE_POSTS = [
+    {'title': 'Long $TSLA', 'selftext': '', 'created_utc': 1514782900},
+    {'title': 'Is $AAPL long worth it?', 'selftext': '',
+     'created_utc': 1514782901},
+    {'title': 'Going long $AMD and $TSLA', 'selftext': '',
+     'created_utc': 1514782902},
+    {'title': 'Long $NVDA', 'selftext': 'short $GME',
+     'created_utc': 1514782903},
+    {'title': 'Long $GME', 'selftext': '', 'created_utc': 1514782904},
+    {'title': 'Long $PLTR', 'selftext': '', 'created_utc': 1514782905},
+]
+
+
+def test_run_sweep(tmp_path):
+    """
+    Tests that each grid cell averages the returns of the recommendations
+    its filter keeps, and leaves out windows past the end of the data.
+    """
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    dates = ['2021-01-04', '2021-01-05', '2021-01-06', '2021-01-07',
+             '2021-01-08']
+    write_bar_csv(cache_dir / 'AAPL.csv', dates, [100, 110, 120, 130, 140])
+    write_bar_csv(cache_dir / 'TSLA.csv', dates, [50, 50, 40, 40, 40])
+    write_bar_csv(cache_dir / 'SPY.csv', dates, [100, 101, 102, 103, 104])
+    cache = BarCache(str(cache_dir))
+    for ticker in ['AAPL', 'TSLA', 'SPY']:
+        cache.ranges[ticker] = [[datetime.date(2021, 1, 4),
+                                 datetime.date(2021, 1, 8)]]
+    submissions = pd.DataFrame({
+        'title': ['Long $AAPL', 'Long $TSLA and $GME'],
+        'time': pd.to_datetime(['2021-01-04 10:00:00',
+                                '2021-01-04 11:00:00']),
+        'tickers': [['AAPL'], ['TSLA', 'GME']]})
+
+    results = run_sweep(submissions, hold_days=[1, 4, 30],
+                        filters=['all', 'single_ticker'], cache=cache,
+                        workers=2, download=False)
+    assert list(results['filter']) == ['all'] * 3 + ['single_ticker'] * 3
+    assert list(results['hold_days']) == [1, 4, 30] * 2
+    assert list(results['count']) == [2, 2, 0, 1, 1, 0]
+    # GME has no prices at all, and the 30 day windows run past the data
+    assert list(results['dropped']) == [1, 1, 3, 0, 0, 1]
+    np.testing.assert_allclose(results['mean_excess_return'],
+                               [4, 6, np.nan, 9, 36, np.nan])
+    np.testing.assert_allclose(results['std_excess_return'],
+                               [5, 30, np.nan, 0, 0, np.nan])
+    np.testing.assert_allclose(results['hit_rate'],
+                               [0.5, 0.5, np.nan, 1, 1, np.nan])
+
+    # Windows longer than anything stored are downloaded first
+    api = api_clients.FakeAlpaca(invalid=['GME'])
+    results = run_sweep(submissions, hold_days=[30, 400], cache=cache,
+                        workers=1, api=api)
+    assert list(results['count']) == [2, 2]
+    assert list(results['dropped']) == [1, 1]
+
+
+def fake_posts(crash_after=None, calls=None):
+    """
+    Makes a stand-in for stream_raw_posts that serves FAKE_POSTS and can
+    raise an error partway through to simulate a crash.
+
+    Args:
+        crash_after: The number of posts to yield before raising, or None to
+        never raise.
+        calls: A list that the (limit, after, before) arguments of each call
+        are appended to.
+    """
+    def posts(limit, after, before):
+        if calls is not None:
+            calls.append((limit, after, before))
+        served = 0
+        for post in FAKE_POSTS:
+            if after < post['created_utc'] < before and served < limit:
+                if served == crash_after:
+                    raise ConnectionError("lost connection")
+                served += 1
+                yield post
+    return posts
+
+
+def test_get_filtered_reddit_data_resume(tmp_path):
+    """
+    Tests that a pull that crashes partway through resumes from its
+    checkpoint and writes the same output as a pull that never crashed.
+    """
+    clean_path = str(tmp_path / 'clean.csv')
+    get_filtered_reddit_data(100, '2018-01-01', '2018-01-02', clean_path,
+                             chunk_size=2, posts=fake_posts())
+
+    resumed_path = str(tmp_path / 'resumed.csv')
+    with pytest.raises(ConnectionError):
+        get_filtered_reddit_data(100, '2018-01-01', '2018-01-02',
+                                 resumed_path, chunk_size=2,
+                                 posts=fake_posts(crash_after=5))
+    calls = []
+    get_filtered_reddit_data(100, '2018-01-01', '2018-01-02', resumed_path,
+                             chunk_size=2, posts=fake_posts(calls=calls))
+    # The last checkpoint was saved after the first four posts
+    assert calls[0][:2] == (96, 1514782903)
+
+    with open(clean_path) as clean, open(resumed_path) as resumed:
+        assert clean.read() == resumed.read()
+    with open(clean_path) as clean:
+        assert "['AMD']" in clean.read()
+
+
+def test_get_filtered_reddit_data_rerun(tmp_path):
+    """
+    Tests that pulling again over an old output replaces it, header and all.
+    """
+    output_path = str(tmp_path / 'filtered.csv')
+    get_filtered_reddit_data(100, '2018-01-01', '2018-01-02', output_path,
+                             chunk_size=2, posts=fake_posts())
+    with open(output_path) as output:
+        first = output.read()
+    get_filtered_reddit_data(100, '2018-01-01', '2018-01-02', output_path,
+                             chunk_size=2, posts=fake_posts())
+    with open(output_path) as output:
+        assert output.read() == first
+    assert first.startswith(',title,selftext,time,tickers')
+
+
+def test_split_window():
+    """
+    Tests that the shards of a window cover every second in it exactly once
+    when both ends of each shard are exclusive.
+    """
+    shards = split_window(100, 125, 10)
+    assert shards == [(100, 110), (109, 119), (118, 125)]
+    covered = [second for after, before in shards
+               for second in range(after + 1, before)]
+    assert covered == list(range(101, 125))
+
+
+class CountingPushshift(api_clients.FakePushshift):
+    """
+    A stand-in for the Pushshift client that counts the posts it serves.
+    """
+
+    def __init__(self, posts=()):
+        super().__init__(posts)
+        self.served = 0
+
+    def search_submissions(self, **kwargs):
+        """
+        Returns the posts FakePushshift would, counting them.
+        """
+        posts = super().search_submissions(**kwargs)
+        self.served += len(posts)
+        return posts
+
+
+def test_stream_sharded_posts():
+    """
+    Tests that posts pulled from many shards at once come out in time order
+    with duplicates removed and the limit applied.
+    """
+    posts = [{'id': f'p{second}', 'title': f'Long ${second}',
+              'selftext': '', 'created_utc': second}
+             for second in range(1000, 1100, 3)]
+    # Pushshift sometimes returns the same post twice, out of order
+    served = posts[::-1] + posts[10:12]
+    client = api_clients.FakePushshift(served)
+    pulled = list(stream_sharded_posts('wallstreetbets', 1000, 999, 1100,
+                                       shard_seconds=7, workers=3,
+                                       client=client))
+    assert [post['id'] for post in pulled] == [post['id'] for post in posts]
+    limited = list(stream_sharded_posts('wallstreetbets', 5, 999, 1100,
+                                        shard_seconds=7, workers=3,
+                                        client=client))
+    assert limited == pulled[:5]
+
+    # Shards after the limit is reached are not pulled at all
+    client = CountingPushshift(
+        {'id': f'd{second}', 'title': '', 'selftext': '',
+         'created_utc': second} for second in range(1000))
+    assert len(list(stream_sharded_posts('wallstreetbets', 5, 0, 1000,
+                                         shard_seconds=100, workers=2,
+                                         client=client))) == 5
+    assert client.served == 2 * 5
+
+
+class WideFakePushshift:
+    """
+    A stand-in for the Pushshift client that makes up one post per second,
+    each with a large field we never use, and records the fields asked for.
+    """
+
+    def __init__(self):
+        self.fields = []
+
+    def search_submissions(self, subreddit=None, limit=None, before=None,
+                           after=None, filter=None):
+        """
+        Yields made-up posts strictly between after and before.
+        """
+        self.fields.append(filter)
+        for second in range(after + 1, min(before, after + 1 + limit)):
+            yield {'id': str(second), 'title': 'Long $TSLA', 'selftext': '',
+                   'created_utc': second, 'preview': 'x' * 2000}
+
+
+def test_stream_raw_posts_memory():
+    """
+    Tests that streaming only asks for the fields we use and only holds one
+    time slice of posts in memory, however many posts are pulled.
+    """
+    client = WideFakePushshift()
+    api_clients.set_client("pushshift", client)
+    tracemalloc.start()
+    try:
+        pulled = 0
+        for post in stream_raw_posts('wallstreetbets', 20000, 0, 10 ** 6,
+                                     slice_seconds=200):
+            assert post['title'] == 'Long $TSLA'
+            pulled += 1
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        api_clients.set_client("pushshift", None)
+    assert pulled == 20000
+    assert client.fields[0] == ['id', 'title', 'selftext', 'created_utc']
+    # Keeping every post would take over 3 MB even without the large field
+    assert peak < 2 ** 20
+
+
+def test_stream_raw_posts_short_window():
+    """
+    Tests that streaming stops at the end of the window when it holds fewer
+    posts than the limit.
+    """
+    client = CountingPushshift(
+        {'id': f'p{second}', 'title': 'Long $TSLA', 'selftext': '',
+         'created_utc': second} for second in range(1000, 1100, 7))
+    windows = []
+    search = client.search_submissions
+
+    def search_submissions(**kwargs):
+        windows.append((kwargs['after'], kwargs['before']))
+        if len(windows) > 100:
+            raise RuntimeError("the window was never finished")
+        return search(**kwargs)
+    client.search_submissions = search_submissions
+    api_clients.set_client("pushshift", client)
+    try:
+        pulled = list(stream_raw_posts('wallstreetbets', 1000, 999, 1100,
+                                       slice_seconds=30))
+    finally:
+        api_clients.set_client("pushshift", None)
+    assert [post['created_utc'] for post in pulled] == \
+        list(range(1000, 1100, 7))
+    assert windows == [(999, 1029), (1028, 1058), (1057, 1087),
+                       (1086, 1100)]
+
+
+def test_submission_fields():
+    """
+    Tests that submissions can be read by field name like a dictionary, but
+    tuple methods are not mistaken for fields.
+    """
+    post = Submission('p1', 'Long $TSLA', '', 1000)
+    assert post['title'] == 'Long $TSLA' and post[3] == 1000
+    assert post.get('created_utc') == 1000
+    assert post.get('count') is None and post.get('score', 0) == 0
+    with pytest.raises(KeyError):
+        post['index']
+
+
+def test_submission_store(tmp_path):
+    """
+    Tests that the submission store sorts posts by time, turns the ticker
+    strings into lists, answers ticker and date range queries from its
+    indexes, and is only rebuilt when the CSV file changes.
+    """
+    csv_path = str(tmp_path / 'subs.csv')
+    pd.DataFrame({
+        'title': ['Long $TSLA', 'Long $AMD and $TSLA', 'Long $GME'],
+        'selftext': ['', 'to the moon', ''],
+        'time': ['2021-03-05 10:00:00', '2021-02-27 09:00:00',
+                 '2021-03-20 12:00:00'],
+        'tickers': ["['TSLA']", "['AMD', 'TSLA']", "['GME']"],
+    }).to_csv(csv_path)
+
+    store = build_store(csv_path, str(tmp_path / 'store'))
+    assert store.symbols == ['AMD', 'GME', 'TSLA']
+    frame = store.frame(['title', 'time', 'tickers'])
+    assert list(frame['title']) == ['Long $AMD and $TSLA', 'Long $TSLA',
+                                    'Long $GME']
+    assert list(frame['tickers']) == [['AMD', 'TSLA'], ['TSLA'], ['GME']]
+    assert frame['time'].dtype.kind == 'M'
+    assert list(store.rows_mentioning('TSLA')) == [0, 1]
+    assert list(store.rows_mentioning('TSLA', '2021-03-01',
+                                      '2021-04-01')) == [1]
+    assert list(store.rows_mentioning('AAPL')) == []
+    assert list(store.rows_between('2021-03-01', '2021-04-01')) == [1, 2]
+    assert list(store.exploded()['ticker']) == ['AMD', 'TSLA', 'TSLA', 'GME']
+    assert store.text('selftext', [0]) == ['to the moon']
+    assert build_store(csv_path, str(tmp_path / 'store')).source == \
+        store.source
+
+
+@ pytest.mark.parametrize("string,classification", classify_text_cases)
+def test_classify_text(string, classification):
+    """
+    Tests that tickers and the question, long and short flags are found in
+    one call.
+
+    Args:
+        string: A string representing the body or title of a Reddit post.
+    """
+    assert classify_text(string) == classification
+
+
+def test_classify_series():
+    """
+    Tests that the batch classifier accepts the same posts as the original
+    four separate searches.
+    """
+    texts = ["Long $TSLA ", "Long $TSLA?", "long $A, short $B ", "$X long",
+             "Long stocks ", "going long $AMD and $NVDA "]
+    result = classify_series(pd.Series(texts))
+    expected = [bool(find_tickers(text)) and not find_qmarks(text) and
+                find_long(text) and not find_short(text) for text in texts]
+    assert list(result['accepted']) == expected
+    assert result['tickers'][5] == ['AMD', 'NVDA']
+
+
+def test_symbol_set():
+    """
+    Tests that symbols get stable IDs and that symbol sets track membership
+    independently of each other.
+    """
+    registry = SymbolRegistry()
+    assert registry.intern('SPY') == 0
+    assert registry.intern('TSLA') == 1
+    assert registry.intern('SPY') == 0
+    assert registry.lookup('AAPL') is None
+
+    seen = SymbolSet(['SPY'], registry)
+    other = SymbolSet(['AAPL'], registry)
+    assert seen.add('TSLA') is True
+    assert seen.add('TSLA') is False
+    assert 'TSLA' in seen and 'AAPL' not in seen and 'GME' not in seen
+    assert 'AAPL' in other and 'TSLA' not in other
+    assert len(seen) == 2
+    assert seen.to_list() == ['SPY', 'TSLA']
+
+    # A registry that starts out empty is still the one used
+    empty = SymbolRegistry()
+    assert SymbolSet(['GME'], empty).registry is empty
+    assert empty.lookup('GME') == 0
+
+
+def test_load_snp500():
+    """
+    Tests that the S&P 500 list loads with its first symbol intact.
+    """
+    snp_tickers = load_snp500()
+    assert 'MMM' in snp_tickers and 'AAPL' in snp_tickers
+    assert len(snp_tickers) > 500
+
+
+@ pytest.mark.parametrize("bar_days,closes,days,filled_closes",
+                          fill_calendar_days_cases)
+def test_fill_calendar_days(bar_days, closes, days, filled_closes):
+    """
+    Tests that days without bars are filled with the previous close.
+
+    Args:
+        bar_days: A list of the epoch day of each bar.
+        closes: A list of the close of each bar.
+    """
+    result = fill_calendar_days(np.array(bar_days), np.array(closes))
+    assert list(result[0]) == days
+    assert list(result[1]) == filled_closes
+
+
+def test_prepare_color_plot():
+    """
+    Tests that the color plot segments join each filled day to the next and
+    that their slopes give the change in price.
+    """
+    days, closes, segments, slopes = prepare_color_plot(
+        ['1970-01-02 05:00:00+00:00', '1970-01-05 05:00:00+00:00'],
+        [10.0, 12.0])
+    assert list(days) == [1, 2, 3, 4]
+    assert segments.shape == (3, 2, 2)
+    assert segments[2].tolist() == [[3, 10.0], [4, 12.0]]
+    assert list(slopes) == [0.0, 0.0, 2.0]
+
+
+def test_render_charts(tmp_path, capsys):
+    """
+    Tests that charts are saved headlessly and only redrawn when their data
+    changes.
+    """
+    data_dir = tmp_path / 'data'
+    output_dir = str(tmp_path / 'charts')
+    data_dir.mkdir()
+    write_bar_csv(data_dir / 'AAPLdata.csv', ['2021-01-04', '2021-01-08'],
+                  [10, 11])
+    write_bar_csv(data_dir / 'TSLAdata.csv', ['2021-01-05', '2021-01-06'],
+                  [20, 19])
+
+    drawn = render_charts(data_dir=str(data_dir), output_dir=output_dir,
+                          workers=1)
+    assert sorted(os.path.basename(path) for path in drawn) == \
+        ['AAPL.png', 'TSLA.png']
+    assert render_charts(data_dir=str(data_dir), output_dir=output_dir,
+                         workers=1) == []
+
+    write_bar_csv(data_dir / 'TSLAdata.csv', ['2021-01-05', '2021-01-07'],
+                  [20, 21])
+    drawn = render_charts(data_dir=str(data_dir), output_dir=output_dir,
+                          workers=1)
+    assert [os.path.basename(path) for path in drawn] == ['TSLA.png']
+
+    # Tickers without a data file are skipped without stopping the rest
+    drawn = render_charts(['GME', 'AAPL'], data_dir=str(data_dir),
+                          output_dir=output_dir, workers=1, force=True)
+    assert [os.path.basename(path) for path in drawn] == ['AAPL.png']
+    assert "No data to plot for GME" in capsys.readouterr().out
+
+
+def test_bench_suite():
+    """
+    Tests that every benchmark runs offline at a tiny scale and that only
+    measurements worse than the baseline by more than the tolerance are
+    reported as regressions.
+    """
+    results = {'tiny': run_suite({'posts': 50, 'tickers': 3})}
+    assert all(measurements['seconds'] >= 0 and measurements['peak_mb'] >= 0
+               for measurements in results['tiny'].values())
+
+    baseline = {'tiny': {'fetch_bars': {'seconds': 1.0, 'peak_mb': 10.0}}}
+    current = {'tiny': {'fetch_bars': {'seconds': 1.1, 'peak_mb': 13.0},
+                        'remove_dupes': {'seconds': 5.0, 'peak_mb': 1.0}}}
+    assert compare_to_baseline(current, baseline, tolerance=0.2) == \
+        [('tiny', 'fetch_bars', 'peak_mb', 10.0, 13.0)]